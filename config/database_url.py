@@ -14,4 +14,8 @@ DB_NAME = os.getenv("POSTGRESQL_DBNAME")
 STOCKS_DB_NAME = os.getenv("POSTGRESQL_STOCKS_DBNAME")
 
 DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
-STOCKS_DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{STOCKS_DB_NAME}"
\ No newline at end of file
+STOCKS_DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{STOCKS_DB_NAME}"
+
+# asyncpg-backed URLs for the async engines used by the API routes
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
+ASYNC_STOCKS_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{STOCKS_DB_NAME}"
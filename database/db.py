@@ -1,13 +1,18 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from database.models.thesisai import Base
-from config.database_url import DATABASE_URL
-from contextlib import contextmanager
+from config.database_url import DATABASE_URL, ASYNC_DATABASE_URL
+from contextlib import contextmanager, asynccontextmanager
 
 # Create the Engine and session factory
 engine = create_engine(DATABASE_URL, pool_pre_ping=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine and session factory for the API routes, so reads don't occupy a thread each
+async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_pre_ping=True)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 # Create Tables if they don't exist
 Base.metadata.create_all(bind=engine)
 
@@ -22,3 +27,15 @@ def session_scope():
         raise
     finally:
         session.close()
+
+@asynccontextmanager
+async def async_session_scope():
+    session = AsyncSessionLocal()
+    try:
+        yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
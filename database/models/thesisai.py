@@ -1,7 +1,7 @@
-from sqlalchemy import Text, Column, Integer, String, DateTime, Boolean, ForeignKey, CheckConstraint, Float
+from sqlalchemy import Text, Column, Integer, String, DateTime, Boolean, ForeignKey, CheckConstraint, Float, Index, func
 from sqlalchemy.orm import  relationship
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 
 Base = declarative_base()
 
@@ -26,6 +26,9 @@ class Ticker(Base):
     def __repr__(self):
         return f"<Ticker(id{self.id}, symbol{self.symbol}', name='{self.name}')>"
 
+# Tickers are always looked up case-insensitively, so index lower(symbol) instead of the raw column
+ticker_symbol_lower_index = Index("ix_tickers_symbol_lower", func.lower(Ticker.symbol))
+
 class Post(Base):
     __tablename__ = "posts"
     id = Column(Integer, primary_key=True)
@@ -45,6 +48,9 @@ class Post(Base):
 
     def __repr__(self):
         return f"<Post(id{self.id}, source='{self.source}', title='{self.title}')>"
+
+# The refresh scheduler counts the recent posts of every ticker to rank them by activity
+post_date_index = Index("ix_posts_date_of_post", Post.date_of_post)
     
 class Point(Base):
     __tablename__ = "points"
@@ -104,3 +110,24 @@ class Comment(Base):
     def __repr__(self):
         return f"<Comment(id={self.id}, post_id={self.post_id}, author='{self.author}'>"
 
+class AnalysisRun(Base):
+    """Telemetry of one run of an analysis, see routers/analysis/telemetry.py."""
+    __tablename__ = "analysis_runs"
+    id = Column(Integer, primary_key=True)
+    task_id = Column(String(36), nullable=False, index=True)
+    ticker_id = Column(Integer, ForeignKey("tickers.id", ondelete="SET NULL"), nullable=True, index=True)
+    ticker_symbol = Column(String(10), nullable=False)
+    status = Column(String(20), nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=False)
+    duration_seconds = Column(Float, nullable=False)
+    # {stage: seconds}, {item: count} and {stage: failures}
+    stage_seconds = Column(JSONB, nullable=False, default=dict)
+    item_counts = Column(JSONB, nullable=False, default=dict)
+    failures = Column(JSONB, nullable=False, default=dict)
+    input_tokens = Column(Integer, nullable=False, default=0)
+    output_tokens = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+
+    def __repr__(self):
+        return f"<AnalysisRun(id={self.id}, task_id='{self.task_id}', status='{self.status}')>"
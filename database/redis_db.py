@@ -0,0 +1,34 @@
+import os
+import redis
+import redis.asyncio as async_redis
+from dotenv import load_dotenv
+
+ENV_PATH = os.getenv("ENV_PATH")
+load_dotenv(ENV_PATH)
+
+# REDIS_URL (e.g. redis://:password@host:6379/0 or rediss:// for TLS) takes precedence over the single settings
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_SETTINGS = {
+    "host": os.getenv("REDIS_HOST", "localhost"),
+    "port": int(os.getenv("REDIS_PORT", 6379)),
+    "db": int(os.getenv("REDIS_DB", 0)),
+    "password": os.getenv("REDIS_PASSWORD") or None,
+}
+# Connections per client and process, unlimited unless set
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS")) if os.getenv("REDIS_MAX_CONNECTIONS") else None
+# Seconds to wait for a connection to Redis before failing, instead of hanging while it is down
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT", 5))
+
+
+def create_redis_client(client_class):
+    options = {"max_connections": REDIS_MAX_CONNECTIONS, "socket_connect_timeout": REDIS_SOCKET_CONNECT_TIMEOUT}
+    if REDIS_URL:
+        return client_class.from_url(REDIS_URL, **options)
+    return client_class(**REDIS_SETTINGS, **options)
+
+
+# Set up a connection to Redis.
+redis_client = create_redis_client(redis.Redis)
+
+# Async client for code running on the event loop (API routes), so Redis calls don't block it.
+async_redis_client = create_redis_client(async_redis.Redis)
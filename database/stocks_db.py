@@ -1,13 +1,18 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from database.models.stock_index import Base
-from config.database_url import STOCKS_DATABASE_URL
-from contextlib import contextmanager
+from config.database_url import STOCKS_DATABASE_URL, ASYNC_STOCKS_DATABASE_URL
+from contextlib import contextmanager, asynccontextmanager
 
 # Create the Engine and session factory
 engine = create_engine(STOCKS_DATABASE_URL, pool_pre_ping=True)
 StockIndexSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine and session factory for the API routes, so reads don't occupy a thread each
+async_engine = create_async_engine(ASYNC_STOCKS_DATABASE_URL, pool_pre_ping=True)
+AsyncStockIndexSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 # Create Tables if they don't exist
 Base.metadata.create_all(bind=engine)
 
@@ -22,3 +27,15 @@ def stockindex_session_scope():
         raise
     finally:
         session.close()
+
+@asynccontextmanager
+async def async_stockindex_session_scope():
+    session = AsyncStockIndexSessionLocal()
+    try:
+        yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
@@ -1,4 +1,4 @@
-from database.models.thesisai import Base
+from database.models.thesisai import Base, ticker_symbol_lower_index, post_date_index
 from sqlalchemy_utils import database_exists, create_database
 from config.database_url import DATABASE_URL, DB_NAME
 from sqlalchemy import text
@@ -27,6 +27,14 @@ def create_tables():
     except Exception as e:
         print(f"Error creating tables: {e}")
 
+    # create_all only creates indexes together with new tables, so indexes added later are created separately
+    try:
+        ticker_symbol_lower_index.create(engine, checkfirst=True)
+        post_date_index.create(engine, checkfirst=True)
+        print("All Indexes created successfully (if not already present)\n")
+    except Exception as e:
+        print(f"Error creating indexes: {e}")
+
 
 if __name__ == "__main__":
     print(f"DATABASE_URL: {DATABASE_URL}")
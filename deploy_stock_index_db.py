@@ -1,79 +1,201 @@
-from sqlalchemy import text, Index
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import text, Index, func
 import os
+import csv
+import io
+import ijson
 from sqlalchemy_utils import database_exists, create_database
-import json
 from database.models.stock_index import metadata, stocks_table
 from config.database_url import STOCKS_DATABASE_URL, STOCKS_DB_NAME
+from routers.stock_search.search_index import bump_stock_index_version
+from routers.stock_search.query_cache import clear_stock_query_cache
+
+"""
+The stocks table is updated incrementally: the JSON file is stream-parsed and copied into a temporary
+staging table with COPY, then merged into stocks in a single transaction (delete missing tickers,
+update changed titles, insert new tickers). Searches keep seeing the old rows until the merge commits,
+so /stock-query never comes back empty during a redeploy.
+"""
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 JSON_DATA_PATH = os.path.join(BASE_DIR, "./data/sec_tickers.json")
 # Define trigram indexes
+# GiST (unlike GIN) supports ordering by trigram distance (<->), so the search can read the nearest rows straight from the index
 idx_ticker_trgm = Index(
-    "idx_stocks_ticker_trgm",
+    "idx_stocks_ticker_trgm_gist",
     stocks_table.c.ticker,
-    postgresql_using="gin",
-    postgresql_ops={"ticker": "gin_trgm_ops"}
+    postgresql_using="gist",
+    postgresql_ops={"ticker": "gist_trgm_ops"}
 )
 
 idx_title_trgm = Index(
-    "idx_stocks_title_trgm",
+    "idx_stocks_title_trgm_gist",
     stocks_table.c.title,
-    postgresql_using="gin",
-    postgresql_ops={"title": "gin_trgm_ops"}
+    postgresql_using="gist",
+    postgresql_ops={"title": "gist_trgm_ops"}
+)
+
+# Byte-wise btree for prefix ticker matches
+idx_ticker_prefix = Index(
+    "idx_stocks_ticker_prefix",
+    func.lower(stocks_table.c.ticker).label("ticker_lower"),
+    postgresql_ops={"ticker_lower": "text_pattern_ops"}
 )
 
+# GIN indexes of earlier deployments, replaced by the GiST ones above
+OLD_INDEXES = ["idx_stocks_ticker_trgm", "idx_stocks_title_trgm"]
 
+MERGE_STATEMENTS = {
+    # Tickers that are no longer in the file, and duplicate rows left behind by the old truncate + insert loader
+    "deleted": """
+        DELETE FROM stocks s
+        WHERE NOT EXISTS (SELECT 1 FROM stocks_staging st WHERE st.ticker = s.ticker)
+           OR EXISTS (SELECT 1 FROM stocks d WHERE d.ticker = s.ticker AND d.id < s.id);
+    """,
+    "updated": """
+        UPDATE stocks s SET title = st.title
+        FROM stocks_staging st
+        WHERE s.ticker = st.ticker AND s.title IS DISTINCT FROM st.title;
+    """,
+    "inserted": """
+        INSERT INTO stocks (ticker, title)
+        SELECT st.ticker, st.title FROM stocks_staging st
+        WHERE NOT EXISTS (SELECT 1 FROM stocks s WHERE s.ticker = st.ticker);
+    """,
+}
 
-# Check if database exists and create one if it does not
 
-if not database_exists(STOCKS_DATABASE_URL):
-    create_database(STOCKS_DATABASE_URL)
-    print(f"Database {STOCKS_DB_NAME} created successfully")
+def create_database_if_not_exists():
+    """Checks if database exists and creates one if it does not"""
+    if not database_exists(STOCKS_DATABASE_URL):
+        create_database(STOCKS_DATABASE_URL)
+        print(f"Database {STOCKS_DB_NAME} created successfully")
+    else:
+        print(f"Database {STOCKS_DB_NAME} exists already")
 
-else:
-    print(f"Database {STOCKS_DB_NAME} exists already")
 
-try:
-    from database.stocks_db import engine as stocks_engine
-except Exception as e:
-        print("Error importing engine. Are you sure the database was created?:", e)
-        
-# Enable the pg_trgm extension (must be done before creating trigram indexes)
-with stocks_engine.connect() as conn:
+def create_tables_and_indexes(stocks_engine):
+    # Enable the pg_trgm extension (must be done before creating trigram indexes)
+    with stocks_engine.connect() as conn:
+        try:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm;"))
+        except Exception as e:
+            print(f"Could not create pg_trgm extension: {e}")
+        conn.commit()
+
+    # Create tables if they don't already exist
     try:
-        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm;"))
+        metadata.create_all(stocks_engine)
+        print("All Tables created successfully (if not already present)")
     except Exception as e:
-        print(f"Could not create pg_trgm extension: {e}")
-    conn.commit()
-
-# Create tables if they don't already exist
-try:
-    metadata.create_all(stocks_engine)
-    print("All Tables created successfully (if not already present)")
-except Exception as e:
-    print(f"Error creating tables: {e}")    
-
-# Read JSON data
-try:
-    with open(JSON_DATA_PATH, "r") as f:
-        data = json.load(f)
-except FileNotFoundError:
-    print(f"JSON data file not found. Please place a JSON file containing stock tickers and names into {JSON_DATA_PATH}")
-
-records = list(data.values())
-
-# Insert Data into the table
-with stocks_engine.connect() as conn:
+        print(f"Error creating tables: {e}")
+
+    # create_all only creates indexes together with a new table, existing tables get them here
+    with stocks_engine.connect() as conn:
+        try:
+            for index_name in OLD_INDEXES:
+                conn.execute(text(f"DROP INDEX IF EXISTS {index_name};"))
+            for index in (idx_ticker_trgm, idx_title_trgm, idx_ticker_prefix):
+                index.create(conn, checkfirst=True)
+            print("All Indexes created successfully (if not already present)")
+        except Exception as e:
+            print(f"Error creating indexes: {e}")
+        conn.commit()
+
+
+def iter_stock_records(json_path: str):
+    """Yields (ticker, title) from the JSON file without loading it into memory. The first entry of a ticker wins."""
+    seen_tickers = set()
+    with open(json_path, "rb") as f:
+        for _, record in ijson.kvitems(f, ""):
+            ticker = record.get("ticker")
+            if not ticker or ticker in seen_tickers:
+                continue
+            seen_tickers.add(ticker)
+            yield ticker, record.get("title")
+
+
+class CsvRecordStream:
+    """File-like object for COPY FROM STDIN that formats records as CSV only when COPY asks for more data."""
+
+    def __init__(self, records):
+        self.records = iter(records)
+        self.output = io.StringIO()
+        self.writer = csv.writer(self.output)
+        self.buffer = ""
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self.buffer) < size:
+            record = next(self.records, None)
+            if record is None:
+                break
+            self.writer.writerow(record)
+            self.buffer += self.output.getvalue()
+            self.output.seek(0)
+            self.output.truncate()
+
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+    def readline(self, size: int = -1) -> str:
+        return self.read(size)
+
+
+def load_stocks(stocks_engine, json_path: str) -> dict:
+    """Merges the JSON file into the stocks table and returns the number of deleted, updated and inserted rows."""
+    connection = stocks_engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TEMP TABLE stocks_staging (ticker text PRIMARY KEY, title text) ON COMMIT DROP;")
+            # Empty unquoted CSV fields are read as NULL, so missing titles stay NULL like before
+            cursor.copy_expert(
+                "COPY stocks_staging (ticker, title) FROM STDIN WITH (FORMAT csv)",
+                CsvRecordStream(iter_stock_records(json_path))
+            )
+            cursor.execute("ANALYZE stocks_staging;")
+
+            changes = {}
+            for change, statement in MERGE_STATEMENTS.items():
+                cursor.execute(statement)
+                changes[change] = cursor.rowcount
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    return changes
+
+
+if __name__ == "__main__":
+    # Check if database exists and create one if it does not
+    create_database_if_not_exists()
+
     try:
-        conn.execute(text("TRUNCATE stocks;")) # We clear all existing data
+        from database.stocks_db import engine as stocks_engine
     except Exception as e:
-        print(f"Could not truncate table: {e}")
-    
+        print("Error importing engine. Are you sure the database was created?:", e)
+        raise SystemExit(1)
+
+    create_tables_and_indexes(stocks_engine)
+
+    if not os.path.exists(JSON_DATA_PATH):
+        print(f"JSON data file not found. Please place a JSON file containing stock tickers and names into {JSON_DATA_PATH}")
+        raise SystemExit(1)
+
     try:
-        conn.execute(insert(stocks_table), records)
+        changes = load_stocks(stocks_engine, JSON_DATA_PATH)
     except Exception as e:
-        print(f"Could not insert data into table: {e}")
-    conn.commit()
+        print(f"Could not load stock data, the stocks table was left unchanged: {e}")
+        raise SystemExit(1)
+
+    print(f"Stocks merged: {changes['inserted']} inserted, {changes['updated']} updated, {changes['deleted']} deleted")
+
+    # Make the API workers rebuild their in-memory search index and drop cached results, only needed if something changed
+    if any(changes.values()):
+        bump_stock_index_version()
+        clear_stock_query_cache()
 
-print("Stock Index Database Setup complete and data insertion complete!")
\ No newline at end of file
+    print("Stock Index Database Setup complete and data insertion complete!")
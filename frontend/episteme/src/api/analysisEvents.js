@@ -0,0 +1,49 @@
+// src/api/analysisEvents.js
+
+import apiClient from './axiosinstance';
+
+// Reads the Server-Sent Events of /analysis-events. EventSource can't send the API key header,
+// so the stream is read with fetch instead. Resolves once the server ends the stream.
+export const streamAnalysisEvents = async (taskId, onEvent, signal) => {
+  const url = `${apiClient.defaults.baseURL}/analysis-events?task_id=${encodeURIComponent(taskId)}`;
+  const response = await fetch(url, {
+    headers: {
+      'Accept': 'text/event-stream',
+      'X-API-KEY': apiClient.defaults.headers['X-API-KEY'],
+    },
+    signal,
+  });
+
+  if (!response.ok || !response.body) {
+    const error = new Error(`Event stream failed with status ${response.status}`);
+    error.status = response.status;
+    throw error;
+  }
+
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = '';
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) return;
+    buffer += value;
+
+    // Events are separated by a blank line
+    let separatorIndex;
+    while ((separatorIndex = buffer.indexOf('\n\n')) !== -1) {
+      const rawEvent = buffer.slice(0, separatorIndex);
+      buffer = buffer.slice(separatorIndex + 2);
+
+      let event = 'message';
+      const dataLines = [];
+      for (const line of rawEvent.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+      }
+      // Lines starting with ':' are keepalive comments
+      if (dataLines.length > 0) {
+        onEvent(event, JSON.parse(dataLines.join('\n')));
+      }
+    }
+  }
+};
@@ -46,51 +46,46 @@ const Favorites = () => {
         return;
       }
 
-      let userTimezone = 'UTC';
       try {
-        userTimezone = Intl.DateTimeFormat().resolvedOptions().timeZone;
-      } catch (tzError) {
-        console.warn("Could not detect user timezone, defaulting to UTC.", tzError);
-      }
-
-      try {
-        const fetchPromises = favoriteItems.map(favItem => {
-          const ticker = favItem.ticker;
-          const logoFromStorage = favItem.logo;
-
-          return apiClient.get('/retrieve-analysis', {
-            params: {
-                ticker: ticker,
-                timezone: userTimezone,
-                only_database: true
-            }
-          })
-            .then(response => {
-              const data = response.data;
-              if (data && data.company) {
-                return {
-                  ticker: data.company.ticker || ticker,
-                  title: data.company.title || 'Unknown Company',
-                  sentimentScore: data.company.sentimentScore ?? null,
-                  logo: logoFromStorage,
-                };
-              } else {
-                 console.warn(`Received invalid data structure for ticker: ${ticker}`, data);
-                 return { ticker: ticker, title: 'Data Error', sentimentScore: null, logo: logoFromStorage, error: true };
-              }
-            })
-            .catch(err => {
-               console.error(`Failed to fetch details for ticker ${ticker}:`, err.response?.data || err.message || err);
-               return { ticker: ticker, title: 'Fetch Error', sentimentScore: null, logo: logoFromStorage, error: true };
-            });
+        // One batch request for all favorites instead of one request per ticker
+        const response = await apiClient.get('/retrieve-analysis/batch', {
+          params: {
+            tickers: favoriteItems.map(favItem => favItem.ticker).join(','),
+          }
         });
+        const data = response.data;
+
+        if (!data || !Array.isArray(data.results)) {
+          console.warn("Received invalid data structure for favorites batch:", data);
+          setError("Failed to fetch details for some favorites.");
+          return;
+        }
+
+        if (Array.isArray(data.notFound) && data.notFound.length > 0) {
+          console.warn("Some favorites were not found:", data.notFound);
+        }
 
-        const results = await Promise.all(fetchPromises);
-        const validDetails = results.filter(detail => detail && !detail.error);
+        const companiesByTicker = new Map(
+          data.results
+            .filter(result => result && result.company && result.company.ticker)
+            .map(result => [result.company.ticker.toLowerCase(), result.company])
+        );
+
+        const validDetails = favoriteItems
+          .filter(favItem => companiesByTicker.has(favItem.ticker.toLowerCase()))
+          .map(favItem => {
+            const company = companiesByTicker.get(favItem.ticker.toLowerCase());
+            return {
+              ticker: company.ticker || favItem.ticker,
+              title: company.title || 'Unknown Company',
+              sentimentScore: company.sentimentScore ?? null,
+              logo: favItem.logo,
+            };
+          });
         setFavoriteDetails(validDetails);
 
       } catch (fetchError) {
-        console.error("An error occurred during batch API requests:", fetchError);
+        console.error("An error occurred during the batch API request:", fetchError.response?.data || fetchError.message || fetchError);
         setError("Failed to fetch details for some favorites.");
       } finally {
         setIsLoading(false);
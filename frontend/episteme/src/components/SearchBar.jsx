@@ -143,6 +143,12 @@ const SearchBar = () => {
         console.log(`Navigating to loading page for task ${data.task_id}`);
         navigate(`/loading-analysis/${data.task_id}/${currentTicker}`);
         return;
+      } else if (data.status === 'fresh') {
+        // The last analysis is recent enough, show it instead of starting a new one
+        console.log(`Analysis for ${currentTicker} is up to date, opening it`);
+        navigate(`/stock/${currentTicker}`);
+        closeModal();
+        return;
       } else {
         console.error('Analysis task did not start as expected:', data);
         setModalContent(prev => ({
@@ -1,6 +1,10 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import apiClient from '../api/axiosinstance';
+import { streamAnalysisEvents } from '../api/analysisEvents';
+
+// Newest points shown while the analysis is running
+const MAX_PREVIEW_POINTS = 5;
 
 const AnalysisLoadingPage = () => {
   const { taskId, ticker } = useParams();
@@ -8,6 +12,7 @@ const AnalysisLoadingPage = () => {
   const [statusMessage, setStatusMessage] = useState('Initializing analysis...');
   const [errorMessage, setErrorMessage] = useState(null);
   const [progressValue, setProgressValue] = useState(0);
+  const [streamedPoints, setStreamedPoints] = useState([]);
   const intervalRef = useRef(null);
 
   useEffect(() => {
@@ -16,47 +21,86 @@ const AnalysisLoadingPage = () => {
       return;
     }
 
+    const abortController = new AbortController();
+    let finished = false;
+
+    // Handles a status from the event stream or from polling, returns true once the analysis is over
+    const handleStatus = (data) => {
+      console.log('Analysis Status:', data);
+
+      if (data.error) {
+        setErrorMessage(data.error);
+        setStatusMessage('');
+        setProgressValue(0);
+        return true;
+      }
+
+      setStatusMessage(data.status || 'Processing...');
+      const currentProgress = Math.max(0, Math.min(10, Number(data.progress ?? 0)));
+      setProgressValue(currentProgress);
+      setErrorMessage(null);
+
+      if (currentProgress === 10) {
+        console.log(`Analysis complete for ${ticker}. Redirecting...`);
+        navigate(`/stock/${ticker || data.ticker}`);
+        return true;
+      }
+      return false;
+    };
+
+    const handleError = (error) => {
+      console.error('Failed to fetch analysis status:', error);
+      const errorText = error.response?.data?.detail || error.response?.data?.error || error.message || 'Failed to fetch status.';
+      setErrorMessage(`Error checking status: ${errorText}`);
+      setStatusMessage('');
+      setProgressValue(0);
+    };
+
     const checkStatus = async () => {
       try {
         const response = await apiClient.get('/analysis-status', {
           params: { task_id: taskId },
         });
-        const data = response.data;
-
-        console.log('Analysis Status:', data);
-
-        if (data.error) {
-          setErrorMessage(data.error);
-          setStatusMessage('');
-          setProgressValue(0);
+        if (handleStatus(response.data)) {
           clearInterval(intervalRef.current);
-        } else {
-          setStatusMessage(data.status || 'Processing...');
-          const currentProgress = Math.max(0, Math.min(10, Number(data.progress ?? 0)));
-          setProgressValue(currentProgress);
-          setErrorMessage(null);
-
-          if (currentProgress === 10) {
-            clearInterval(intervalRef.current);
-            console.log(`Analysis complete for ${ticker}. Redirecting...`);
-            navigate(`/stock/${ticker || data.ticker}`);
-          }
         }
       } catch (error) {
-        console.error('Failed to fetch analysis status:', error);
-        const errorText = error.response?.data?.detail || error.response?.data?.error || error.message || 'Failed to fetch status.';
-        setErrorMessage(`Error checking status: ${errorText}`);
-        setStatusMessage('');
-        setProgressValue(0);
+        handleError(error);
         clearInterval(intervalRef.current);
       }
     };
 
-    checkStatus();
-    intervalRef.current = setInterval(checkStatus, 3000);
+    // Polling is only the fallback for when the event stream can't be used (e.g. a proxy dropping it)
+    const startPolling = () => {
+      checkStatus();
+      intervalRef.current = setInterval(checkStatus, 3000);
+    };
+
+    const handleEvent = (event, data) => {
+      if (event === 'status') {
+        finished = handleStatus(data);
+      } else if (event === 'points') {
+        setStreamedPoints((points) => [...data, ...points].slice(0, MAX_PREVIEW_POINTS));
+      }
+    };
+
+    streamAnalysisEvents(taskId, handleEvent, abortController.signal)
+      .then(() => {
+        if (!finished) startPolling();
+      })
+      .catch((error) => {
+        if (abortController.signal.aborted) return;
+        if (error.status === 404) {
+          handleError(new Error('Task not found'));
+          return;
+        }
+        console.warn('Analysis event stream failed, falling back to polling:', error);
+        startPolling();
+      });
 
     // Cleanup
     return () => {
+      abortController.abort();
       if (intervalRef.current) {
         clearInterval(intervalRef.current);
       }
@@ -89,6 +133,20 @@ const AnalysisLoadingPage = () => {
             <div className="mt-4 text-lg text-slate-400 min-h-[1.75rem] text-center">
                 {statusMessage}
             </div>
+
+            {/* Points found so far */}
+            {streamedPoints.length > 0 && (
+                <ul className="mt-6 w-4/5 max-w-lg space-y-2">
+                    {streamedPoints.map((point, index) => (
+                        <li
+                            key={`${point.postUrl}-${index}`}
+                            className="bg-neutral-800 p-3 rounded-lg border border-neutral-700 text-sm text-slate-300"
+                        >
+                            {point.content}
+                        </li>
+                    ))}
+                </ul>
+            )}
         </>
 
       )}
@@ -6,6 +6,7 @@ from fastapi import FastAPI, Request, Security, HTTPException, status, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.security import APIKeyHeader
+from brotli_asgi import BrotliMiddleware
 
 from sqlalchemy.exc import SQLAlchemyError
 
@@ -14,6 +15,9 @@ from dotenv import load_dotenv
 from routers import stock_query, create_analysis
 from routers import check_analysis_route
 from routers import return_db_contents
+from routers import metrics
+from routers.retrieve_public_stock_info.stock_profile import close_http_client
+from routers.stock_search.search_index import search_index_loader
 
 
 ENV_PATH = os.getenv("ENV_PATH")
@@ -84,7 +88,16 @@ async def get_api_key(api_key_header:str = Security(api_key_header_auth)):
     
     return api_key_header
 
-app = FastAPI(dependencies=[Depends(get_api_key)])
+app = FastAPI()
+
+@app.on_event("startup")
+async def load_stock_search_index():
+    # Build the search index before the first keystroke arrives instead of during it
+    await search_index_loader.get_index()
+
+@app.on_event("shutdown")
+async def shutdown_http_client():
+    await close_http_client()
 
 @app.exception_handler(SQLAlchemyError)
 async def sqlalchemy_exception_handler():
@@ -103,6 +116,19 @@ async def generic_exception_handler():
         content={"detail": "An unexpected error occurred. Please try again later."}
     )
 
+# Compress responses above the threshold with brotli, or gzip for clients that don't accept brotli.
+# Small responses aren't worth the CPU time and often get larger when compressed.
+COMPRESSION_MINIMUM_SIZE = 1024
+
+app.add_middleware(
+    BrotliMiddleware,
+    quality=4,
+    minimum_size=COMPRESSION_MINIMUM_SIZE,
+    gzip_fallback=True,
+    # Compressing the event stream would buffer the events until a compressed block fills up
+    excluded_handlers=["^/analysis-events"]
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -111,7 +137,9 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
-app.include_router(stock_query.router)
-app.include_router(check_analysis_route.router)
-app.include_router(create_analysis.router)
-app.include_router(return_db_contents.router)
\ No newline at end of file
+app.include_router(stock_query.router, dependencies=[Depends(get_api_key)])
+app.include_router(check_analysis_route.router, dependencies=[Depends(get_api_key)])
+app.include_router(create_analysis.router, dependencies=[Depends(get_api_key)])
+app.include_router(return_db_contents.router, dependencies=[Depends(get_api_key)])
+# Prometheus scrapes without the API key, keep /metrics reachable from the internal network only
+app.include_router(metrics.router)
\ No newline at end of file
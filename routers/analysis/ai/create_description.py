@@ -1,7 +1,9 @@
-from openai import OpenAI
+import asyncio
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
 import os
 import yfinance as yf
+from routers.analysis.ai.llm_limiter import call_llm, estimate_tokens
 
 
 ENV_PATH = os.getenv("ENV_PATH")
@@ -11,7 +13,8 @@ DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 if not DEEPSEEK_API_KEY:
     raise ValueError("DEEPSEEK_API_KEY ENVIRONMENT VARIABLE IS EITHER EMPTY OR DOESN'T EXIST")
 
-client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com")
+# Retries are done by call_llm, which also knows about the other requests in flight
+client = AsyncOpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com", max_retries=0)
 
 
 prompt = """
@@ -45,11 +48,13 @@ Your final output should provide investors with a robust, long-term overview of
 
 """
 
-def generate_company_description(ticker: str):
+async def generate_company_description(ticker: str):
     yf_ticker = yf.Ticker(ticker)
-    company_info = yf_ticker.info
+    # yfinance is blocking
+    company_info = await asyncio.to_thread(lambda: yf_ticker.info)
+    user_prompt = f"Company description:\n{company_info}\n"
 
-    response = client.chat.completions.create(
+    response = await call_llm("deepseek-chat", "description", lambda: client.chat.completions.create(
         model = "deepseek-chat",
         messages = [
             {
@@ -58,13 +63,13 @@ def generate_company_description(ticker: str):
             },
             {
                 "role": "user",
-                "content": f"Company description:\n{company_info}\n",
+                "content": user_prompt,
             }
         ]
-    )
+    ), estimated_tokens=estimate_tokens(prompt, user_prompt))
 
     return response.choices[0].message.content
 
 if __name__ == "__main__":
 
-    print(generate_company_description(ticker="TSLA"))
\ No newline at end of file
+    print(asyncio.run(generate_company_description(ticker="TSLA")))
\ No newline at end of file
@@ -1,6 +1,8 @@
 from collections import defaultdict
 from database.db import session_scope
 from database.models.thesisai import Comment
+from routers.analysis.ai.llm_limiter import call_llm, estimate_tokens
+from routers.analysis.ai.llm_cache import cached_llm_output
 from openai import AsyncOpenAI
 from dotenv import load_dotenv
 import os
@@ -13,7 +15,10 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY ENVIRONMENT VARIABLE IS EITHER EMPTY OR DOESN'T EXIST")
 
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+# Retries are done by call_llm, which also knows about the other requests in flight
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+# Bump whenever the prompt, the response schema or the parsing changes, so cached outputs aren't reused
+PROMPT_VERSION = 1
 
 async def process_post_group(post_id: int, points: list, ticker_symbol: str = "", ) -> list:
     """
@@ -50,57 +55,57 @@ async def process_post_group(post_id: int, points: list, ticker_symbol: str = ""
         f"Comments: {json.dumps(comments_data, indent=2)}"
     )
     
-    response = await client.responses.create(
-        model="o3-mini",
-        input=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-       # tools=[{"type": "web_search_preview"}],
-        text={
-            "format": {
-                "type": "json_schema",
-                "name": "comment_analysis",
-                "schema": {
-                    "type": "object",
-                    "properties": {
-                        "results": {
-                            "type": "array",
-                            "items": {
-                                "type": "object",
-                                "properties": {
-                                    "point": {"type": "string"},
-                                    "sentiment_score": {"type": "integer"},
-                                    "criticism_exists": {"type": "boolean"},
-                                    "criticisms": {
-                                        "type": "array",
-                                        "items": {
-                                            "type": "object",
-                                            "properties": {
-                                                "criticism": {"type": "string"},
-                                                "validity_score": {"type": "integer"},
-                                                "comment_id": {"type": "integer"}
-                                            },
-                                            "required": ["criticism", "validity_score", "comment_id"],
-                                            "additionalProperties": False
+    async def generate():
+        response = await call_llm("o3-mini", "criticisms", lambda: client.responses.create(
+            model="o3-mini",
+            input=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+           # tools=[{"type": "web_search_preview"}],
+            text={
+                "format": {
+                    "type": "json_schema",
+                    "name": "comment_analysis",
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "results": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "point": {"type": "string"},
+                                        "sentiment_score": {"type": "integer"},
+                                        "criticism_exists": {"type": "boolean"},
+                                        "criticisms": {
+                                            "type": "array",
+                                            "items": {
+                                                "type": "object",
+                                                "properties": {
+                                                    "criticism": {"type": "string"},
+                                                    "validity_score": {"type": "integer"},
+                                                    "comment_id": {"type": "integer"}
+                                                },
+                                                "required": ["criticism", "validity_score", "comment_id"],
+                                                "additionalProperties": False
+                                            }
                                         }
-                                    }
-                                },
-                                "required": ["point", "sentiment_score", "criticism_exists", "criticisms"],
-                                "additionalProperties": False
+                                    },
+                                    "required": ["point", "sentiment_score", "criticism_exists", "criticisms"],
+                                    "additionalProperties": False
+                                }
                             }
-                        }
-                    },
-                    "required": ["results"],
-                    "additionalProperties": False
+                        },
+                        "required": ["results"],
+                        "additionalProperties": False
+                    }
                 }
             }
-        }
-    )
-
+        ), estimated_tokens=estimate_tokens(system_prompt, user_prompt))
+        return json.loads(response.output_text).get("results", [])
 
-    gpt_response = json.loads(response.output_text)
-    gpt_analysis = gpt_response.get("results", [])
+    gpt_analysis = await cached_llm_output("o3-mini", "criticisms", PROMPT_VERSION, [system_prompt, user_prompt], generate)
     # Merge GPT's analysis with the original full points by matching on 'point' and 'sentiment_score'.
     merged_points = []
     for orig in points:
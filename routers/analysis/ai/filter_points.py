@@ -1,24 +1,28 @@
 import asyncio
-from typing import List, Dict
+from typing import List
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
 from sentence_transformers import SentenceTransformer
 import os
 import json
 import numpy as np
 import logging
-from database.models.thesisai import Ticker, Point
+from database.models.thesisai import Point
 from database.db import session_scope
 from sqlalchemy.exc import SQLAlchemyError
 from sklearn.metrics.pairwise import cosine_similarity
-from sqlalchemy import func
+from routers.analysis.ai.llm_limiter import call_llm, estimate_tokens
+from routers.analysis.ai.llm_cache import cached_llm_output
 # Load environment variables and initialize OpenAI client
 ENV_PATH = os.getenv("ENV_PATH")
 load_dotenv(ENV_PATH)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY ENVIRONMENT VARIABLE IS EITHER EMPTY OR DOESN'T EXIST")
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Retries are done by call_llm, which also knows about the other requests in flight
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+# Bump whenever the prompt, the response schema or the parsing changes, so cached outputs aren't reused
+PROMPT_VERSION = 1
 
 # -------------------------
 # Utility Functions
@@ -67,99 +71,26 @@ def get_existing_points_as_dicts(ticker_id: int) -> List:
 # Duplicate Filtering Function
 # -------------------------
 
-async def remove_duplicate_points(new_points: List, ticker_id: int, threshold: float = 0.40) -> Dict:
+async def filter_candidates_with_gpt(candidate_points_for_gpt: List, existing_point_texts: List) -> List:
     """
-    Remove duplicate thesis points by comparing new points against those already stored in the database.
-    
-    Process:
-      1. Retrieve existing thesis points (with embeddings) for the given ticker.
-      2. For each new thesis point (which should also include a "post_id" field), compute its embedding.
-      3. Compute cosine similarity between the new point's embedding and each existing point's embedding.
-      4. If the maximum similarity exceeds the threshold, consider it a duplicate; otherwise, save the new point (with its embedding)
-         to the database and include it in the output.
-    
-    Returns a dictionary with the filtered (unique) thesis points.
+    Asks GPT which of the candidate points (too similar to an existing point by embedding) still express a unique idea.
+    Returns the candidates GPT kept, without embeddings.
     """
-    # Retrieve existing points (including embeddings) & Prepare lists for existing embeddings and texts
-    existing_points = get_existing_points_as_dicts(ticker_id)
-    existing_embeddings = [np.array(pt["embedding"]) for pt in existing_points if pt.get("embedding")]
-    existing_point_texts = [pt.get("point") for pt in existing_points if pt.get("point")]
-
-    unique_points = []
-    # Maintain two lists for candidate points:
-    # 1. candidate_points_for_gpt: sent to GPT (without embedding)
-    # 2. candidate_points_full: contains embedding locally
-    candidate_points_for_gpt = []
-    candidate_points_full = []
-    
-    # Create a list of tasks to compute embeddings concurrently.
-    # We'll only compute embeddings for points that have a valid post_id.
-    tasks = []
-    valid_new_points = []
-    for pt in new_points:
-        if "post_id" not in pt:
-            logging.warning(f"Point dictionary for point '{pt}' does not include post_id. Skipping...")
-            continue
-        valid_new_points.append(pt)
-        # Offload compute_finlang_embedding to a thread.
-        tasks.append(asyncio.to_thread(compute_finlang_embedding, pt["point"]))
-    
-    # Gather all embeddings concurrently 
-    new_embeddings = await asyncio.gather(*tasks)
-
-    # Iterate through the points and their computed embeddings.
-    for pt, new_embedding in zip(valid_new_points, new_embeddings):
-        text = pt["point"]
-        sentiment = pt["sentiment_score"]
-        post_id = pt["post_id"]
-        emb_list = new_embedding.tolist()
-        
-        # Compare with existing embeddings to check for duplicates
-        is_duplicate = False
-        if existing_embeddings:
-            sims = [cosine_sim(new_embedding, emb) for emb in existing_embeddings]
-            max_sim = max(sims) if sims else 0.0
-            if max_sim >= threshold:
-                is_duplicate = True
-        
-        if not is_duplicate:
-            unique_points.append({
-                "point": text,
-                "sentiment_score": sentiment,
-                "embedding": emb_list,
-                "post_id": post_id
-            })
-        else:
-            # Add candidate without embedding for GPT
-            candidate_points_for_gpt.append({
-                "point": text,
-                "sentiment_score": sentiment,
-                "post_id": post_id
-            })
-            # Also store the full candidate with embedding locally
-            candidate_points_full.append({
-                "point": text,
-                "sentiment_score": sentiment,
-                "post_id": post_id,
-                "embedding": emb_list
-            })
-    
-    # Use GPT to further filter candidate points
-    if candidate_points_for_gpt:
-        system_prompt = (
-            "You are a financial analysis assistant. Your task is to compare two lists of thesis points "
-            "and determine which points from the candidate list express a unique idea that is not already "
-            "present in the existing list. A thesis point is considered a duplicate if it conveys the same core idea, "
-            "even if the phrasing is slightly different. Return only the candidate points that are unique, in JSON format "
-            "with the following schema: {\"thesis_points\": [{\"point\": \"string\", \"sentiment_score\": number, \"post_id\": number}]}."
-        )
-
-        user_prompt = (
-            f"Candidate New Thesis Points:\n{json.dumps(candidate_points_for_gpt, indent=2)}\n\n"
-            f"Existing Thesis Points:\n{json.dumps(existing_point_texts, indent=2)}"
-        )
-
-        response = client.responses.create(
+    system_prompt = (
+        "You are a financial analysis assistant. Your task is to compare two lists of thesis points "
+        "and determine which points from the candidate list express a unique idea that is not already "
+        "present in the existing list. A thesis point is considered a duplicate if it conveys the same core idea, "
+        "even if the phrasing is slightly different. Return only the candidate points that are unique, in JSON format "
+        "with the following schema: {\"thesis_points\": [{\"point\": \"string\", \"sentiment_score\": number, \"post_id\": number}]}."
+    )
+
+    user_prompt = (
+        f"Candidate New Thesis Points:\n{json.dumps(candidate_points_for_gpt, indent=2)}\n\n"
+        f"Existing Thesis Points:\n{json.dumps(existing_point_texts, indent=2)}"
+    )
+
+    async def generate():
+        response = await call_llm("gpt-4o", "deduplicate", lambda: client.responses.create(
             model="gpt-4o",
             input=[
                 {"role": "system", "content": system_prompt},
@@ -191,31 +122,109 @@ async def remove_duplicate_points(new_points: List, ticker_id: int, threshold: f
                     }
                 }
             }
-        )
+        ), estimated_tokens=estimate_tokens(system_prompt, user_prompt))
+        return json.loads(response.output_text).get("thesis_points", [])
 
-        gpt_filtered = json.loads(response.output_text)
-        filtered_candidates = gpt_filtered.get("thesis_points", [])
-
-        # For each candidate returned by GPT, look up the full candidate (the one with embedding)
-        for candidate in filtered_candidates:
-            # Here we're matching on both 'post_id' and 'point' to be safe
-            full_candidate = next(
-                (item for item in candidate_points_full
-                 if item["post_id"] == candidate["post_id"] and item["point"] == candidate["point"]),
-                None
-            )
-            if full_candidate:
-                unique_points.append(full_candidate)
-    
-    return unique_points
+    return await cached_llm_output("gpt-4o", "deduplicate", PROMPT_VERSION, [system_prompt, user_prompt], generate)
 
-if __name__ == "__main__":
-    ticker = "spry"
-    new_points_list = [{'point': 'Epinephrine nasal spray available by prescription since September.', 'sentiment_score': 60, 'post_id': 6}, {'point': 'Shelf life of 30 months compared to 18 months for Epipen.', 'sentiment_score': 70, 'post_id': 6}, {'point': 'Renaissance Lakewood, LLC, partnered for production, expanding to meet demand.', 'sentiment_score': 65, 'post_id': 6}, {'point': 'Device may not be covered by insurance; not covered by Medicare.', 'sentiment_score': 45, 'post_id': 6}, {'point': 'Pushback from the medical community for speed of delivery concerns.', 'sentiment_score': 40, 'post_id': 6}, {'point': 'Better suited for home use, less likely for hospital use.', 'sentiment_score': 50, 'post_id': 6}, {'point': 'Launched first FDA-approved needle-free epinephrine nasal spray for severe allergic reactions.', 'sentiment_score': 75, 'post_id': 9}, {'point': 'Early sales have exceeded expectations.', 'sentiment_score': 80, 'post_id': 9}, {'point': 'Targets several segments within severe allergic reactions and could become an OTC medication.', 'sentiment_score': 78, 'post_id': 9}, {'point': 'Plans to expand indications into CSU and pediatric use.', 'sentiment_score': 74, 'post_id': 9}, {'point': 'Risks related to insurance coverage policies and competition with traditional auto-injectors.', 'sentiment_score': 40, 'post_id': 9}, {'point': 'First non-injectable epinephrine nasal spray launched in U.S. and Europe.', 'sentiment_score': 75, 'post_id': 10}, {'point': '140% year-to-date stock increase driven by product launch.', 'sentiment_score': 80, 'post_id': 10}, {'point': 'Solid balance sheet with $205 million in cash.', 'sentiment_score': 70, 'post_id': 10}, {'point': 'Received $145 million upfront payment from licensing deal with ALK-Abelló.', 'sentiment_score': 72, 'post_id': 10}, {'point': 'Uncertain demand curve shortly after commercialization start.', 'sentiment_score': 45, 'post_id': 10}, {'point': 'Notable insider selling recorded in November.', 'sentiment_score': 40, 'post_id': 10}]
-    with session_scope() as session:
-        ticker_obj = session.query(Ticker).filter(func.lower(Ticker.symbol) == ticker.lower()).first()
 
-    results = asyncio.run(remove_duplicate_points(new_points=new_points_list, ticker_obj=ticker_obj))
-    for result in results:
-        result.pop("embedding", None)
-    print(results)
+class PointDeduplicator:
+    """
+    Duplicate filtering for points that arrive post by post while other posts are still being analyzed.
+
+    The points of a post are compared against the points stored for the ticker plus the points accepted from
+    other posts of this analysis so far, i.e. what they would have been compared against had the posts been
+    stored one after another. The embedding comparison runs under a lock and registers the points it accepts
+    right away, so two posts arriving together can't both accept the same idea. Points too similar to a known
+    point are checked by GPT outside of the lock, against the texts of their nearest known points only.
+    Points other posts accepted in the meantime weren't part of that check, so the points GPT keeps are
+    compared against those afterwards (and checked by GPT again if they are similar to one of them).
+    """
+
+    def __init__(self, ticker_id: int, threshold: float = 0.40, nearest_known_points: int = 5):
+        self.ticker_id = ticker_id
+        self.threshold = threshold
+        # Known points sent to GPT per candidate
+        self.nearest_known_points = nearest_known_points
+        self.lock = asyncio.Lock()
+        self.known_embeddings = None
+        self.known_texts = None
+
+    async def load_existing_points(self):
+        existing_points = await asyncio.to_thread(get_existing_points_as_dicts, self.ticker_id)
+        existing_points = [pt for pt in existing_points if pt.get("embedding") and pt.get("point")]
+        self.known_embeddings = [np.array(pt["embedding"]) for pt in existing_points]
+        self.known_texts = [pt["point"] for pt in existing_points]
+
+    def add_accepted_points(self, points: List):
+        """Registers points that were accepted, e.g. by an interrupted earlier run of the same analysis."""
+        for pt in points:
+            self.known_embeddings.append(np.array(pt["embedding"]))
+            self.known_texts.append(pt["point"])
+
+    def compare_with_known(self, points: List, start: int, end: int):
+        """
+        Splits the points into those unlike the known points start:end and candidates for GPT.
+        Returns (unique points, candidates, texts of the known points nearest to the candidates).
+        """
+        if not points or start >= end:
+            return points, [], []
+        similarities = cosine_similarity([pt["embedding"] for pt in points], np.array(self.known_embeddings[start:end]))
+
+        unique_points, candidates, nearest = [], [], set()
+        for pt, point_similarities in zip(points, similarities):
+            if point_similarities.max() >= self.threshold:
+                candidates.append(pt)
+                nearest.update(start + int(k) for k in np.argsort(point_similarities)[-self.nearest_known_points:])
+            else:
+                unique_points.append(pt)
+        return unique_points, candidates, [self.known_texts[k] for k in sorted(nearest)]
+
+    async def filter_post_points(self, points: List) -> List:
+        """Returns the unique points of one post, with their embeddings."""
+        valid_points = []
+        for pt in points:
+            if "post_id" not in pt:
+                logging.warning(f"Point dictionary for point '{pt}' does not include post_id. Skipping...")
+                continue
+            valid_points.append(pt)
+
+        new_embeddings = await asyncio.gather(
+            *(asyncio.to_thread(compute_finlang_embedding, pt["point"]) for pt in valid_points)
+        )
+        full_points = [
+            {
+                "point": pt["point"],
+                "sentiment_score": pt["sentiment_score"],
+                "embedding": new_embedding.tolist(),
+                "post_id": pt["post_id"]
+            }
+            for pt, new_embedding in zip(valid_points, new_embeddings)
+        ]
+
+        async with self.lock:
+            if self.known_embeddings is None:
+                await self.load_existing_points()
+            unique_points, candidates, nearest_texts = self.compare_with_known(full_points, 0, len(self.known_texts))
+            self.add_accepted_points(unique_points)
+            compared_until = len(self.known_texts)
+
+        while candidates:
+            candidate_points_for_gpt = [
+                {"point": pt["point"], "sentiment_score": pt["sentiment_score"], "post_id": pt["post_id"]}
+                for pt in candidates
+            ]
+            filtered_candidates = await filter_candidates_with_gpt(candidate_points_for_gpt, nearest_texts)
+            kept = [
+                item for item in candidates
+                if any(item["post_id"] == c["post_id"] and item["point"] == c["point"] for c in filtered_candidates)
+            ]
+
+            async with self.lock:
+                # Points accepted by other posts while GPT was checking
+                accepted, candidates, nearest_texts = self.compare_with_known(kept, compared_until, len(self.known_texts))
+                self.add_accepted_points(accepted)
+                unique_points.extend(accepted)
+                compared_until = len(self.known_texts)
+
+        return unique_points
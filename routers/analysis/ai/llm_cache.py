@@ -0,0 +1,63 @@
+import hashlib
+import logging
+import os
+import orjson
+from dotenv import load_dotenv
+from redis.exceptions import RedisError
+from database.redis_db import async_redis_client
+from routers.analysis.telemetry import LLM_CACHE_LOOKUPS
+
+"""
+Content-addressed cache of parsed LLM outputs, shared by all analyses and workers.
+
+The prompts of the analysis are deterministic functions of their inputs, so the same post, comment thread or
+candidate list sent again (a retried job, a resumed analysis, a repost, a manual replay) gets the stored output
+instead of another LLM call. Entries are keyed by sha256 of (model, prompt version, rendered prompts), so any
+change of the input is a different entry. Bumping a module's PROMPT_VERSION retires its old entries.
+
+Entries expire after LLM_CACHE_EXPIRE_SECONDS. Under memory pressure Redis evicts them earlier according to
+its maxmemory-policy, with volatile-lru only keys with an expiry (like these) are evicted.
+"""
+
+ENV_PATH = os.getenv("ENV_PATH")
+load_dotenv(ENV_PATH)
+
+CACHE_KEY_PREFIX = "llm_cache:"
+# 0 disables the cache
+LLM_CACHE_EXPIRE_SECONDS = int(os.getenv("LLM_CACHE_EXPIRE_SECONDS", 7 * 24 * 60 * 60))
+
+
+def llm_cache_key(model: str, operation: str, prompt_version: int, payload) -> str:
+    digest = hashlib.sha256(orjson.dumps([model, prompt_version, payload], option=orjson.OPT_SORT_KEYS)).hexdigest()
+    return f"{CACHE_KEY_PREFIX}{operation}:{digest}"
+
+
+async def cached_llm_output(model: str, operation: str, prompt_version: int, payload, generate):
+    """
+    Returns the cached output for the payload, or awaits generate() (which calls the LLM and parses its answer)
+    and caches what it returns unless that is None (no usable answer, worth asking again next time).
+    Redis errors only cost the cache, not the output.
+    """
+    if not LLM_CACHE_EXPIRE_SECONDS:
+        return await generate()
+
+    key = llm_cache_key(model, operation, prompt_version, payload)
+    try:
+        cached = await async_redis_client.get(key)
+    except RedisError as e:
+        logging.warning(f"Could not read LLM cache for {operation}: {e}")
+        cached = None
+
+    if cached is not None:
+        LLM_CACHE_LOOKUPS.labels(operation, "hit").inc()
+        return orjson.loads(cached)
+
+    LLM_CACHE_LOOKUPS.labels(operation, "miss").inc()
+    output = await generate()
+    if output is None:
+        return output
+    try:
+        await async_redis_client.set(key, orjson.dumps(output), ex=LLM_CACHE_EXPIRE_SECONDS)
+    except (RedisError, orjson.JSONEncodeError) as e:
+        logging.warning(f"Could not store LLM output of {operation} in the cache: {e}")
+    return output
@@ -0,0 +1,271 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from contextvars import ContextVar
+import openai
+from dotenv import load_dotenv
+from redis.exceptions import RedisError
+from database.redis_db import async_redis_client
+from routers.analysis.telemetry import record_llm_usage
+
+"""
+Rate limiting and retries for every LLM request of the analyses.
+
+Each model has two token buckets, one for requests per minute and one for tokens per minute. A request
+waits until both buckets have room for it, its tokens are estimated from the prompt up front and corrected
+with the actual usage once the response is back. With LLM_RATE_LIMIT_BACKEND=redis the buckets live in Redis
+and are shared by all workers, otherwise every process has its own (fine for a single worker process).
+
+Requests run in one of two lanes. Interactive requests (analyses users asked for) may empty the buckets,
+background requests (refreshes queued by the scheduler) leave LLM_BACKGROUND_RESERVE of every bucket free,
+so an interactive analysis never waits behind a backlog of refreshes.
+
+429s, 5xx responses and connection errors are retried with jittered exponential backoff. A 429 also pauses
+the model for everyone, as the provider is telling all of our requests to slow down, not just this one.
+"""
+
+ENV_PATH = os.getenv("ENV_PATH")
+load_dotenv(ENV_PATH)
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+# Requests and tokens per minute. Set LLM_RATE_LIMITS (JSON, same format) to match the account's limits.
+DEFAULT_RATE_LIMITS = {
+    "gpt-4o": {"rpm": 500, "tpm": 30000},
+    "o3-mini": {"rpm": 500, "tpm": 200000},
+    "deepseek-chat": {"rpm": 600, "tpm": 1000000},
+}
+FALLBACK_RATE_LIMIT = {"rpm": 500, "tpm": 100000}
+RATE_LIMITS = {**DEFAULT_RATE_LIMITS, **json.loads(os.getenv("LLM_RATE_LIMITS", "{}"))}
+
+RATE_LIMIT_BACKEND = os.getenv("LLM_RATE_LIMIT_BACKEND", "local")
+BACKGROUND_RESERVE = float(os.getenv("LLM_BACKGROUND_RESERVE", 0.25))
+
+MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", 5))
+BACKOFF_BASE_SECONDS = 1
+BACKOFF_MAX_SECONDS = 60
+# Rough number of output tokens charged up front, the difference is settled with the actual usage
+ESTIMATED_OUTPUT_TOKENS = 1000
+# Keeps callers from spinning when a bucket is just short
+MIN_WAIT_SECONDS = 0.05
+
+BUCKET_KEY_PREFIX = "llm_limiter:"
+# Buckets of idle models refill completely within a minute, so they can expire after that
+BUCKET_EXPIRE_SECONDS = 120
+
+llm_priority = ContextVar("llm_priority", default=INTERACTIVE)
+
+
+def set_llm_priority(priority: str):
+    """Sets the lane of the LLM requests made from the current context (e.g. by the analysis a worker runs)."""
+    llm_priority.set(priority)
+
+
+def estimate_tokens(*texts: str, output_tokens: int = ESTIMATED_OUTPUT_TOKENS) -> int:
+    # About 4 characters per token for English text
+    return sum(len(text) for text in texts) // 4 + output_tokens
+
+
+def rate_limit(model: str) -> dict:
+    return RATE_LIMITS.get(model, FALLBACK_RATE_LIMIT)
+
+
+# Refills both buckets for the time passed, then takes one request and `tokens` tokens if both buckets
+# still hold the lane's reserve afterwards. Returns the seconds to wait before trying again (0 = taken).
+# The token bucket may go negative, large requests and usage corrections are paid back by waiting.
+TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rpm = tonumber(ARGV[2])
+local tpm = tonumber(ARGV[3])
+local tokens = tonumber(ARGV[4])
+local reserve = tonumber(ARGV[5])
+local state = redis.call('HMGET', KEYS[1], 'requests', 'tokens', 'updated', 'blocked')
+local requests = tonumber(state[1]) or rpm
+local available = tonumber(state[2]) or tpm
+local updated = tonumber(state[3]) or now
+local blocked = tonumber(state[4]) or 0
+if now < blocked then
+    return tostring(blocked - now)
+end
+local elapsed = math.max(0, now - updated)
+requests = math.min(rpm, requests + elapsed * rpm / 60)
+available = math.min(tpm, available + elapsed * tpm / 60)
+local needed_requests = 1 + reserve * rpm
+local needed_tokens = math.min(tokens, tpm * (1 - reserve)) + reserve * tpm
+local wait = 0
+if requests >= needed_requests and available >= needed_tokens then
+    requests = requests - 1
+    available = available - tokens
+else
+    wait = math.max((needed_requests - requests) * 60 / rpm, (needed_tokens - available) * 60 / tpm)
+end
+redis.call('HSET', KEYS[1], 'requests', tostring(requests), 'tokens', tostring(available), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+return tostring(wait)
+"""
+
+# Charges (or refunds, if negative) the difference between the actual and the estimated tokens
+SETTLE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HINCRBYFLOAT', KEYS[1], 'tokens', -tonumber(ARGV[1]))
+end
+return 1
+"""
+
+BLOCK_SCRIPT = """
+local blocked = tonumber(redis.call('HGET', KEYS[1], 'blocked')) or 0
+if tonumber(ARGV[1]) > blocked then
+    redis.call('HSET', KEYS[1], 'blocked', ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+
+class LocalBuckets:
+    """Token buckets of this process, same semantics as TAKE_SCRIPT."""
+
+    def __init__(self):
+        self.buckets = {}
+
+    def bucket(self, model: str, limits: dict, now: float) -> dict:
+        return self.buckets.setdefault(
+            model, {"requests": limits["rpm"], "tokens": limits["tpm"], "updated": now, "blocked": 0}
+        )
+
+    async def take(self, model: str, limits: dict, tokens: int, reserve: float) -> float:
+        now = time.time()
+        bucket = self.bucket(model, limits, now)
+        if now < bucket["blocked"]:
+            return bucket["blocked"] - now
+
+        rpm, tpm = limits["rpm"], limits["tpm"]
+        elapsed = max(0, now - bucket["updated"])
+        bucket["requests"] = min(rpm, bucket["requests"] + elapsed * rpm / 60)
+        bucket["tokens"] = min(tpm, bucket["tokens"] + elapsed * tpm / 60)
+        bucket["updated"] = now
+
+        needed_requests = 1 + reserve * rpm
+        needed_tokens = min(tokens, tpm * (1 - reserve)) + reserve * tpm
+        if bucket["requests"] >= needed_requests and bucket["tokens"] >= needed_tokens:
+            bucket["requests"] -= 1
+            bucket["tokens"] -= tokens
+            return 0
+        return max((needed_requests - bucket["requests"]) * 60 / rpm, (needed_tokens - bucket["tokens"]) * 60 / tpm)
+
+    async def settle(self, model: str, token_difference: int):
+        if model in self.buckets:
+            self.buckets[model]["tokens"] -= token_difference
+
+    async def block(self, model: str, limits: dict, until: float):
+        bucket = self.bucket(model, limits, time.time())
+        bucket["blocked"] = max(bucket["blocked"], until)
+
+
+class RedisBuckets:
+    """Token buckets shared by all processes through Redis."""
+
+    def __init__(self):
+        self.take_script = async_redis_client.register_script(TAKE_SCRIPT)
+        self.settle_script = async_redis_client.register_script(SETTLE_SCRIPT)
+        self.block_script = async_redis_client.register_script(BLOCK_SCRIPT)
+
+    @staticmethod
+    def key(model: str) -> str:
+        return f"{BUCKET_KEY_PREFIX}{model}"
+
+    async def take(self, model: str, limits: dict, tokens: int, reserve: float) -> float:
+        wait = await self.take_script(
+            keys=[self.key(model)],
+            args=[time.time(), limits["rpm"], limits["tpm"], tokens, reserve, BUCKET_EXPIRE_SECONDS],
+        )
+        return float(wait)
+
+    async def settle(self, model: str, token_difference: int):
+        await self.settle_script(keys=[self.key(model)], args=[token_difference])
+
+    async def block(self, model: str, limits: dict, until: float):
+        await self.block_script(keys=[self.key(model)], args=[until, BUCKET_EXPIRE_SECONDS])
+
+
+buckets = RedisBuckets() if RATE_LIMIT_BACKEND == "redis" else LocalBuckets()
+
+
+async def acquire(model: str, tokens: int):
+    limits = rate_limit(model)
+    reserve = BACKGROUND_RESERVE if llm_priority.get() == BACKGROUND else 0
+    while True:
+        try:
+            wait = await buckets.take(model, limits, tokens, reserve)
+        except RedisError as e:
+            # Better to go over the limit for a moment than to stop all analyses while Redis is unavailable
+            logging.warning(f"Could not reach the LLM rate limiter, sending request to {model} unthrottled: {e}")
+            return
+        if wait <= 0:
+            return
+        # Jitter keeps waiting callers from all retrying at the same moment
+        await asyncio.sleep(max(wait, MIN_WAIT_SECONDS) * random.uniform(1, 1.2))
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    return isinstance(error, openai.APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """Retry-After if the provider sent one, otherwise full-jitter exponential backoff."""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX_SECONDS)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def usage_tokens(usage) -> int:
+    if usage is None:
+        return 0
+    return getattr(usage, "total_tokens", None) or (
+        (getattr(usage, "input_tokens", None) or getattr(usage, "prompt_tokens", 0) or 0)
+        + (getattr(usage, "output_tokens", None) or getattr(usage, "completion_tokens", 0) or 0)
+    )
+
+
+async def call_llm(model: str, operation: str, send_request, estimated_tokens: int):
+    """
+    Sends an LLM request within the model's rate limits and retries it on rate limiting and server errors.
+    `send_request` is a function returning the coroutine of the API call, it is called again for every attempt.
+    """
+    limits = rate_limit(model)
+    for attempt in range(MAX_ATTEMPTS):
+        await acquire(model, estimated_tokens)
+        try:
+            response = await send_request()
+        except Exception as e:
+            if not is_retryable(e) or attempt == MAX_ATTEMPTS - 1:
+                raise
+            delay = retry_delay(e, attempt)
+            logging.warning(f"{operation} request to {model} failed ({e}), retrying in {delay:.1f}s")
+            if isinstance(e, openai.RateLimitError):
+                try:
+                    await buckets.block(model, limits, time.time() + delay)
+                except RedisError:
+                    pass
+            await asyncio.sleep(delay)
+            continue
+
+        usage = getattr(response, "usage", None)
+        record_llm_usage(model, operation, usage)
+        if usage is not None:
+            try:
+                await buckets.settle(model, usage_tokens(usage) - estimated_tokens)
+            except RedisError:
+                pass
+        return response
@@ -4,8 +4,12 @@ from dotenv import load_dotenv
 import os
 import json
 import asyncio
+import logging
+from sqlalchemy import select
 from database.db import session_scope
-from database.models.thesisai import Post
+from database.models.thesisai import Post, Ticker
+from routers.analysis.ai.llm_limiter import call_llm, estimate_tokens
+from routers.analysis.ai.llm_cache import cached_llm_output
 
 ENV_PATH = os.getenv("ENV_PATH")
 load_dotenv(ENV_PATH)
@@ -14,18 +18,51 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY ENVIRONMENT VARIABLE IS EITHER EMPTY OR DOESN'T EXIST")
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+# Retries are done by call_llm, which also knows about the other requests in flight
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+# Bump whenever the prompt, the response schema or the parsing changes, so cached outputs aren't reused
+PROMPT_VERSION = 2
 
-async def summarize_points_from_post(post_id):
-    """
-    Summarizes main investment points from the post associated with the gigen post_id using GPT-4o.
-    """
+# Short posts are summarized several at a time, each batched request sized to stay within this many estimated tokens
+SUMMARIZE_BATCH_TOKEN_BUDGET = int(os.getenv("SUMMARIZE_BATCH_TOKEN_BUDGET", 8000))
+# Most posts per batched request, 1 turns batching off
+SUMMARIZE_BATCH_MAX_POSTS = int(os.getenv("SUMMARIZE_BATCH_MAX_POSTS", 8))
+# Posts estimated above this many tokens get a request of their own
+SUMMARIZE_BATCH_MAX_POST_TOKENS = int(os.getenv("SUMMARIZE_BATCH_MAX_POST_TOKENS", 1500))
+# Rough number of output tokens per post of a batch
+BATCH_OUTPUT_TOKENS_PER_POST = 300
+
+THESIS_POINT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "point": {
+            "type": "string",
+            "description": "The extracted thesis point text."
+        },
+        "sentiment_score": {
+            "type": "integer",
+            "description": "The sentiment score, where 50 is neutral, above 50 is bullish, and below 50 is bearish."
+        }
+    },
+    "required": ["point", "sentiment_score"],
+    "additionalProperties": False
+}
+
+def load_posts(post_ids: list) -> dict:
+    """Content and ticker of the posts as {post_id: post}, read in a single query."""
     with session_scope() as session:
-        post_obj = session.query(Post).filter(Post.id == post_id).first()
-        
-        post_content = post_obj.content
-        ticker_symbol = post_obj.ticker.symbol
-        ticker_name = post_obj.ticker.name
+        rows = session.execute(
+            select(Post.id, Post.content, Ticker.symbol, Ticker.name)
+            .join(Ticker, Post.ticker_id == Ticker.id)
+            .where(Post.id.in_(post_ids))
+        ).all()
+    return {row.id: {"content": row.content, "ticker_symbol": row.symbol, "ticker_name": row.name} for row in rows}
+
+async def summarize_post_content(post_id: int, post: dict) -> list:
+    """Summarizes a single post (as returned by load_posts) in a request of its own."""
+    post_content = post["content"]
+    ticker_symbol = post["ticker_symbol"]
+    ticker_name = post["ticker_name"]
 
     system_prompt = f"""
     Extract the main thesis points from the following financial post regarding the ticker {ticker_symbol} with the name {ticker_name} in bullet form. Only extract thesis points that relate specifically to this stock; ignore any information or points about other stocks.
@@ -51,56 +88,171 @@ async def summarize_points_from_post(post_id):
     {post_content}
     """
 
-    response = await client.responses.create(
-        model="gpt-4o",
-        input=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        text={
-            "format": {
-                "type": "json_schema",
-                "name": "thesis_summarization",
-                "schema": {
-                    "type": "object",
-                    "properties": {
-                        "thesis_points": {
-                            "type": "array",
-                            "items": {
-                                "type": "object",
-                                "properties": {
-                                    "point": {
-                                        "type": "string",
-                                        "description": "The extracted thesis point text."
-                                    },
-                                    "sentiment_score": {
-                                        "type": "integer",
-                                        "description": "The sentiment score, where 50 is neutral, above 50 is bullish, and below 50 is bearish."
-                                    }
-                                },
-                                "required": ["point", "sentiment_score"],
-                                "additionalProperties": False
+    async def generate():
+        response = await call_llm("gpt-4o", "summarize", lambda: client.responses.create(
+            model="gpt-4o",
+            input=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            text={
+                "format": {
+                    "type": "json_schema",
+                    "name": "thesis_summarization",
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "thesis_points": {
+                                "type": "array",
+                                "items": THESIS_POINT_SCHEMA
                             }
-                        }
-                    },
-                    "required": ["thesis_points"],
-                    "additionalProperties": False
+                        },
+                        "required": ["thesis_points"],
+                        "additionalProperties": False
+                    }
                 }
             }
-        }
-    )
+        ), estimated_tokens=estimate_tokens(system_prompt, user_prompt))
+        return json.loads(response.output_text).get("thesis_points", [])
 
-    result_dict = json.loads(response.output_text).get("thesis_points")
+    result_dict = await cached_llm_output("gpt-4o", "summarize", PROMPT_VERSION, [system_prompt, user_prompt], generate)
     for point in result_dict:
         point["post_id"] = post_id
     return result_dict
 
-def run_summarize_points_from_post(post_id):
-    import asyncio
-    return asyncio.run(summarize_points_from_post(post_id))
+def batch_system_prompt(ticker_symbol: str, ticker_name: str) -> str:
+    return f"""
+    Extract the main thesis points from each of the following financial posts regarding the ticker {ticker_symbol} with the name {ticker_name} in bullet form. Only extract thesis points that relate specifically to this stock; ignore any information or points about other stocks.
+
+    Summarize every post on its own: take the points of a post only from that post, never from the other posts. Return the points of every post under its post_id and include every post_id, with an empty list of thesis points if a post has no thesis points about this stock.
+
+    For each bullet point, please follow these instructions:
 
-async def summarize_all_posts(post_ids):
-    tasks = [asyncio.to_thread(run_summarize_points_from_post, pid) for pid in post_ids]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    # Flatten the list of lists
-    return [point for res in results if isinstance(res, list) for point in res]
+    1. Factual Only: Extract only the factual thesis points; ignore any personal opinions or references to the "user."
+    2. Crisp & Short: Make each bullet point concise and straightforward.
+    3. Omit Ticker/Name: Do not mention the stock name or ticker (assume that every point refers to that ticker).
+    4. Sentiment Score: Assign a sentiment score from 1 to 100 for each bullet point using the following guideline:
+    - A score of 50 is neutral.
+    - Above 50 indicates a bullish/positive sentiment.
+    - Below 50 indicates a bearish/negative sentiment.
+    Ensure that the sentiment score accurately reflects the economic impact of the point (e.g., challenges or drawbacks should get a score below 50)
+    """
+
+def plan_batches(posts: dict) -> tuple:
+    """
+    Packs the short posts of each ticker into batches that stay within SUMMARIZE_BATCH_TOKEN_BUDGET and
+    SUMMARIZE_BATCH_MAX_POSTS. Returns the batches (lists of post ids) and the ids of the posts that are
+    summarized on their own: long posts and posts that ended up alone in a batch.
+    """
+    overhead = estimate_tokens(batch_system_prompt("", ""), output_tokens=0)
+    batches, single_post_ids = [], []
+    open_batches = {}
+    for post_id, post in posts.items():
+        tokens = estimate_tokens(post["content"] or "", output_tokens=BATCH_OUTPUT_TOKENS_PER_POST)
+        if SUMMARIZE_BATCH_MAX_POSTS <= 1 or tokens > SUMMARIZE_BATCH_MAX_POST_TOKENS:
+            single_post_ids.append(post_id)
+            continue
+
+        ticker = (post["ticker_symbol"], post["ticker_name"])
+        batch = open_batches.get(ticker)
+        if batch is None or len(batch["post_ids"]) >= SUMMARIZE_BATCH_MAX_POSTS or batch["tokens"] + tokens > SUMMARIZE_BATCH_TOKEN_BUDGET:
+            batch = {"post_ids": [], "tokens": overhead}
+            open_batches[ticker] = batch
+            batches.append(batch["post_ids"])
+        batch["post_ids"].append(post_id)
+        batch["tokens"] += tokens
+
+    single_post_ids.extend(post_ids[0] for post_ids in batches if len(post_ids) == 1)
+    return [post_ids for post_ids in batches if len(post_ids) > 1], single_post_ids
+
+async def summarize_post_batch(post_ids: list, posts: dict) -> dict:
+    """
+    Summarizes several short posts of the same ticker in one request.
+    Returns {post_id: points} for the posts the response covers.
+    """
+    ticker_symbol = posts[post_ids[0]]["ticker_symbol"]
+    ticker_name = posts[post_ids[0]]["ticker_name"]
+    system_prompt = batch_system_prompt(ticker_symbol, ticker_name)
+    posts_data = [{"post_id": post_id, "content": posts[post_id]["content"]} for post_id in post_ids]
+    user_prompt = f"""
+    Ticker: {ticker_symbol}
+    Name: {ticker_name}
+    posts:
+    {json.dumps(posts_data, indent=2)}
+    """
+
+    async def generate():
+        response = await call_llm("gpt-4o", "summarize_batch", lambda: client.responses.create(
+            model="gpt-4o",
+            input=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            text={
+                "format": {
+                    "type": "json_schema",
+                    "name": "batch_thesis_summarization",
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "posts": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "post_id": {"type": "integer"},
+                                        "thesis_points": {
+                                            "type": "array",
+                                            "items": THESIS_POINT_SCHEMA
+                                        }
+                                    },
+                                    "required": ["post_id", "thesis_points"],
+                                    "additionalProperties": False
+                                }
+                            }
+                        },
+                        "required": ["posts"],
+                        "additionalProperties": False
+                    }
+                }
+            }
+        ), estimated_tokens=estimate_tokens(system_prompt, user_prompt, output_tokens=BATCH_OUTPUT_TOKENS_PER_POST * len(post_ids)))
+        return json.loads(response.output_text).get("posts", [])
+
+    results = await cached_llm_output("gpt-4o", "summarize_batch", PROMPT_VERSION, [system_prompt, user_prompt], generate)
+    return {
+        result["post_id"]: [{**point, "post_id": result["post_id"]} for point in result["thesis_points"]]
+        for result in results
+        if result["post_id"] in post_ids
+    }
+
+async def summarize_points_from_posts(post_ids: list) -> dict:
+    """
+    Summarizes the posts with as few requests as their lengths allow (see plan_batches).
+    Posts a batched request fails on or leaves out are summarized on their own.
+    Returns {post_id: points}, posts that couldn't be summarized are left out.
+    """
+    posts = await asyncio.to_thread(load_posts, post_ids)
+    batches, single_post_ids = plan_batches(posts)
+    points_by_post = {}
+
+    async def summarize_single(post_id):
+        try:
+            points_by_post[post_id] = await summarize_post_content(post_id, posts[post_id])
+        except Exception as e:
+            logging.warning(f"Could not summarize post {post_id}: {e}")
+
+    async def summarize_batch(batch):
+        try:
+            batch_points = await summarize_post_batch(batch, posts)
+        except Exception as e:
+            logging.warning(f"Batched summarization of posts {batch} failed, summarizing them one by one: {e}")
+            batch_points = {}
+        points_by_post.update(batch_points)
+        await asyncio.gather(*(summarize_single(post_id) for post_id in batch if post_id not in batch_points))
+
+    await asyncio.gather(
+        *(summarize_single(post_id) for post_id in single_post_ids),
+        *(summarize_batch(batch) for batch in batches),
+    )
+    return points_by_post
@@ -0,0 +1,82 @@
+import logging
+from redis.exceptions import RedisError
+from database.redis_db import redis_client, async_redis_client
+
+"""
+Per-ticker lease on running an analysis, so concurrent /generate-analysis requests for the same ticker
+share one task instead of scraping and calling the LLMs twice.
+
+The lease 'analysis_lock:<ticker>' holds the task_id of the analysis that owns it. It is taken when the
+job is queued, before any task state is created, and only if it is free: a request for a task that is
+already queued or running (e.g. a resumed one) joins it instead of queuing it a second time.
+The worker renews the lease while the analysis runs. Renewing and releasing only touch the lease if it
+still belongs to the same task, so a task whose lease expired can't release someone else's.
+"""
+
+LOCK_KEY_PREFIX = "analysis_lock:"
+# Covers the time a job waits in the queue, the worker renews it while the analysis runs
+LOCK_LEASE_SECONDS = 30 * 60
+LOCK_RENEW_INTERVAL_SECONDS = 60
+
+# Takes the lease if it's free. Returns the task_id holding the lease and whether it was taken just now.
+ACQUIRE_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if not owner then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    return {ARGV[1], 1}
+end
+return {owner, 0}
+"""
+
+# Takes the lease if it's free or already ours and sets its expiry. Returns the task_id holding the lease.
+CLAIM_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if not owner or owner == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    return ARGV[1]
+end
+return owner
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+acquire_lease = redis_client.register_script(ACQUIRE_SCRIPT)
+claim_lease_async = async_redis_client.register_script(CLAIM_SCRIPT)
+release_lease_async = async_redis_client.register_script(RELEASE_SCRIPT)
+
+
+def lock_key(ticker: str) -> str:
+    return f"{LOCK_KEY_PREFIX}{ticker.lower()}"
+
+
+def acquire_analysis_lock(ticker: str, task_id: str):
+    """
+    Returns (task_id that owns the analysis of the ticker, whether task_id just took the lease). If the lease
+    was taken already, the owner is the analysis queued or running, which may be task_id itself (a resumed task).
+    """
+    owner, acquired = acquire_lease(keys=[lock_key(ticker)], args=[task_id, LOCK_LEASE_SECONDS])
+    return (owner.decode() if isinstance(owner, bytes) else owner), bool(acquired)
+
+
+async def renew_analysis_lock(ticker: str, task_id: str) -> bool:
+    """Extends the lease of a running analysis, returns False if another task owns the ticker now."""
+    try:
+        owner = await claim_lease_async(keys=[lock_key(ticker)], args=[task_id, LOCK_LEASE_SECONDS])
+    except RedisError as e:
+        # Keep running, the lease has enough time left to survive a short Redis outage
+        logging.warning(f"Could not renew analysis lock for {ticker}: {e}")
+        return True
+    owner = owner.decode() if isinstance(owner, bytes) else owner
+    return owner == task_id
+
+
+async def release_analysis_lock(ticker: str, task_id: str):
+    try:
+        await release_lease_async(keys=[lock_key(ticker)], args=[task_id])
+    except RedisError as e:
+        logging.warning(f"Could not release analysis lock for {ticker}, it expires in at most {LOCK_LEASE_SECONDS} seconds: {e}")
@@ -0,0 +1,217 @@
+import logging
+import orjson
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, selectinload, load_only
+from redis.exceptions import RedisError
+from database.models.thesisai import Ticker, Post, Point, Criticism, Comment
+from database.redis_db import redis_client, async_redis_client
+
+SNAPSHOT_KEY_PREFIX = "analysis_snapshot:"
+# Snapshots are rewritten whenever an analysis finishes, the expiry only keeps abandoned tickers from piling up
+SNAPSHOT_EXPIRE_SECONDS = 7 * 24 * 60 * 60
+# Counts the times points were stored for a ticker, so ETags change while an analysis is still running.
+# Also guards the snapshot: a reader only stores a snapshot it rebuilt if the version didn't change meanwhile.
+POINTS_VERSION_KEY_PREFIX = "analysis_points_version:"
+
+# Stores a snapshot rebuilt by a reader unless points were stored (or an analysis finished) since the reader
+# read the points version, i.e. unless the snapshot might be older than the data.
+# KEYS: snapshot, points version. ARGV: points version read before the rebuild, snapshot, expiry.
+STORE_IF_CURRENT_SCRIPT = """
+local version = tonumber(redis.call('GET', KEYS[2])) or 0
+if version ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+store_snapshot_if_current = async_redis_client.register_script(STORE_IF_CURRENT_SCRIPT)
+
+
+def snapshot_key(ticker: str) -> str:
+    return f"{SNAPSHOT_KEY_PREFIX}{ticker.lower()}"
+
+
+def points_version_key(ticker: str) -> str:
+    return f"{POINTS_VERSION_KEY_PREFIX}{ticker.lower()}"
+
+
+def point_payload_options():
+    """Loader options that fetch exactly what point_to_dict needs, without one query per criticism."""
+    return [
+        load_only(Point.id, Point.ticker_id, Point.text, Point.sentiment_score, Point.criticism_exists),
+        selectinload(Point.criticisms)
+        .load_only(Criticism.text, Criticism.validity_score, Criticism.comment_id)
+        .joinedload(Criticism.comment)
+        .load_only(Comment.link),
+    ]
+
+
+def point_to_dict(pt: Point) -> dict:
+    post_obj = pt.post
+    return {
+        "content": pt.text,
+        "sentimentScore": pt.sentiment_score,
+        "postUrl": post_obj.link if post_obj else None,
+        "postTitle": post_obj.title if post_obj else None,
+        "postAuthor": post_obj.author if post_obj else None,
+        "postSource": post_obj.source if post_obj else None,
+        "postDate": post_obj.date_of_post if post_obj else None,
+        "criticismExists": pt.criticism_exists,
+        "criticisms": [
+            {
+                "content": crit.text,
+                "validityScore": crit.validity_score,
+                "commentUrl": crit.comment.link if crit.comment else None
+            }
+            for crit in pt.criticisms
+        ]
+    }
+
+
+def points_payload_statement():
+    """
+    Selects points for the payload in a constant number of queries:
+    one for the points joined with their posts and one for all criticisms joined with their comments.
+    Only the columns the payload needs are loaded (no embeddings or post contents).
+    """
+    return select(Point).options(
+        joinedload(Point.post).load_only(Post.link, Post.title, Post.author, Post.source, Post.date_of_post),
+        *point_payload_options(),
+    )
+
+
+def points_statement(ticker_ids: list):
+    """Selects the points of one or more tickers for the payload."""
+    return points_payload_statement().where(Point.ticker_id.in_(ticker_ids))
+
+
+def group_points_by_ticker(points: list, ticker_ids: list) -> dict:
+    points_by_ticker = {ticker_id: [] for ticker_id in ticker_ids}
+    for pt in points:
+        points_by_ticker[pt.ticker_id].append(point_to_dict(pt))
+    return points_by_ticker
+
+
+def build_points_by_ticker(session, ticker_ids: list) -> dict:
+    """Returns {ticker_id: points_list} for the given tickers."""
+    points = session.execute(points_statement(ticker_ids)).scalars().all()
+    return group_points_by_ticker(points, ticker_ids)
+
+
+async def build_points_by_ticker_async(session, ticker_ids: list) -> dict:
+    points = (await session.execute(points_statement(ticker_ids))).scalars().all()
+    return group_points_by_ticker(points, ticker_ids)
+
+
+def build_points_payload(session, point_ids: list) -> list:
+    """Returns the payloads of the given points, JSON encoded like the points of a snapshot."""
+    points = session.execute(points_payload_statement().where(Point.id.in_(point_ids))).scalars().all()
+    return jsonable_encoder([point_to_dict(pt) for pt in points])
+
+
+def build_company_data(ticker_obj: Ticker) -> dict:
+    return {
+        "ticker": ticker_obj.symbol,
+        "title": ticker_obj.name,
+        "description": ticker_obj.description,
+        "sentimentScore": ticker_obj.overall_sentiment_score,
+    }
+
+
+def assemble_analysis_snapshot(ticker_obj: Ticker, points_list: list) -> dict:
+    """
+    Builds the database part of the /retrieve-analysis payload for a ticker.
+    The result is already JSON encoded (dates as ISO strings) so it looks the same
+    whether it was just built or read back from Redis.
+    """
+    snapshot = {
+        "last_analyzed": ticker_obj.last_analyzed,
+        "company": build_company_data(ticker_obj),
+        "points": points_list,
+    }
+    return jsonable_encoder(snapshot)
+
+
+def build_analysis_snapshot(session, ticker_obj: Ticker) -> dict:
+    points_by_ticker = build_points_by_ticker(session, [ticker_obj.id])
+    return assemble_analysis_snapshot(ticker_obj, points_by_ticker[ticker_obj.id])
+
+
+async def build_analysis_snapshot_async(session, ticker_obj: Ticker) -> dict:
+    points_by_ticker = await build_points_by_ticker_async(session, [ticker_obj.id])
+    return assemble_analysis_snapshot(ticker_obj, points_by_ticker[ticker_obj.id])
+
+
+def get_analysis_snapshot(ticker: str):
+    """Returns the stored snapshot for a ticker or None on a miss."""
+    try:
+        value = redis_client.get(snapshot_key(ticker))
+    except RedisError as e:
+        logging.warning(f"Could not read analysis snapshot for {ticker}: {e}")
+        return None
+
+    if value:
+        return orjson.loads(value)
+    return None
+
+
+def store_analysis_snapshot(snapshot: dict):
+    """
+    Stores the snapshot of a finished analysis. Bumps the points version with it, so a reader that rebuilt
+    the snapshot from the data as it was before can't overwrite this one.
+    """
+    ticker = snapshot["company"]["ticker"]
+    try:
+        with redis_client.pipeline() as pipe:
+            pipe.incr(points_version_key(ticker))
+            pipe.set(snapshot_key(ticker), orjson.dumps(snapshot), ex=SNAPSHOT_EXPIRE_SECONDS)
+            pipe.execute()
+    except RedisError as e:
+        logging.warning(f"Could not store analysis snapshot for {ticker}: {e}")
+
+
+async def get_analysis_snapshot_async(ticker: str):
+    try:
+        value = await async_redis_client.get(snapshot_key(ticker))
+    except RedisError as e:
+        logging.warning(f"Could not read analysis snapshot for {ticker}: {e}")
+        return None
+
+    if value:
+        return orjson.loads(value)
+    return None
+
+
+async def store_analysis_snapshot_async(snapshot: dict, points_version: int):
+    """Stores a snapshot rebuilt from the database, unless the points version changed since it was read."""
+    ticker = snapshot["company"]["ticker"]
+    try:
+        await store_snapshot_if_current(
+            keys=[snapshot_key(ticker), points_version_key(ticker)],
+            args=[points_version, orjson.dumps(snapshot), SNAPSHOT_EXPIRE_SECONDS],
+        )
+    except RedisError as e:
+        logging.warning(f"Could not store analysis snapshot for {ticker}: {e}")
+
+
+def invalidate_analysis_snapshot(ticker: str):
+    """Called whenever points of the ticker were stored: drops the snapshot and bumps the points version."""
+    try:
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.delete(snapshot_key(ticker))
+            pipe.incr(points_version_key(ticker))
+            pipe.execute()
+    except RedisError as e:
+        logging.warning(f"Could not invalidate analysis snapshot for {ticker}: {e}")
+
+
+async def get_points_version_async(ticker: str):
+    """Returns the points version of the ticker, or None if it can't be read."""
+    try:
+        version = await async_redis_client.get(points_version_key(ticker))
+    except RedisError as e:
+        logging.warning(f"Could not read points version for {ticker}: {e}")
+        return None
+    return int(version) if version else 0
@@ -1,6 +1,6 @@
-from database.db import session_scope
+from database.db import session_scope, async_session_scope
 from database.models.thesisai import Ticker
-from sqlalchemy import func
+from sqlalchemy import func, select
 
 
 def check_ticker_in_database(ticker: str):
@@ -11,4 +11,16 @@ def check_ticker_in_database(ticker: str):
     if result is not None:
         return True, result[0]
     else:
-        return False, None
\ No newline at end of file
+        return False, None
+
+
+async def check_ticker_in_database_async(ticker: str):
+    
+    async with async_session_scope() as session:
+        stmt = select(Ticker.last_analyzed).where(func.lower(Ticker.symbol) == ticker.lower())
+        result = (await session.execute(stmt)).first()
+
+    if result is not None:
+        return True, result[0]
+    else:
+        return False, None
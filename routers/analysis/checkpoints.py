@@ -0,0 +1,100 @@
+import logging
+import orjson
+from redis.exceptions import RedisError
+from database.redis_db import redis_client
+
+"""
+Checkpoints of a running analysis, so a failed or interrupted analysis resumes from its last completed
+stage instead of scraping and paying for the LLM calls of the earlier stages again.
+
+The hash 'analysis_checkpoint:<task_id>' records the completed stages of start_analysis_process under their
+stage number, and for every post the stage it reached in the pipeline together with that stage's output.
+When an analysis fails, its task_id is remembered per ticker and the next /generate-analysis for the ticker
+resumes that task. The marker is cleared as the task is queued again, so later requests join the running
+task instead of resuming it a second time. A job requeued after a worker crash keeps its task_id and
+resumes by itself.
+The checkpoint is deleted once the analysis completes.
+"""
+
+CHECKPOINT_KEY_PREFIX = "analysis_checkpoint:"
+RESUMABLE_KEY_PREFIX = "analysis_checkpoint:resumable:"
+# Posts are checkpointed one by one as they move through the pipeline, under 'post:<url>'
+POST_FIELD_PREFIX = "post:"
+# Scraped posts get outdated, after a day a retry starts from scratch
+CHECKPOINT_EXPIRE_SECONDS = 24 * 60 * 60
+
+
+def checkpoint_key(task_id: str) -> str:
+    return f"{CHECKPOINT_KEY_PREFIX}{task_id}"
+
+
+def resumable_key(ticker: str) -> str:
+    return f"{RESUMABLE_KEY_PREFIX}{ticker.lower()}"
+
+
+def load_checkpoint(task_id: str):
+    """Returns ({stage: output} of the completed stages, {post url: record} of the posts) of the task."""
+    try:
+        raw_fields = redis_client.hgetall(checkpoint_key(task_id))
+    except RedisError as e:
+        logging.warning(f"Could not load checkpoint of task {task_id}, starting from scratch: {e}")
+        return {}, {}
+
+    stages, posts = {}, {}
+    for field, output in raw_fields.items():
+        field = field.decode()
+        if field.startswith(POST_FIELD_PREFIX):
+            posts[field[len(POST_FIELD_PREFIX):]] = orjson.loads(output)
+        else:
+            stages[int(field)] = orjson.loads(output)
+    return stages, posts
+
+
+def save_checkpoint(task_id: str, stage, output=None):
+    try:
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset(checkpoint_key(task_id), stage, orjson.dumps(output, option=orjson.OPT_SERIALIZE_NUMPY))
+            pipe.expire(checkpoint_key(task_id), CHECKPOINT_EXPIRE_SECONDS)
+            pipe.execute()
+    except (RedisError, orjson.JSONEncodeError) as e:
+        # The analysis itself can go on, it just won't be able to resume from this stage
+        logging.warning(f"Could not save checkpoint of stage {stage} for task {task_id}: {e}")
+
+
+def save_post_checkpoint(task_id: str, url: str, record: dict):
+    save_checkpoint(task_id, f"{POST_FIELD_PREFIX}{url}", record)
+
+
+def mark_resumable(ticker: str, task_id: str):
+    """Remembers a failed analysis so the next request for the ticker continues it."""
+    try:
+        if redis_client.exists(checkpoint_key(task_id)):
+            redis_client.set(resumable_key(ticker), task_id, ex=CHECKPOINT_EXPIRE_SECONDS)
+    except RedisError as e:
+        logging.warning(f"Could not mark task {task_id} as resumable: {e}")
+
+
+def find_resumable_task(ticker: str):
+    """Returns the task_id of a failed analysis of the ticker that still has a checkpoint, or None."""
+    try:
+        task_id = redis_client.get(resumable_key(ticker))
+        if task_id and redis_client.exists(checkpoint_key(task_id.decode())):
+            return task_id.decode()
+    except RedisError as e:
+        logging.warning(f"Could not look up resumable analysis for {ticker}: {e}")
+    return None
+
+
+def clear_resumable_task(ticker: str):
+    """Called once the resumed task is queued. Its lease keeps other requests from resuming it meanwhile."""
+    try:
+        redis_client.delete(resumable_key(ticker))
+    except RedisError as e:
+        logging.warning(f"Could not clear resumable analysis of {ticker}: {e}")
+
+
+def delete_checkpoint(ticker: str, task_id: str):
+    try:
+        redis_client.delete(checkpoint_key(task_id), resumable_key(ticker))
+    except RedisError as e:
+        logging.warning(f"Could not delete checkpoint of task {task_id}: {e}")
@@ -3,9 +3,10 @@ from typing import List, Dict
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from datetime import datetime
-from database.models.thesisai import Post, Ticker, Comment, Point, Criticism
+from database.models.thesisai import Post, Ticker, Comment, Point, Criticism, AnalysisRun
 from database.db import session_scope
 from .check_existing_analysis import check_ticker_in_database
+from .telemetry import RunTelemetry
 
 
 
@@ -67,10 +68,12 @@ def commit_posts_to_db(
     return new_post_ids
 
 
-def commit_final_points_to_db(points_list: List[Dict]):
+def commit_final_points_to_db(points_list: List[Dict]) -> List[int]:
+    """Stores the points with their criticisms and returns the ids of the stored points."""
     if not points_list:
-        return
+        return []
 
+    new_point_ids = []
     with session_scope() as session:
         # We assume that all points are for posts with the same ticker.
         post_obj = session.query(Post).filter(
@@ -99,11 +102,15 @@ def commit_final_points_to_db(points_list: List[Dict]):
                         new_point.criticisms.append(new_criticism)
 
                     session.add(new_point)
+                    session.flush()  # to assign an id
+
+                new_point_ids.append(new_point.id)
             except Exception as e:
                 logging.warning(
                     "Error processing point for post %s: %s", pt_data.get("post_id"), str(e)
                 )
                 continue
+    return new_point_ids
 
 
 def commit_overall_sentiment_score(ticker_id: int, overall_sentiment_score: int):
@@ -111,3 +118,22 @@ def commit_overall_sentiment_score(ticker_id: int, overall_sentiment_score: int)
         ticker_obj = session.get(Ticker, ticker_id)
         ticker_obj.overall_sentiment_score = overall_sentiment_score
         session.commit()
+
+
+def commit_analysis_run(run: RunTelemetry, ticker_id, status: str, duration_seconds: float, error: str = None):
+    with session_scope() as session:
+        session.add(AnalysisRun(
+            task_id=run.task_id,
+            ticker_id=ticker_id,
+            ticker_symbol=run.ticker.lower(),
+            status=status,
+            started_at=datetime.fromtimestamp(run.started_at),
+            finished_at=datetime.now(),
+            duration_seconds=duration_seconds,
+            stage_seconds=run.stage_seconds,
+            item_counts=run.items,
+            failures=run.failures,
+            input_tokens=run.input_tokens,
+            output_tokens=run.output_tokens,
+            error=error
+        ))
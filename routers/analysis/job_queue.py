@@ -0,0 +1,151 @@
+import json
+import logging
+import time
+import uuid
+from redis.exceptions import RedisError
+from database.redis_db import redis_client, async_redis_client
+from .task_store import create_task, finish_task
+from .analysis_lock import acquire_analysis_lock, release_analysis_lock
+from .checkpoints import mark_resumable, find_resumable_task, clear_resumable_task
+from .ai.llm_limiter import INTERACTIVE
+
+"""
+Redis-backed queue of analysis jobs.
+
+The API pushes jobs onto QUEUE_KEY and returns right away, the analysis itself runs in worker.py.
+A worker atomically moves a job from the queue into its own processing list (BLMOVE) before running it
+and removes it from there once the analysis has finished, so a job is never lost between the two.
+If a worker dies mid-job its heartbeat key expires and the other workers put its unfinished jobs
+back onto the queue (up to MAX_ATTEMPTS runs per job).
+"""
+
+QUEUE_KEY = "analysis_jobs:queue"
+PROCESSING_KEY_PREFIX = "analysis_jobs:processing:"
+WORKERS_KEY = "analysis_jobs:workers"
+HEARTBEAT_KEY_PREFIX = "analysis_jobs:heartbeat:"
+
+HEARTBEAT_INTERVAL_SECONDS = 10
+HEARTBEAT_EXPIRE_SECONDS = 30
+# How long a worker blocks waiting for a job before checking whether it should shut down
+DEQUEUE_TIMEOUT_SECONDS = 5
+MAX_ATTEMPTS = 3
+
+
+def processing_key(worker_id: str) -> str:
+    return f"{PROCESSING_KEY_PREFIX}{worker_id}"
+
+
+def heartbeat_key(worker_id: str) -> str:
+    return f"{HEARTBEAT_KEY_PREFIX}{worker_id}"
+
+
+def new_worker_id() -> str:
+    return uuid.uuid4().hex
+
+
+def enqueue_analysis_job(task_id: str, params: dict, priority: str = INTERACTIVE) -> int:
+    """
+    Queues an analysis and returns the number of jobs waiting in the queue (including this one).
+    The priority is the lane of the analysis' LLM requests (see ai/llm_limiter.py).
+    """
+    job = {"task_id": task_id, "params": params, "priority": priority, "attempts": 0, "enqueued_at": time.time()}
+    # Jobs are pushed on the left and taken from the right, so the queue is first in first out
+    return redis_client.lpush(QUEUE_KEY, json.dumps(job))
+
+
+def submit_analysis(ticker: str, params: dict, priority: str = INTERACTIVE):
+    """
+    Creates the task of an analysis of the ticker and queues it. Only one analysis per ticker runs at a time,
+    if one is already queued or running, that analysis is joined instead.
+    Returns (task_id, queue position), the queue position is None when an existing analysis was joined.
+    """
+    # A failed analysis of the ticker is continued from its last completed stage instead of starting over
+    resumable_task_id = find_resumable_task(ticker)
+    task_id = resumable_task_id or str(uuid.uuid4())
+
+    # The lease is taken before touching any task state, so joining an analysis never resets it
+    owner_task_id, acquired = acquire_analysis_lock(ticker, task_id)
+    if not acquired:
+        return owner_task_id, None
+    if resumable_task_id:
+        clear_resumable_task(ticker)
+
+    # Initialize the task in Redis with "pending" state
+    create_task(task_id, ticker)
+
+    return task_id, enqueue_analysis_job(task_id, {"ticker": ticker, **params}, priority)
+
+
+def queue_length() -> int:
+    return redis_client.llen(QUEUE_KEY)
+
+
+async def dequeue_job(worker_id: str):
+    """Waits up to DEQUEUE_TIMEOUT_SECONDS for a job and returns (raw job, job) or None."""
+    raw_job = await async_redis_client.blmove(
+        QUEUE_KEY, processing_key(worker_id), DEQUEUE_TIMEOUT_SECONDS, "RIGHT", "LEFT"
+    )
+    if raw_job is None:
+        return None
+    return raw_job, json.loads(raw_job)
+
+
+async def acknowledge_job(worker_id: str, raw_job: bytes):
+    """Removes a finished job from the worker's processing list."""
+    await async_redis_client.lrem(processing_key(worker_id), 1, raw_job)
+
+
+async def register_worker(worker_id: str):
+    await async_redis_client.sadd(WORKERS_KEY, worker_id)
+    await async_redis_client.set(heartbeat_key(worker_id), int(time.time()), ex=HEARTBEAT_EXPIRE_SECONDS)
+
+
+def send_heartbeat(worker_id: str):
+    # Sync, the worker sends heartbeats from a thread of their own
+    redis_client.set(heartbeat_key(worker_id), int(time.time()), ex=HEARTBEAT_EXPIRE_SECONDS)
+
+
+async def unregister_worker(worker_id: str):
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        pipe.srem(WORKERS_KEY, worker_id)
+        pipe.delete(heartbeat_key(worker_id))
+        await pipe.execute()
+
+
+async def requeue_orphaned_jobs() -> int:
+    """Puts the unfinished jobs of workers without a heartbeat back at the front of the queue."""
+    requeued = 0
+    for raw_worker_id in await async_redis_client.smembers(WORKERS_KEY):
+        worker_id = raw_worker_id.decode()
+        if await async_redis_client.exists(heartbeat_key(worker_id)):
+            continue
+
+        while True:
+            raw_job = await async_redis_client.rpop(processing_key(worker_id))
+            if raw_job is None:
+                break
+            job = json.loads(raw_job)
+            job["attempts"] += 1
+
+            if job["attempts"] >= MAX_ATTEMPTS:
+                logging.error(f"Analysis job {job['task_id']} was interrupted {job['attempts']} times, giving up")
+                await mark_task_failed(job["task_id"])
+                mark_resumable(job["params"]["ticker"], job["task_id"])
+                await release_analysis_lock(job["params"]["ticker"], job["task_id"])
+                continue
+
+            logging.warning(f"Requeuing analysis job {job['task_id']} of stopped worker {worker_id}")
+            # The right end is dequeued next, the job has waited long enough
+            await async_redis_client.rpush(QUEUE_KEY, json.dumps(job))
+            requeued += 1
+
+        await async_redis_client.srem(WORKERS_KEY, worker_id)
+
+    return requeued
+
+
+async def mark_task_failed(task_id: str, error: str = "The analysis was interrupted. Please try again later or contact support."):
+    try:
+        await finish_task(task_id, "failed", 100, error=error)
+    except RedisError as e:
+        logging.warning(f"Could not mark task {task_id} as failed: {e}")
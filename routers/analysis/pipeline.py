@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import time
+from sqlalchemy import select
+from database.db import session_scope
+from database.models.thesisai import Post
+from .scraping import stream_scraped_content
+from .commit_to_db import commit_posts_to_db, commit_final_points_to_db
+from .ai.summarize_post import summarize_points_from_posts, SUMMARIZE_BATCH_MAX_POSTS
+from .ai.filter_points import PointDeduplicator
+from .ai.extract_criticisms import process_post_group
+from .analysis_snapshot import invalidate_analysis_snapshot, build_points_payload
+from .checkpoints import save_checkpoint, save_post_checkpoint
+from .task_store import publish_task_event
+from .telemetry import RunTelemetry
+
+"""
+Streaming analysis pipeline: every post flows through
+
+    commit post -> summarize -> embed / deduplicate -> criticisms + commit points
+
+as soon as it is scraped, instead of each stage waiting for all posts to finish the previous one.
+The stages are connected by bounded queues and each stage runs a fixed number of workers, so a slow
+stage holds back the ones before it (down to the scrapers) instead of piling up work in memory.
+Summarization takes the posts that are ready in batches, so short posts can share a request (see summarize_post.py).
+
+Every post is checkpointed with the stage it reached, so an interrupted analysis picks up each post where it was.
+"""
+
+# Stages a post can be at, numbered like PROGRESS_STAGES in run_analysis
+POST_SCRAPED = 2
+POST_COMMITTED = 4
+POST_SUMMARIZED = 5
+POST_DEDUPLICATED = 6
+POST_CRITICIZED = 7
+POST_STORED = 8
+
+# Stage numbers of start_analysis_process that are checkpointed as a whole
+SCRAPING_DONE_STAGE = 2
+
+QUEUE_SIZE = 16
+# Workers per stage, the LLM stages get the most since they spend their time waiting on the API
+STAGE_CONCURRENCY = {
+    "commit": 2,
+    # Every summarize worker handles a batch of up to SUMMARIZE_BATCH_MAX_POSTS posts at a time
+    "summarize": 4,
+    "deduplicate": 4,
+    "criticisms": 8,
+}
+NEXT_STAGE = {
+    "commit": "summarize",
+    "summarize": "deduplicate",
+    "deduplicate": "criticisms",
+    "criticisms": None,
+}
+# Queue a checkpointed post re-enters the pipeline at
+RESUME_STAGE = {
+    POST_SCRAPED: "commit",
+    POST_COMMITTED: "summarize",
+    POST_SUMMARIZED: "deduplicate",
+    POST_DEDUPLICATED: "criticisms",
+    POST_CRITICIZED: "criticisms",
+}
+
+# How long a batch waits for more posts once its first post is ready
+BATCH_WAIT_SECONDS = 1.0
+BATCH_POLL_SECONDS = 0.05
+
+# Tells a stage worker that no more posts will come
+STOP = object()
+
+
+def load_existing_links(ticker_id: int) -> set:
+    with session_scope() as session:
+        return set(session.execute(select(Post.link).where(Post.ticker_id == ticker_id)).scalars())
+
+
+def publish_stored_points(task_id: str, point_ids: list):
+    """Sends newly stored points to the clients following the analysis (/analysis-events)."""
+    if not point_ids:
+        return
+    try:
+        with session_scope() as session:
+            points = build_points_payload(session, point_ids)
+        publish_task_event(task_id, "points", points)
+    except Exception as e:
+        # The points are stored either way, clients just see them once the analysis completes
+        logging.warning(f"Could not publish stored points of task {task_id}: {e}")
+
+
+class AnalysisPipeline:
+    def __init__(self, task_id: str, ticker: str, ticker_id: int, post_records: dict, on_progress, telemetry: RunTelemetry):
+        self.task_id = task_id
+        self.ticker = ticker
+        self.ticker_id = ticker_id
+        # {post url: checkpoint record} of posts an earlier run of this task got to
+        self.records = post_records
+        self.on_progress = on_progress
+        self.telemetry = telemetry
+        self.routed_urls = set()
+        self.existing_links = set()
+        self.deduplicator = PointDeduplicator(ticker_id)
+        self.queues = {stage: asyncio.Queue(maxsize=QUEUE_SIZE) for stage in STAGE_CONCURRENCY}
+
+    async def checkpoint(self, url: str, record: dict):
+        self.records[url] = record
+        await asyncio.to_thread(save_post_checkpoint, self.task_id, url, record)
+        await self.on_progress(record["stage"])
+
+    async def route_post(self, url: str, record: dict):
+        self.routed_urls.add(url)
+        stage = RESUME_STAGE.get(record["stage"])
+        if stage is not None:
+            await self.queues[stage].put((url, record))
+
+    async def handle_scraped_post(self, post: dict):
+        url = post.get("url")
+        if url in self.routed_urls:
+            # The same post showed up in several subreddits
+            return
+        if url in self.records:
+            await self.route_post(url, self.records[url])
+            return
+        if url in self.existing_links:
+            # Analyzed in an earlier analysis
+            return
+
+        self.telemetry.count("posts_scraped")
+        record = {"stage": POST_SCRAPED, "post": post}
+        await self.checkpoint(url, record)
+        await self.route_post(url, record)
+
+    async def commit_post(self, url: str, record: dict):
+        post_ids = await asyncio.to_thread(
+            commit_posts_to_db, posts_data=[record["post"]], ticker_symbol=self.ticker, session_scope=session_scope
+        )
+        if not post_ids:
+            return None
+        self.telemetry.count("posts_committed")
+
+        # The post itself is in the database now, the checkpoint only needs its id
+        record = {"stage": POST_COMMITTED, "post_id": post_ids[0]}
+        await self.checkpoint(url, record)
+        return record
+
+    async def summarize_posts(self, items: list):
+        points_by_post = await summarize_points_from_posts([record["post_id"] for _, record in items])
+        summarized = []
+        for url, record in items:
+            points = points_by_post.get(record["post_id"])
+            if points is None:
+                # Like a failing stage of a single post, the post is dropped
+                logging.warning(f"Analysis stage 'summarize' failed for post {url}")
+                self.telemetry.record_failure("summarize")
+                continue
+            self.telemetry.count("points_extracted", len(points))
+            record = {"stage": POST_SUMMARIZED, "post_id": record["post_id"], "points": points}
+            await self.checkpoint(url, record)
+            summarized.append((url, record))
+        return summarized
+
+    async def deduplicate_points(self, url: str, record: dict):
+        unique_points = await self.deduplicator.filter_post_points(record["points"])
+        self.telemetry.count("points_unique", len(unique_points))
+        if not unique_points:
+            await self.checkpoint(url, {"stage": POST_STORED, "post_id": record["post_id"]})
+            return None
+
+        record = {"stage": POST_DEDUPLICATED, "post_id": record["post_id"], "points": unique_points}
+        await self.checkpoint(url, record)
+        return record
+
+    async def criticize_and_store_points(self, url: str, record: dict):
+        if record["stage"] == POST_DEDUPLICATED:
+            points = await process_post_group(record["post_id"], record["points"], self.ticker)
+            record = {"stage": POST_CRITICIZED, "post_id": record["post_id"], "points": points}
+            await self.checkpoint(url, record)
+
+        point_ids = await asyncio.to_thread(commit_final_points_to_db, record["points"])
+        self.telemetry.count("points_stored", len(point_ids))
+        # Readers see the points as soon as they are stored, the final snapshot is built when the analysis completes
+        await asyncio.to_thread(invalidate_analysis_snapshot, self.ticker)
+        await asyncio.to_thread(publish_stored_points, self.task_id, point_ids)
+        await self.checkpoint(url, {"stage": POST_STORED, "post_id": record["post_id"]})
+        return None
+
+    async def run_stage(self, stage: str, handler):
+        queue = self.queues[stage]
+        next_stage = NEXT_STAGE[stage]
+
+        async def worker():
+            while (item := await queue.get()) is not STOP:
+                url, record = item
+                try:
+                    with self.telemetry.time_stage(stage):
+                        result = await handler(url, record)
+                except Exception as e:
+                    # Like before, a post failing in one stage doesn't fail the whole analysis
+                    logging.warning(f"Analysis stage '{stage}' failed for post {url}: {e}")
+                    continue
+                if result is not None and next_stage is not None:
+                    await self.queues[next_stage].put((url, result))
+
+        await asyncio.gather(*(worker() for _ in range(STAGE_CONCURRENCY[stage])))
+        await self.stop_next_stage(stage)
+
+    async def next_batch(self, queue: asyncio.Queue, max_size: int):
+        """
+        Waits for the next post, then collects the posts arriving within BATCH_WAIT_SECONDS, up to max_size.
+        Returns the batch and whether the stage was told to stop.
+        """
+        item = await queue.get()
+        if item is STOP:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + BATCH_WAIT_SECONDS
+        while len(batch) < max_size:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                if time.monotonic() >= deadline:
+                    break
+                await asyncio.sleep(BATCH_POLL_SECONDS)
+                continue
+            if item is STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def run_batched_stage(self, stage: str, handler, max_batch_size: int):
+        """Like run_stage, for handlers that take a list of (url, record) and return the pairs to pass on."""
+        queue = self.queues[stage]
+        next_stage = NEXT_STAGE[stage]
+
+        async def worker():
+            stopped = False
+            while not stopped:
+                batch, stopped = await self.next_batch(queue, max_batch_size)
+                if not batch:
+                    continue
+                try:
+                    with self.telemetry.time_stage(stage):
+                        results = await handler(batch)
+                except Exception as e:
+                    logging.warning(f"Analysis stage '{stage}' failed for posts {[url for url, _ in batch]}: {e}")
+                    continue
+                if next_stage is not None:
+                    for result in results:
+                        await self.queues[next_stage].put(result)
+
+        await asyncio.gather(*(worker() for _ in range(STAGE_CONCURRENCY[stage])))
+        await self.stop_next_stage(stage)
+
+    async def stop_next_stage(self, stage: str):
+        next_stage = NEXT_STAGE[stage]
+        if next_stage is not None:
+            for _ in range(STAGE_CONCURRENCY[next_stage]):
+                await self.queues[next_stage].put(STOP)
+
+    async def run(self, scrape_params: dict, scraping_done: bool):
+        """Runs all posts through the pipeline and returns once every post is stored or dropped."""
+        self.existing_links = await asyncio.to_thread(load_existing_links, self.ticker_id)
+        await self.deduplicator.load_existing_points()
+        for record in self.records.values():
+            # Points an earlier run accepted but didn't store yet still count for deduplication
+            if record["stage"] in (POST_DEDUPLICATED, POST_CRITICIZED):
+                self.deduplicator.add_accepted_points(record["points"])
+
+        stage_tasks = [
+            asyncio.create_task(self.run_stage("commit", self.commit_post)),
+            asyncio.create_task(self.run_batched_stage("summarize", self.summarize_posts, SUMMARIZE_BATCH_MAX_POSTS)),
+            asyncio.create_task(self.run_stage("deduplicate", self.deduplicate_points)),
+            asyncio.create_task(self.run_stage("criticisms", self.criticize_and_store_points)),
+        ]
+        try:
+            if not scraping_done:
+                with self.telemetry.time_stage("scraping"):
+                    await stream_scraped_content(self.handle_scraped_post, **scrape_params)
+                save_checkpoint(self.task_id, SCRAPING_DONE_STAGE)
+
+            # Checkpointed posts that weren't scraped again (or all of them if scraping had finished before)
+            for url, record in list(self.records.items()):
+                if url not in self.routed_urls:
+                    await self.route_post(url, record)
+
+            for _ in range(STAGE_CONCURRENCY["commit"]):
+                await self.queues["commit"].put(STOP)
+            await asyncio.gather(*stage_tasks)
+        except BaseException:
+            for task in stage_tasks:
+                task.cancel()
+            raise
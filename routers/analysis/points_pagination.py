@@ -0,0 +1,86 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import contains_eager
+from database.models.thesisai import Point, Post
+from .analysis_snapshot import point_payload_options
+
+"""
+Keyset (cursor) pagination over the points of a ticker.
+
+Points are ordered by (sort column, point id) so the order is total and a page boundary is fully
+described by the last row's sort value and id. The cursor is that pair, base64 encoded together with
+the ordering it belongs to, so it can't accidentally be reused with a different ordering.
+"""
+
+# Posts without a date sort as if they were the oldest ones
+MISSING_POST_DATE = datetime(1970, 1, 1)
+
+ORDER_COLUMNS = {
+    "sentiment": Point.sentiment_score,
+    "date": func.coalesce(Post.date_of_post, MISSING_POST_DATE),
+}
+
+
+def sort_value_of(pt: Point, order_by: str):
+    if order_by == "sentiment":
+        return pt.sentiment_score
+    return pt.post.date_of_post or MISSING_POST_DATE
+
+
+def encode_cursor(pt: Point, order_by: str, descending: bool) -> str:
+    sort_value = sort_value_of(pt, order_by)
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+
+    cursor = {"o": order_by, "d": descending, "v": sort_value, "id": pt.id}
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+
+def decode_cursor(cursor: str, order_by: str, descending: bool):
+    """Returns (sort value, point id) of the cursor, raises ValueError if it's malformed or for another ordering."""
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        sort_value, point_id = decoded["v"], int(decoded["id"])
+        # The sort value goes into the query as is, so it must have the type of the sort column
+        if order_by == "date":
+            sort_value = datetime.fromisoformat(sort_value)
+        elif isinstance(sort_value, bool) or not isinstance(sort_value, int):
+            raise TypeError(f"Sentiment cursor value must be an integer, not {sort_value!r}")
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError("Malformed cursor") from e
+
+    if decoded.get("o") != order_by or decoded.get("d") != descending:
+        raise ValueError("Cursor belongs to a different ordering")
+
+    return sort_value, point_id
+
+
+def points_page_statement(ticker_id: int, order_by: str, descending: bool, cursor: str = None):
+    """
+    Returns the ordered select of the ticker's points after the cursor (or from the start).
+    Posts are joined (not lazy loaded) and criticisms are selectin-loaded per batch,
+    so this works both for a limited page and for a streamed server-side cursor.
+    """
+    sort_column = ORDER_COLUMNS[order_by]
+
+    stmt = (
+        select(Point)
+        .join(Point.post)
+        .where(Point.ticker_id == ticker_id)
+        .options(
+            contains_eager(Point.post).load_only(Post.link, Post.title, Post.author, Post.source, Post.date_of_post),
+            *point_payload_options(),
+        )
+    )
+
+    if cursor:
+        sort_value, point_id = decode_cursor(cursor, order_by, descending)
+        row_key = tuple_(sort_column, Point.id)
+        cursor_key = tuple_(sort_value, point_id)
+        stmt = stmt.where(row_key < cursor_key if descending else row_key > cursor_key)
+
+    if descending:
+        return stmt.order_by(sort_column.desc(), Point.id.desc())
+    return stmt.order_by(sort_column.asc(), Point.id.asc())
@@ -0,0 +1,43 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from redis.exceptions import RedisError
+from database.redis_db import redis_client, async_redis_client
+
+"""
+How often each ticker's analysis is viewed, counted per day in the sorted sets 'ticker_views:<YYYY-MM-DD>'
+(member = lowercase ticker, score = views). The refresh scheduler uses it to keep popular tickers fresh.
+"""
+
+VIEWS_KEY_PREFIX = "ticker_views:"
+POPULARITY_WINDOW_DAYS = 7
+
+
+def views_key(day) -> str:
+    return f"{VIEWS_KEY_PREFIX}{day.isoformat()}"
+
+
+def recent_days(days: int) -> list:
+    today = datetime.now(timezone.utc).date()
+    return [today - timedelta(days=offset) for offset in range(days)]
+
+
+async def record_ticker_view(ticker: str):
+    key = views_key(recent_days(1)[0])
+    try:
+        async with async_redis_client.pipeline(transaction=False) as pipe:
+            pipe.zincrby(key, 1, ticker.lower())
+            # Days drop out of the window on their own
+            pipe.expire(key, (POPULARITY_WINDOW_DAYS + 1) * 24 * 60 * 60)
+            await pipe.execute()
+    except RedisError as e:
+        logging.warning(f"Could not record view of {ticker}: {e}")
+
+
+def get_ticker_views(days: int = POPULARITY_WINDOW_DAYS) -> dict:
+    """Returns {lowercase ticker: views} over the last `days` days."""
+    try:
+        views = redis_client.zunion([views_key(day) for day in recent_days(days)], withscores=True)
+    except RedisError as e:
+        logging.warning(f"Could not load ticker views: {e}")
+        return {}
+    return {ticker.decode(): score for ticker, score in views}
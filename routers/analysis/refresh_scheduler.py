@@ -0,0 +1,189 @@
+import logging
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from sqlalchemy import select, func, or_
+from database.db import session_scope
+from database.models.thesisai import Ticker, Post
+from database.redis_db import redis_client
+from .popularity import get_ticker_views
+from .job_queue import submit_analysis
+from .task_store import get_task, task_finished
+from .ai.llm_limiter import BACKGROUND
+
+"""
+Refreshes analyses before users ask for them, so popular tickers are already up to date when they are opened.
+
+Every round ranks the analyzed tickers by how stale their analysis is, weighted by how often the analysis
+was viewed recently (popularity) and how many posts about the ticker came out recently (activity), and queues
+refreshes for the top ones. Two caps keep it from crowding out the analyses users start themselves:
+at most SCHEDULER_MAX_CONCURRENT scheduled analyses are queued or running at once, and the posts they may
+scrape per day (each one costs a handful of LLM calls) are limited to SCHEDULER_DAILY_POST_BUDGET.
+
+Refreshes are incremental: posts that were analyzed before are skipped by the pipeline, and reddit is only
+searched over the shortest timeframe that covers the time since the last analysis.
+"""
+
+ENV_PATH = os.getenv("ENV_PATH")
+load_dotenv(ENV_PATH)
+
+SCHEDULER_INTERVAL_SECONDS = int(os.getenv("SCHEDULER_INTERVAL_SECONDS", 300))
+SCHEDULER_MAX_CONCURRENT = int(os.getenv("SCHEDULER_MAX_CONCURRENT", 2))
+SCHEDULER_DAILY_POST_BUDGET = int(os.getenv("SCHEDULER_DAILY_POST_BUDGET", 500))
+# Analyses younger than this are never refreshed by the scheduler
+SCHEDULER_MIN_STALENESS_HOURS = float(os.getenv("SCHEDULER_MIN_STALENESS_HOURS", 6))
+
+DEFAULT_SUBREDDITS = os.getenv("REDDIT_DEFAULT_SUBREDDITS", "").split(",")
+DEFAULT_REDDIT_TIMEFRAME = os.getenv("REDDIT_DEFAULT_TIMEFRAME")
+DEFAULT_REDDIT_NUM_POSTS = int(os.getenv("REDDIT_DEFAULT_NUM_POSTS", 0))
+DEFAULT_SEEKINGALPHA_NUM_POSTS = int(os.getenv("SEEKINGALPHA_DEFAULT_NUM_POSTS", 0))
+
+ACTIVITY_WINDOW = timedelta(days=7)
+# Tickers that were created but never successfully analyzed count as this stale
+NEVER_ANALYZED_STALENESS = timedelta(days=30)
+# Shortest reddit timeframe that covers the time since the last analysis
+REFRESH_TIMEFRAMES = [
+    (timedelta(days=1), "day"),
+    (timedelta(weeks=1), "week"),
+    (timedelta(days=31), "month"),
+]
+
+RUNNING_KEY = "analysis_scheduler:running"
+BUDGET_KEY_PREFIX = "analysis_scheduler:budget:"
+ROUND_KEY = "analysis_scheduler:round"
+
+
+def budget_key() -> str:
+    return f"{BUDGET_KEY_PREFIX}{datetime.now(timezone.utc).date().isoformat()}"
+
+
+def load_refresh_candidates(now: datetime) -> list:
+    """Returns (symbol, last_analyzed, recent posts) of every ticker whose analysis is old enough to be refreshed."""
+    recent_posts = (
+        select(Post.ticker_id, func.count().label("recent_posts"))
+        .where(Post.date_of_post >= now - ACTIVITY_WINDOW)
+        .group_by(Post.ticker_id)
+        .subquery()
+    )
+    stmt = (
+        select(Ticker.symbol, Ticker.last_analyzed, func.coalesce(recent_posts.c.recent_posts, 0))
+        .outerjoin(recent_posts, recent_posts.c.ticker_id == Ticker.id)
+        .where(or_(
+            Ticker.last_analyzed.is_(None),
+            Ticker.last_analyzed < now - timedelta(hours=SCHEDULER_MIN_STALENESS_HOURS),
+        ))
+    )
+    with session_scope() as session:
+        return [tuple(row) for row in session.execute(stmt)]
+
+
+def refresh_priority(last_analyzed, views: float, recent_posts: int, now: datetime) -> float:
+    """
+    Staleness in hours weighted by popularity and activity, on a log scale so a few very popular tickers
+    don't starve the rest: a ticker nobody looks at is still refreshed eventually, a popular one much sooner.
+    """
+    staleness = now - last_analyzed if last_analyzed else NEVER_ANALYZED_STALENESS
+    staleness_hours = staleness.total_seconds() / 3600
+    return staleness_hours * (1 + math.log1p(views)) * (1 + math.log1p(recent_posts))
+
+
+def rank_refresh_candidates(candidates: list, views: dict, now: datetime) -> list:
+    """Returns [(priority, symbol, last_analyzed)] with the most urgent refresh first."""
+    ranked = [
+        (refresh_priority(last_analyzed, views.get(symbol.lower(), 0), recent_posts, now), symbol, last_analyzed)
+        for symbol, last_analyzed, recent_posts in candidates
+    ]
+    ranked.sort(key=lambda candidate: candidate[0], reverse=True)
+    return ranked
+
+
+def refresh_params(last_analyzed, now: datetime) -> dict:
+    reddit_timeframe = DEFAULT_REDDIT_TIMEFRAME
+    if last_analyzed:
+        for max_age, timeframe in REFRESH_TIMEFRAMES:
+            if now - last_analyzed <= max_age:
+                reddit_timeframe = timeframe
+                break
+
+    return {
+        "subreddits": DEFAULT_SUBREDDITS,
+        "reddit_timeframe": reddit_timeframe,
+        "reddit_num_posts": DEFAULT_REDDIT_NUM_POSTS,
+        "seekingalpha_num_posts": DEFAULT_SEEKINGALPHA_NUM_POSTS,
+    }
+
+
+def refresh_cost(params: dict) -> int:
+    """Most posts a refresh can scrape, reddit posts are searched per subreddit."""
+    return params["reddit_num_posts"] * len(params["subreddits"]) + params["seekingalpha_num_posts"]
+
+
+def count_running_refreshes() -> int:
+    """Number of scheduled analyses that are still queued or running, forgetting the finished ones."""
+    running = 0
+    for raw_task_id in redis_client.smembers(RUNNING_KEY):
+        task = get_task(raw_task_id.decode())
+        # Finished tasks are kept for a while for /analysis-tasks, expired ones are gone
+        if task is None or task_finished(task):
+            redis_client.srem(RUNNING_KEY, raw_task_id)
+        else:
+            running += 1
+    return running
+
+
+def reserve_budget(cost: int) -> bool:
+    """Takes `cost` posts from today's budget, or nothing if not enough is left."""
+    key = budget_key()
+    with redis_client.pipeline(transaction=False) as pipe:
+        pipe.incrby(key, cost)
+        pipe.expire(key, 2 * 24 * 60 * 60)
+        used, _ = pipe.execute()
+
+    if used > SCHEDULER_DAILY_POST_BUDGET:
+        redis_client.decrby(key, cost)
+        return False
+    return True
+
+
+def release_budget(cost: int):
+    redis_client.decrby(budget_key(), cost)
+
+
+def schedule_refreshes(interval: int = SCHEDULER_INTERVAL_SECONDS) -> int:
+    """Runs one scheduling round and returns the number of refreshes queued."""
+    # Only one scheduler instance runs a round per interval, the others skip it
+    if not redis_client.set(ROUND_KEY, os.getpid(), nx=True, ex=max(interval - 1, 1)):
+        return 0
+
+    free_slots = SCHEDULER_MAX_CONCURRENT - count_running_refreshes()
+    if free_slots <= 0:
+        return 0
+
+    # Ticker rows store naive local timestamps
+    now = datetime.now()
+    ranked = rank_refresh_candidates(load_refresh_candidates(now), get_ticker_views(), now)
+
+    queued = 0
+    for priority, symbol, last_analyzed in ranked:
+        if queued >= free_slots:
+            break
+
+        params = refresh_params(last_analyzed, now)
+        cost = refresh_cost(params)
+        if not reserve_budget(cost):
+            logging.info(f"Daily refresh budget of {SCHEDULER_DAILY_POST_BUDGET} posts used up")
+            break
+
+        # Refreshes only use the LLM capacity that analyses users are waiting for leave free
+        task_id, queue_position = submit_analysis(symbol.upper(), params, priority=BACKGROUND)
+        if queue_position is None:
+            # Already being analyzed, e.g. because a user asked for it
+            release_budget(cost)
+            continue
+
+        redis_client.sadd(RUNNING_KEY, task_id)
+        queued += 1
+        logging.info(f"Queued refresh of {symbol.upper()} (priority {priority:.1f}, last analyzed {last_analyzed})")
+
+    return queued
@@ -71,8 +71,11 @@ def get_top_comments(submission, comment_limit=10):
 
 
 def get_reddit_posts_info(subreddits, stock_ticker, timeframe, num_posts):
+    return list(iter_reddit_posts_info(subreddits, stock_ticker, timeframe, num_posts))
+
+def iter_reddit_posts_info(subreddits, stock_ticker, timeframe, num_posts):
+    """Yields the info of each post as soon as it is scraped."""
     try:
-        post_info_list = []
         ticker_yf = yfinance.Ticker(stock_ticker)
         stock_name = ticker_yf.info["longName"]
         for subreddit in subreddits:
@@ -96,12 +99,11 @@ def get_reddit_posts_info(subreddits, stock_ticker, timeframe, num_posts):
                         "content": post.selftext,
                         "comments": top_comments
                     }
-                    post_info_list.append(post_info)
                 except Exception as e:
                     # Log the error for this particular post and continue with the next
                     logging.warning(f"Skipping post {post} due to error: {e}")
                     continue
-        return post_info_list
+                yield post_info
     except Exception as e:
         raise RuntimeError(f"Failed to scrape Reddit posts: {str(e)}") from e
 
@@ -143,8 +143,12 @@ def get_top_comments(post_id, post_url, comment_limit=10):
 
 
 def get_seekingalpha_posts_info(stock_ticker, num_posts):
+    return list(iter_seekingalpha_posts_info(stock_ticker, num_posts))
+
+
+def iter_seekingalpha_posts_info(stock_ticker, num_posts):
+    """Yields the info of each post as soon as it is scraped."""
     url = f"{base_url}/analysis/v2/get-details"
-    post_info_list = []
     try:
         post_ids = find_seekingalpha_posts(stock_ticker, num_posts)
     except Exception as e:
@@ -190,13 +194,11 @@ def get_seekingalpha_posts_info(stock_ticker, num_posts):
                 "content": filtered_content,
                 "comments": comments
             }
-            post_info_list.append(post_info)
         except Exception as e:
             # Log the error for this particular post and continue with the next
             logging.warning(f"Skipping post {post_id} due to error: {e}")
             continue
-
-    return post_info_list
+        yield post_info
 
 
 if __name__ == "__main__":
@@ -1,37 +1,54 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from .scrapers.reddit_scraper import get_reddit_posts_info
-from .scrapers.seekingalpha_scraper import get_seekingalpha_posts_info
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .scrapers.reddit_scraper import iter_reddit_posts_info
+from .scrapers.seekingalpha_scraper import iter_seekingalpha_posts_info
 
-def scrape_reddit(ticker:str, subreddits, reddit_timeframe: str, reddit_num_posts: int):
-    return get_reddit_posts_info(stock_ticker=ticker, subreddits=subreddits, timeframe=reddit_timeframe, num_posts=reddit_num_posts)
+async def stream_scraped_content(handle_post, ticker:str, subreddits, reddit_timeframe: str, reddit_num_posts: int, seekingalpha_num_posts):
+    """
+    Scrapes both sources at the same time and awaits handle_post(post) for every post as soon as it is scraped.
+    The scraper threads wait for handle_post to return, so scraping can't run further ahead than the analysis lets it.
+    They get their own executor: blocked in the default one, they could take all of its threads from the
+    stages that have to drain the pipeline before they can go on (which use asyncio.to_thread).
+    """
+    loop = asyncio.get_running_loop()
+    stopped = threading.Event()
+    pending = set()
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="scraper")
 
-def scrape_seekingalpha(ticker:str, seekingalpha_num_posts: int):
-    return get_seekingalpha_posts_info(stock_ticker=ticker, num_posts=seekingalpha_num_posts)
+    def forward_posts(source_name, posts):
+        try:
+            for post in posts:
+                if stopped.is_set():
+                    return
+                future = asyncio.run_coroutine_threadsafe(handle_post(post), loop)
+                pending.add(future)
+                if stopped.is_set():
+                    future.cancel()
+                try:
+                    future.result()
+                finally:
+                    pending.discard(future)
+        except Exception as e:
+            if stopped.is_set():
+                return
+            raise RuntimeError(f"failed to scrape {source_name}:", e) from e
 
-def scrape_content(ticker:str, subreddits, reddit_timeframe: str, reddit_num_posts: int, seekingalpha_num_posts):
-    # Create a thread pool
-    with ThreadPoolExecutor(max_workers=2) as executor:
-        future_to_name = {
-            executor.submit(scrape_reddit, ticker, subreddits, reddit_timeframe, reddit_num_posts): "reddit",
-            executor.submit(scrape_seekingalpha, ticker, seekingalpha_num_posts): "seekingalpha"
-        }
-
-        # As they complete gather results
-        results = {}
-        for future in as_completed(future_to_name):
-            source_name = future_to_name[future]
-            try:
-                data = future.result()
-                results[source_name] = data
-            except Exception as e:
-                # Log and re-raise with context
-                raise RuntimeError(f"failed to scrape {source_name}:", e) from e
-    # 'results' now holds data from both threads
-    reddit_data = results.get("reddit", [])
-    seekingalpha_data = results.get("seekingalpha", [])
-
-
-    return reddit_data + seekingalpha_data
-
-if __name__ == "__main__":
-    scrape_content(ticker="VST", title="Vistra", subreddits=["stocks", "investing", "valueinvesting", "wallstreetbets"], reddit_timeframe="year", reddit_num_posts=1, seekingalpha_num_posts=1)
\ No newline at end of file
+    try:
+        await asyncio.gather(
+            loop.run_in_executor(executor, forward_posts, "reddit", iter_reddit_posts_info(
+                stock_ticker=ticker, subreddits=subreddits, timeframe=reddit_timeframe, num_posts=reddit_num_posts
+            )),
+            loop.run_in_executor(executor, forward_posts, "seekingalpha", iter_seekingalpha_posts_info(
+                stock_ticker=ticker, num_posts=seekingalpha_num_posts
+            )),
+        )
+    except BaseException:
+        # The scraper threads can't be interrupted: stop them at their next post and
+        # cancel the post they may be waiting on, so they don't block forever
+        stopped.set()
+        for future in list(pending):
+            future.cancel()
+        raise
+    finally:
+        executor.shutdown(wait=False)
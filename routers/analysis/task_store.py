@@ -0,0 +1,169 @@
+import json
+import time
+from database.redis_db import redis_client, async_redis_client
+
+"""
+Status of analysis tasks, shared by the API (which creates and reports tasks) and the workers (which run them).
+Kept apart from run_analysis so the API doesn't have to import the analysis pipeline and its models.
+
+Every task is a hash 'analysis_task:<task_id>' with the fields ticker, status, progress, error, created_at,
+updated_at, finished_at and 'stage:<n>' (when the task reached progress stage n), each stored JSON encoded.
+Updates only write the fields that change and run in a single round-trip. Stages only ever move forward:
+advance_task compares and writes in one Lua script, so concurrent pipeline stages can report progress without
+reading the task first.
+
+Running tasks expire if they aren't updated for ACTIVE_TASK_EXPIRE_SECONDS (e.g. when the worker was lost for
+good), finished tasks are kept for FINISHED_TASK_EXPIRE_SECONDS so they show up in /analysis-tasks.
+The sorted set 'analysis_tasks' indexes the tasks by creation time.
+
+Every change of a task is also published on 'analysis_task_events:<task_id>' together with other events of the
+running analysis (e.g. newly stored points), so /analysis-events can push them to the client as they happen.
+Messages are JSON objects {"event": <event name>, "data": <payload>}, 'status' events carry the changed fields.
+"""
+
+TASK_KEY_PREFIX = "analysis_task:"
+TASK_CHANNEL_PREFIX = "analysis_task_events:"
+TASKS_INDEX_KEY = "analysis_tasks"
+STAGE_FIELD_PREFIX = "stage:"
+
+ACTIVE_TASK_EXPIRE_SECONDS = 24 * 60 * 60
+FINISHED_TASK_EXPIRE_SECONDS = 60 * 60
+
+# Moves the task to a later stage, ignored if it already is at that stage or further.
+# KEYS: task hash. ARGV: progress, expiry, channel, status event, then field / value pairs to set.
+ADVANCE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local current = tonumber(redis.call('HGET', KEYS[1], 'progress')) or -1
+if tonumber(ARGV[1]) <= current then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 5))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('PUBLISH', ARGV[3], ARGV[4])
+return 1
+"""
+
+advance_task_script = async_redis_client.register_script(ADVANCE_SCRIPT)
+
+
+def task_key(task_id: str) -> str:
+    return f"{TASK_KEY_PREFIX}{task_id}"
+
+def task_channel(task_id: str) -> str:
+    return f"{TASK_CHANNEL_PREFIX}{task_id}"
+
+def task_event(event: str, data) -> str:
+    return json.dumps({"event": event, "data": data})
+
+def encode_fields(fields: dict) -> dict:
+    return {field: json.dumps(value) for field, value in fields.items()}
+
+def decode_task(raw_task: dict):
+    """Turns a task hash into a dict, the stage timestamps are collected under 'stages'."""
+    if not raw_task:
+        return None
+    task = {"stages": {}}
+    for field, value in raw_task.items():
+        field = field.decode()
+        if field.startswith(STAGE_FIELD_PREFIX):
+            task["stages"][int(field[len(STAGE_FIELD_PREFIX):])] = json.loads(value)
+        else:
+            task[field] = json.loads(value)
+    return task
+
+def task_finished(task: dict) -> bool:
+    """Whether the analysis of the task completed or failed."""
+    return task.get("status") == "failed" or task.get("progress", 0) >= 10
+
+def queue_task_update(pipe, task_id: str, fields: dict, expire_seconds: int):
+    """Adds writing and announcing the changed fields of a task to a (sync or async) pipeline."""
+    pipe.hset(task_key(task_id), mapping=encode_fields(fields))
+    pipe.expire(task_key(task_id), expire_seconds)
+    pipe.publish(task_channel(task_id), task_event("status", fields))
+
+
+def create_task(task_id: str, ticker: str):
+    """Creates (or, for a resumed task, resets) a task waiting in the queue."""
+    now = time.time()
+    fields = {
+        "ticker": ticker,
+        "status": "pending",
+        "progress": 0,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+    with redis_client.pipeline() as pipe:
+        # Drop the stages and the outcome of an earlier run of a resumed task
+        pipe.delete(task_key(task_id))
+        queue_task_update(pipe, task_id, fields, ACTIVE_TASK_EXPIRE_SECONDS)
+        pipe.zadd(TASKS_INDEX_KEY, {task_id: now})
+        # Tasks older than the longest expiry are gone already
+        pipe.zremrangebyscore(TASKS_INDEX_KEY, "-inf", now - ACTIVE_TASK_EXPIRE_SECONDS)
+        pipe.execute()
+
+def publish_task_event(task_id: str, event: str, data):
+    redis_client.publish(task_channel(task_id), task_event(event, data))
+
+def get_task(task_id: str) -> dict:
+    """Retrieves the task data from Redis."""
+    return decode_task(redis_client.hgetall(task_key(task_id)))
+
+async def get_task_async(task_id: str) -> dict:
+    return decode_task(await async_redis_client.hgetall(task_key(task_id)))
+
+
+async def start_task(task_id: str, status: str):
+    """Marks a task as picked up by a worker. A requeued task starts over from the first stage."""
+    now = time.time()
+    fields = {"status": status, "progress": 0, "error": None, "updated_at": now, f"{STAGE_FIELD_PREFIX}0": now}
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        queue_task_update(pipe, task_id, fields, ACTIVE_TASK_EXPIRE_SECONDS)
+        await pipe.execute()
+
+async def advance_task(task_id: str, progress: int, status: str) -> bool:
+    """Moves the task to a later stage, returns False if it already was at that stage or further."""
+    now = time.time()
+    fields = {"status": status, "progress": progress, "updated_at": now, f"{STAGE_FIELD_PREFIX}{progress}": now}
+    field_values = [item for pair in encode_fields(fields).items() for item in pair]
+    advanced = await advance_task_script(
+        keys=[task_key(task_id)],
+        args=[progress, ACTIVE_TASK_EXPIRE_SECONDS, task_channel(task_id), task_event("status", fields), *field_values],
+    )
+    return bool(advanced)
+
+async def finish_task(task_id: str, status: str, progress: int, error: str = None):
+    """Records the outcome of a task, which is then kept around for FINISHED_TASK_EXPIRE_SECONDS."""
+    now = time.time()
+    fields = {"status": status, "progress": progress, "error": error, "updated_at": now, "finished_at": now}
+    if not error:
+        fields[f"{STAGE_FIELD_PREFIX}{progress}"] = now
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        queue_task_update(pipe, task_id, fields, FINISHED_TASK_EXPIRE_SECONDS)
+        await pipe.execute()
+
+async def list_tasks(limit: int) -> list:
+    """Returns the `limit` most recently created tasks that still exist, newest first, with their task_id."""
+    task_ids = [raw_task_id.decode() for raw_task_id in await async_redis_client.zrevrange(TASKS_INDEX_KEY, 0, limit - 1)]
+    if not task_ids:
+        return []
+
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        for task_id in task_ids:
+            pipe.hgetall(task_key(task_id))
+        raw_tasks = await pipe.execute()
+
+    tasks, expired = [], []
+    for task_id, raw_task in zip(task_ids, raw_tasks):
+        task = decode_task(raw_task)
+        if task is None:
+            expired.append(task_id)
+            continue
+        task["task_id"] = task_id
+        tasks.append(task)
+
+    if expired:
+        await async_redis_client.zrem(TASKS_INDEX_KEY, *expired)
+    return tasks
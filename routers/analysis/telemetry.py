@@ -0,0 +1,112 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import Counter, Histogram
+
+"""
+Telemetry of analysis runs: how long every stage took, how many posts and points went through it,
+how many tokens the LLM calls used and what failed.
+
+Everything is exported as Prometheus metrics (see routers/metrics.py) and collected per run in RunTelemetry,
+which is stored in the analysis_runs table once the run ends. The RunTelemetry of the running analysis is kept
+in a context variable, so code deep inside the pipeline (e.g. the LLM calls) can report to it without passing
+it around. asyncio tasks and asyncio.to_thread inherit the context of the code that starts them.
+
+The stages of a run overlap since posts are processed as they come in, so the per-stage times of a run are
+the time spent in the stage summed over all posts, not wall time.
+"""
+
+# Stages take from milliseconds (committing a post) to many minutes (scraping, whole runs)
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 2400)
+
+STAGE_SECONDS = Histogram(
+    "analysis_stage_seconds", "Time spent in an analysis stage, per post for the pipeline stages", ["stage"],
+    buckets=DURATION_BUCKETS,
+)
+RUN_SECONDS = Histogram(
+    "analysis_run_seconds", "Wall time of analysis runs", ["outcome"], buckets=DURATION_BUCKETS,
+)
+RUNS = Counter("analysis_runs_total", "Finished analysis runs", ["outcome"])
+ITEMS = Counter("analysis_items_total", "Posts and points processed by analyses", ["item"])
+STAGE_FAILURES = Counter("analysis_stage_failures_total", "Failed stage executions", ["stage"])
+LLM_REQUESTS = Counter("llm_requests_total", "LLM API requests", ["model", "operation"])
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens used by LLM API requests", ["model", "operation", "kind"])
+LLM_CACHE_LOOKUPS = Counter("llm_cache_lookups_total", "Lookups in the LLM output cache", ["operation", "result"])
+
+current_run = ContextVar("current_analysis_run", default=None)
+
+
+class RunTelemetry:
+    def __init__(self, task_id: str, ticker: str):
+        self.task_id = task_id
+        self.ticker = ticker
+        self.started_at = time.time()
+        self.stage_seconds = {}
+        self.items = {}
+        self.failures = {}
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    @contextmanager
+    def time_stage(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.record_failure(stage)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            STAGE_SECONDS.labels(stage).observe(elapsed)
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0) + elapsed
+
+    def count(self, item: str, amount: int = 1):
+        if amount:
+            ITEMS.labels(item).inc(amount)
+            self.items[item] = self.items.get(item, 0) + amount
+
+    def record_failure(self, stage: str):
+        STAGE_FAILURES.labels(stage).inc()
+        self.failures[stage] = self.failures.get(stage, 0) + 1
+
+    def finish(self, outcome: str) -> float:
+        """Records the end of the run and returns its duration in seconds."""
+        duration = time.time() - self.started_at
+        RUN_SECONDS.labels(outcome).observe(duration)
+        RUNS.labels(outcome).inc()
+        return duration
+
+    def summary(self) -> dict:
+        return {
+            "stage_seconds": {stage: round(seconds, 3) for stage, seconds in self.stage_seconds.items()},
+            "items": self.items,
+            "failures": self.failures,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+        }
+
+
+def start_run(task_id: str, ticker: str) -> RunTelemetry:
+    """Starts collecting the telemetry of the analysis running in the current context."""
+    run = RunTelemetry(task_id, ticker)
+    current_run.set(run)
+    return run
+
+
+def record_llm_usage(model: str, operation: str, usage):
+    """Counts an LLM request and its tokens, `usage` is the usage object of a Responses or Chat Completions response."""
+    LLM_REQUESTS.labels(model, operation).inc()
+    if usage is None:
+        return
+
+    # The Responses API and the Chat Completions API name the token counts differently
+    input_tokens = getattr(usage, "input_tokens", None) or getattr(usage, "prompt_tokens", 0) or 0
+    output_tokens = getattr(usage, "output_tokens", None) or getattr(usage, "completion_tokens", 0) or 0
+    LLM_TOKENS.labels(model, operation, "input").inc(input_tokens)
+    LLM_TOKENS.labels(model, operation, "output").inc(output_tokens)
+
+    run = current_run.get()
+    if run is not None:
+        run.input_tokens += input_tokens
+        run.output_tokens += output_tokens
+
@@ -1,11 +1,11 @@
 from fastapi import APIRouter
-from .analysis.check_existing_analysis import check_ticker_in_database
+from .analysis.check_existing_analysis import check_ticker_in_database_async
 
 router = APIRouter()
 
 @router.get("/check-analysis")
-def create_analysis(ticker: str):
-    ticker_exists, last_analyzed = check_ticker_in_database(ticker)
+async def create_analysis(ticker: str):
+    ticker_exists, last_analyzed = await check_ticker_in_database_async(ticker)
     
     if ticker_exists:
         if last_analyzed is not None:
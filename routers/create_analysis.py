@@ -1,8 +1,13 @@
-from fastapi import APIRouter, BackgroundTasks, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import uuid
+import json
 from typing import Optional, List
-from routers.analysis.run_analysis import start_analysis_process, get_task, update_task
+from routers.analysis.task_store import get_task_async, list_tasks, task_channel, task_finished
+from routers.analysis.job_queue import submit_analysis
+from routers.analysis.check_existing_analysis import check_ticker_in_database
+from database.redis_db import async_redis_client
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import os
 
@@ -16,55 +21,128 @@ default_reddit_num_posts = os.getenv("REDDIT_DEFAULT_NUM_POSTS")
 
 default_seekingalpha_num_posts = os.getenv("SEEKINGALPHA_DEFAULT_NUM_POSTS")
 
+# Requests within this many minutes of the last analysis get the existing analysis instead of a new one (0 disables it)
+ANALYSIS_COOLDOWN_MINUTES = int(os.getenv("ANALYSIS_COOLDOWN_MINUTES", 60))
+
+# Proxies and load balancers close connections that stay silent for too long
+EVENTS_KEEPALIVE_SECONDS = 15
+MAX_LISTED_TASKS = 200
+
 @router.get("/generate-analysis")
 def start_analysis(
-    background_tasks: BackgroundTasks,
     ticker:str = Query(..., description="The ticker symbol for the analysis"),
     subreddits: Optional[List[str]] = Query(default=default_subreddits, description="List of subreddits to scrape"),
     reddit_timeframe: Optional[str] = Query(default=default_reddit_timeframe, description="Timeframe to scrape posts(e.g., 'hour', 'day', 'week', 'month', 'year', 'all')"),
     reddit_num_posts: Optional[int] = Query(default=default_reddit_num_posts, description="Number of reddit posts to scrape"),
     seekingalpha_num_posts: Optional[int] = Query(default=default_seekingalpha_num_posts, description="Number of seekingalpha posts to scrape")
     ):
-    task_id = str(uuid.uuid4())
-
-    # Initialize the task in Redis with "pending" state
-    initial_task = {
-        "status": "pending",
-        "progress": 0,
-        "ticker": ticker,
-        "error": None
-    }
-    update_task(task_id, initial_task)
-
-    # Add the analysis function to the background tasks
-    background_tasks.add_task(
-        start_analysis_process, 
-        ticker=ticker, 
-        subreddits=subreddits, 
-        reddit_timeframe=reddit_timeframe, 
-        reddit_num_posts=reddit_num_posts, 
-        seekingalpha_num_posts=seekingalpha_num_posts, 
-        task_id=task_id)
+    _, last_analyzed = check_ticker_in_database(ticker)
+    if last_analyzed and datetime.now() - last_analyzed < timedelta(minutes=ANALYSIS_COOLDOWN_MINUTES):
+        return {
+            "message": f"The analysis for {ticker} is up to date (created on {last_analyzed})",
+            "task_id": None,
+            "status": "fresh",
+            "last_analyzed": last_analyzed
+        }
+
+    # Only one analysis per ticker at a time, everyone else follows the one that is already queued or running.
+    # The analysis is picked up by a worker process (worker.py)
+    task_id, queue_position = submit_analysis(ticker, {
+        "subreddits": subreddits,
+        "reddit_timeframe": reddit_timeframe,
+        "reddit_num_posts": reddit_num_posts,
+        "seekingalpha_num_posts": seekingalpha_num_posts,
+    })
+    if queue_position is None:
+        return {
+            "message": f"Analysis for {ticker} is already running",
+            "task_id": task_id,
+            "status": "started"
+        }
 
     return {
         "message": f"Analysis for {ticker} started",
         "task_id": task_id,
-        "status": "started"
+        "status": "started",
+        "queue_position": queue_position
+    }
+
+def task_status(task: dict) -> dict:
+    return {
+        "status": task.get("status", "unknown"),
+        "progress": task.get("progress", 0),
+        "error": task.get("error", ""),
+        "ticker": task.get("ticker", ""),
     }
 
+def sse_message(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @router.get("/analysis-status")
-def analysis_status(task_id: str):
+async def analysis_status(task_id: str):
     """
     Polling endpoint: user calls this with the task_id to check
     status and progress of the background job.
     """
-    task = get_task(task_id)
+    task = await get_task_async(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     
+    return task_status(task)
+
+async def stream_task_events(pubsub, task: dict):
+    try:
+        yield sse_message("status", task_status(task))
+        if task_finished(task):
+            return
+
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=EVENTS_KEEPALIVE_SECONDS)
+            if message is None:
+                # SSE comment line, ignored by the client
+                yield ": keepalive\n\n"
+                continue
+
+            event = json.loads(message["data"])
+            if event["event"] == "status":
+                # Status events only carry the fields that changed
+                task.update(event["data"])
+                yield sse_message("status", task_status(task))
+                if task_finished(task):
+                    return
+            else:
+                yield sse_message(event["event"], event["data"])
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+
+@router.get("/analysis-events")
+async def analysis_events(task_id: str):
+    """
+    Server-Sent Events stream of a task: a 'status' event whenever the task changes (same fields as
+    /analysis-status) and a 'points' event with the points of every post as soon as they are stored.
+    The stream ends once the analysis completed or failed.
+    """
+    pubsub = async_redis_client.pubsub()
+    # Subscribe before reading the current state, so no update falls between the two
+    await pubsub.subscribe(task_channel(task_id))
+    task = await get_task_async(task_id)
+    if not task:
+        await pubsub.aclose()
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    return StreamingResponse(
+        stream_task_events(pubsub, task),
+        media_type="text/event-stream",
+        # Keeps nginx and other proxies from buffering the events
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/analysis-tasks")
+async def analysis_tasks(limit: int = Query(50, ge=1, le=MAX_LISTED_TASKS, description="Number of most recent tasks to list")):
+    """Queued and running analyses and the recently finished ones, newest first, with the time every stage was reached."""
+    tasks = await list_tasks(limit)
     return {
-        "status": task.get("status", "unknown"),
-        "progress": task.get("progress", 0),
-        "error": task.get("error", ""),
-        "ticker": task.get("ticker", ""),
-    }
\ No newline at end of file
+        "active": [task for task in tasks if not task_finished(task)],
+        "recent": [task for task in tasks if task_finished(task)],
+    }
@@ -0,0 +1,23 @@
+import os
+from fastapi import APIRouter, Response
+from prometheus_client import CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+
+"""
+Prometheus metrics of the analyses (routers/analysis/telemetry.py).
+
+The analyses run in the worker processes, not in the API. With PROMETHEUS_MULTIPROC_DIR set to the same
+directory for the API and the workers of a machine, /metrics aggregates the metrics of all of them.
+Workers on other machines expose their own metrics instead (worker.py --metrics-port).
+Unlike the other routes /metrics doesn't require the API key (Prometheus scrapes it), see main.py.
+"""
+
+router = APIRouter()
+
+@router.get("/metrics")
+def metrics():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
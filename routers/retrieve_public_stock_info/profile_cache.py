@@ -0,0 +1,173 @@
+import json
+import logging
+import time
+from redis.exceptions import RedisError
+from database.redis_db import async_redis_client
+
+"""
+Shared Redis cache for public stock profile data.
+
+Every cached field is stored in the hash 'stock_profile:<TICKER>' together with the time it was fetched.
+A field is fresh for its TTL, after that it may still be served for its stale window while it is
+refreshed in the background (stale-while-revalidate). Past the stale window it counts as a miss.
+
+The values are (fresh seconds, stale seconds).
+"""
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+FIELD_TTLS = {
+    # FMP profile
+    "price": (15, 5 * MINUTE),
+    "mktCap": (15, 5 * MINUTE),
+    "dcf": (HOUR, DAY),
+    "beta": (DAY, 7 * DAY),
+    "symbol": (7 * DAY, 30 * DAY),
+    "companyName": (7 * DAY, 30 * DAY),
+    "website": (7 * DAY, 30 * DAY),
+    "description": (7 * DAY, 30 * DAY),
+    "exchangeShortName": (7 * DAY, 30 * DAY),
+    "industry": (7 * DAY, 30 * DAY),
+    "image": (7 * DAY, 30 * DAY),
+    # yfinance info
+    "analystRating": (6 * HOUR, 7 * DAY),
+    "forwardPE": (HOUR, DAY),
+    # yfinance earnings dates, stored in UTC and formatted per user timezone on read
+    "earningsDateUtc": (DAY, 7 * DAY),
+}
+
+# Which upstream source provides each field. One upstream call refreshes all of its fields.
+SOURCE_FIELDS = {
+    "fmp_profile": [
+        "symbol", "companyName", "website", "description", "price", "exchangeShortName",
+        "mktCap", "industry", "dcf", "beta", "image",
+    ],
+    "yf_info": ["analystRating", "forwardPE"],
+    "earnings": ["earningsDateUtc"],
+}
+
+FIELD_SOURCES = {field: source for source, fields in SOURCE_FIELDS.items() for field in fields}
+
+CACHE_KEY_PREFIX = "stock_profile:"
+REFRESH_LOCK_PREFIX = "stock_profile_refresh:"
+REFRESH_LOCK_SECONDS = 30
+STATS_KEY = "stock_profile_cache:stats"
+
+# Logo validity is resolved once per ticker and kept for a long time, it's re-checked in the background every week
+LOGO_KEY_PREFIX = "stock_logo:"
+LOGO_EXPIRE_SECONDS = 90 * DAY
+LOGO_RECHECK_SECONDS = 7 * DAY
+
+# The whole hash expires once even the longest lived field is past its stale window
+CACHE_EXPIRE_SECONDS = max(fresh + stale for fresh, stale in FIELD_TTLS.values())
+
+FRESH = "hit"
+STALE = "stale"
+MISSING = "miss"
+
+
+def cache_key(ticker: str) -> str:
+    return f"{CACHE_KEY_PREFIX}{ticker.upper()}"
+
+
+async def read_cached_fields(ticker: str) -> dict:
+    """
+    Returns {field: (value, state)} for every cached field, where state is FRESH or STALE.
+    Fields past their stale window are left out.
+    """
+    try:
+        raw_fields = await async_redis_client.hgetall(cache_key(ticker))
+    except RedisError as e:
+        logging.warning(f"Could not read stock profile cache for {ticker}: {e}")
+        return {}
+
+    now = time.time()
+    cached_fields = {}
+    for raw_field, raw_entry in raw_fields.items():
+        field = raw_field.decode()
+        if field not in FIELD_TTLS:
+            continue
+        entry = json.loads(raw_entry)
+        fresh_seconds, stale_seconds = FIELD_TTLS[field]
+        age = now - entry["t"]
+        if age <= fresh_seconds:
+            cached_fields[field] = (entry["v"], FRESH)
+        elif age <= fresh_seconds + stale_seconds:
+            cached_fields[field] = (entry["v"], STALE)
+
+    return cached_fields
+
+
+async def write_cached_fields(ticker: str, values: dict):
+    if not values:
+        return
+
+    now = time.time()
+    mapping = {field: json.dumps({"v": value, "t": now}) for field, value in values.items()}
+    try:
+        async with async_redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset(cache_key(ticker), mapping=mapping)
+            pipe.expire(cache_key(ticker), CACHE_EXPIRE_SECONDS)
+            await pipe.execute()
+    except RedisError as e:
+        logging.warning(f"Could not write stock profile cache for {ticker}: {e}")
+
+
+async def acquire_refresh_lock(ticker: str, source: str) -> bool:
+    """Makes sure only one API worker refreshes a stale source at a time."""
+    try:
+        return bool(await async_redis_client.set(
+            f"{REFRESH_LOCK_PREFIX}{ticker.upper()}:{source}", 1, nx=True, ex=REFRESH_LOCK_SECONDS
+        ))
+    except RedisError:
+        return False
+
+
+async def read_logo_record(ticker: str):
+    """Returns {'url', 'valid', 'checked_at'} of the last logo check for the ticker, or None."""
+    try:
+        value = await async_redis_client.get(f"{LOGO_KEY_PREFIX}{ticker.upper()}")
+    except RedisError as e:
+        logging.warning(f"Could not read logo record for {ticker}: {e}")
+        return None
+
+    if value:
+        return json.loads(value)
+    return None
+
+
+async def write_logo_record(ticker: str, url: str, valid: bool):
+    record = {"url": url, "valid": valid, "checked_at": time.time()}
+    try:
+        await async_redis_client.set(f"{LOGO_KEY_PREFIX}{ticker.upper()}", json.dumps(record), ex=LOGO_EXPIRE_SECONDS)
+    except RedisError as e:
+        logging.warning(f"Could not write logo record for {ticker}: {e}")
+
+
+async def record_cache_stats(field_states: dict):
+    """Counts one hit, stale hit or miss per requested field."""
+    counts = {}
+    for state in field_states.values():
+        counts[state] = counts.get(state, 0) + 1
+
+    try:
+        async with async_redis_client.pipeline(transaction=False) as pipe:
+            for state, count in counts.items():
+                pipe.hincrby(STATS_KEY, state, count)
+            await pipe.execute()
+    except RedisError as e:
+        logging.warning(f"Could not record stock profile cache stats: {e}")
+
+
+async def get_profile_cache_stats() -> dict:
+    try:
+        raw_stats = await async_redis_client.hgetall(STATS_KEY)
+    except RedisError as e:
+        logging.warning(f"Could not read stock profile cache stats: {e}")
+        raw_stats = {}
+    stats = {state: int(raw_stats.get(state.encode(), 0)) for state in (FRESH, STALE, MISSING)}
+    lookups = sum(stats.values())
+    stats["hit_rate"] = (stats[FRESH] + stats[STALE]) / lookups if lookups else None
+    return stats
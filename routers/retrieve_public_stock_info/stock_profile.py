@@ -1,10 +1,17 @@
-import requests as r
+import asyncio
+import httpx
 import json
 import os
+import time
 import yfinance as yf
 from dotenv import load_dotenv
 from datetime import datetime
 import pytz
+from .profile_cache import (
+    FIELD_TTLS, SOURCE_FIELDS, FIELD_SOURCES, MISSING, STALE, LOGO_RECHECK_SECONDS,
+    read_cached_fields, write_cached_fields, acquire_refresh_lock, record_cache_stats,
+    read_logo_record, write_logo_record
+)
 
 ENV_PATH = os.getenv("ENV_PATH")
 load_dotenv(ENV_PATH)
@@ -12,6 +19,19 @@ api_key = os.getenv("FMP_API_KEY")
 
 BASE_URL = "https://financialmodelingprep.com/api/v3/"
 
+# Per-call timeouts so a single slow upstream can't hold the whole profile hostage
+UPSTREAM_TIMEOUT_SECONDS = 5
+LOGO_TIMEOUT_SECONDS = 3
+
+# Pooled client shared by all requests, connections to FMP and the logo hosts are kept alive
+http_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(UPSTREAM_TIMEOUT_SECONDS),
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+)
+
+async def close_http_client():
+    await http_client.aclose()
+
 def response_to_json(data):
     try:
         json_response = data.json()
@@ -25,71 +45,200 @@ def response_to_json(data):
     
     return json_data
 
-def get_company_logo(profile_data):
-    # Get the image separately since we have to check if the URL is valid
-    try:
-        image_url = profile_data.get("image", "N/A")
-        image_valid = image_url != "N/A" and r.get(image_url).status_code == 200
-        image = image_url if image_valid else None
-    except:
-        image = None
-    
-    return image
-
-def get_earnings_date(yf_ticker: yf.Ticker, user_timezone_str: str):
-    try:
-        earnings_dates_df = yf_ticker.get_earnings_dates(limit=4)
-        
-        # Ensure the DataFrame is sorted by the earnings date
-        earnings_dates_df.sort_index(ascending=True, inplace=True)
+# Keep references to background work (cache refreshes, logo checks) so it isn't garbage collected mid-flight
+background_tasks = set()
 
-        next_earnings_date_utc = earnings_dates_df.index[0]
+def run_in_background(coroutine):
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
 
+async def check_logo_url(image_url: str):
+    """
+    Checks whether the logo URL resolves without downloading the image.
+    Returns None if the host couldn't be reached, so a transient error is never persisted.
+    """
+    try:
+        response = await http_client.head(image_url, timeout=LOGO_TIMEOUT_SECONDS, follow_redirects=True)
+        if response.status_code == 405:
+            # Some image hosts don't allow HEAD, only read the status line of a GET then
+            async with http_client.stream("GET", image_url, timeout=LOGO_TIMEOUT_SECONDS, follow_redirects=True) as response:
+                pass
+    except httpx.HTTPError:
+        return None
+
+    return response.status_code == 200
+
+async def revalidate_logo(ticker: str, image_url: str):
+    if not await acquire_refresh_lock(ticker, "logo"):
+        return
+
+    image_valid = await check_logo_url(image_url)
+    if image_valid is not None:
+        await write_logo_record(ticker, image_url, image_valid)
+
+async def get_company_logo(ticker: str, image_url):
+    """
+    Returns the logo URL if it is known to be valid.
+    Never waits on the image host: unknown, changed or outdated URLs are (re)checked in the background
+    and the logo shows up once the check has passed.
+    """
+    if not image_url or image_url == "N/A":
+        return None
+
+    logo_record = await read_logo_record(ticker)
+    if logo_record is None or logo_record["url"] != image_url:
+        run_in_background(revalidate_logo(ticker, image_url))
+        return None
+
+    if time.time() - logo_record["checked_at"] > LOGO_RECHECK_SECONDS:
+        run_in_background(revalidate_logo(ticker, image_url))
+
+    return image_url if logo_record["valid"] else None
+
+def get_next_earnings_date_utc(yf_ticker: yf.Ticker):
+    """Returns the earnings date as an ISO string in UTC, or None if yfinance has no earnings dates."""
+    earnings_dates_df = yf_ticker.get_earnings_dates(limit=4)
+    if earnings_dates_df is None or earnings_dates_df.empty:
+        return None
+
+    # Ensure the DataFrame is sorted by the earnings date
+    earnings_dates_df.sort_index(ascending=True, inplace=True)
+
+    next_earnings_date_utc = earnings_dates_df.index[0]
+    return next_earnings_date_utc.replace(tzinfo=pytz.utc).isoformat()
+
+def format_earnings_date(earnings_date_utc, user_timezone_str: str):
+    try:
         # Convert Earnings date to user's timezone
-        utc = pytz.utc
         user_tz = pytz.timezone(user_timezone_str)
-
-        localized_date = next_earnings_date_utc.replace(tzinfo=utc).astimezone(user_tz)
+        localized_date = datetime.fromisoformat(earnings_date_utc).astimezone(user_tz)
 
         # Format output
         formatted_date = localized_date.strftime("%Y-%m-%d %H:%M %Z")
     except Exception:
         formatted_date = "N/A"
-    
+
     return formatted_date
 
+def get_earnings_date(yf_ticker: yf.Ticker, user_timezone_str: str):
+    try:
+        return format_earnings_date(get_next_earnings_date_utc(yf_ticker), user_timezone_str)
+    except Exception:
+        return "N/A"
 
-def get_stock_profile(ticker, user_timezone_str:str):
-    
-    # Get data from yahoo finance
-    yf_ticker = yf.Ticker(ticker)
-    yf_company_info = yf_ticker.info
 
-    # Get additional data from FMP
-    profile_response = r.get(
-        url=f"{BASE_URL}profile/{ticker}",
-        params = {
-            "apikey": api_key
+async def fetch_yf_info(yf_ticker: yf.Ticker):
+    # yfinance is blocking, so it runs in a worker thread
+    try:
+        return await asyncio.wait_for(asyncio.to_thread(lambda: yf_ticker.info), timeout=UPSTREAM_TIMEOUT_SECONDS)
+    except Exception:
+        return {}
+
+async def fetch_fmp_profile(ticker):
+    try:
+        profile_response = await http_client.get(
+            url=f"{BASE_URL}profile/{ticker}",
+            params = {
+                "apikey": api_key
+            }
+        )
+    except httpx.HTTPError:
+        return {}
+    return response_to_json(profile_response)
+
+
+async def fetch_source(source: str, ticker: str, yf_ticker: yf.Ticker):
+    """
+    Fetches one upstream source and returns its cache fields.
+    Returns None if the upstream call failed, so failures are never cached.
+    """
+    if source == "fmp_profile":
+        profile_data = await fetch_fmp_profile(ticker)
+        # FMP answers errors and unknown tickers with a body that has no symbol
+        if "symbol" not in profile_data:
+            return None
+        return {field: profile_data.get(field, "N/A") for field in SOURCE_FIELDS["fmp_profile"]}
+
+    if source == "yf_info":
+        yf_company_info = await fetch_yf_info(yf_ticker)
+        if not yf_company_info:
+            return None
+        return {
+            "analystRating": yf_company_info.get("recommendationKey", "N/A"),
+            "forwardPE": yf_company_info.get("forwardPE", "N/A"),
         }
-    )
-    profile_data = response_to_json(profile_response)
 
+    if source == "earnings":
+        try:
+            earnings_date_utc = await asyncio.wait_for(
+                asyncio.to_thread(get_next_earnings_date_utc, yf_ticker),
+                timeout=UPSTREAM_TIMEOUT_SECONDS
+            )
+        except Exception:
+            return None
+        return {"earningsDateUtc": earnings_date_utc}
+
+    raise ValueError(f"Unknown stock profile source '{source}'")
+
+
+async def refresh_sources(ticker: str, sources: set) -> dict:
+    """Fetches the given sources concurrently, writes them to the shared cache and returns the fetched fields."""
+    yf_ticker = yf.Ticker(ticker)
+
+    results = await asyncio.gather(*(fetch_source(source, ticker, yf_ticker) for source in sources))
+
+    fetched_values = {}
+    for result in results:
+        fetched_values.update(result or {})
+
+    await write_cached_fields(ticker, fetched_values)
+    return fetched_values
+
+
+async def refresh_stale_sources(ticker: str, sources: set):
+    # Only one worker refreshes a given source, the others keep serving the stale value
+    locked_sources = {source for source in sources if await acquire_refresh_lock(ticker, source)}
+    if locked_sources:
+        await refresh_sources(ticker, locked_sources)
+
+
+async def get_stock_profile(ticker, user_timezone_str:str):
+    cached_fields = await read_cached_fields(ticker)
+
+    values = {field: value for field, (value, _) in cached_fields.items()}
+    field_states = {field: cached_fields.get(field, (None, MISSING))[1] for field in FIELD_TTLS}
+
+    missing_sources = {FIELD_SOURCES[field] for field, state in field_states.items() if state == MISSING}
+    stale_sources = {FIELD_SOURCES[field] for field, state in field_states.items() if state == STALE} - missing_sources
+
+    # Missing fields have to be fetched before we can answer, all at once so we only wait for the slowest one
+    if missing_sources:
+        values.update(await refresh_sources(ticker, missing_sources))
+
+    # Stale fields are served as they are and refreshed in the background
+    if stale_sources:
+        run_in_background(refresh_stale_sources(ticker, stale_sources))
+
+    await record_cache_stats(field_states)
+
+    logo = await get_company_logo(ticker, values.get("image"))
 
     stock_info = {
-        "symbol": profile_data.get("symbol", "N/A"),
-        "companyName": profile_data.get("companyName", "N/A"),
-        "logo": get_company_logo(profile_data),
-        "website": profile_data.get("website", "N/A"),
-        "description": profile_data.get("description", "N/A"),
-        "price": profile_data.get("price", "N/A"),
-        "exchangeShortName": profile_data.get("exchangeShortName", "N/A"),
-        "mktCap": profile_data.get("mktCap", "N/A"),
-        "industry": profile_data.get("industry", "N/A"),
-        "earningsCallDate": get_earnings_date(yf_ticker, user_timezone_str),
-        "analystRating": yf_company_info.get("recommendationKey", "N/A"),
-        "forwardPE": yf_company_info.get("forwardPE", "N/A"),
-        "dcf": profile_data.get("dcf", "N/A"),
-        "beta": profile_data.get("beta", "N/A"),
+        "symbol": values.get("symbol", "N/A"),
+        "companyName": values.get("companyName", "N/A"),
+        "logo": logo,
+        "website": values.get("website", "N/A"),
+        "description": values.get("description", "N/A"),
+        "price": values.get("price", "N/A"),
+        "exchangeShortName": values.get("exchangeShortName", "N/A"),
+        "mktCap": values.get("mktCap", "N/A"),
+        "industry": values.get("industry", "N/A"),
+        "earningsCallDate": format_earnings_date(values.get("earningsDateUtc"), user_timezone_str),
+        "analystRating": values.get("analystRating", "N/A"),
+        "forwardPE": values.get("forwardPE", "N/A"),
+        "dcf": values.get("dcf", "N/A"),
+        "beta": values.get("beta", "N/A"),
     }
 
     return stock_info
@@ -97,6 +246,6 @@ def get_stock_profile(ticker, user_timezone_str:str):
 
 if __name__ == "__main__":
     ticker = input("Ticker: ")
-    profile = get_stock_profile(ticker, "Europe/Berlin")
+    profile = asyncio.run(get_stock_profile(ticker, "Europe/Berlin"))
 
-    print(json.dumps(profile, indent=4))
\ No newline at end of file
+    print(json.dumps(profile, indent=4))
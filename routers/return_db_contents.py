@@ -1,68 +1,227 @@
-from fastapi import APIRouter
-from database.db import session_scope
-from database.models.thesisai import Ticker, Post, Point
-from sqlalchemy import func
+import asyncio
+import hashlib
+import orjson
+import time
+from typing import List, Literal, Optional
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Header, Response
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from database.db import async_session_scope
+from database.models.thesisai import Ticker
+from sqlalchemy import func, select
+from .analysis.analysis_snapshot import (
+    build_analysis_snapshot_async, get_analysis_snapshot_async, store_analysis_snapshot_async,
+    build_company_data, build_points_by_ticker_async, point_to_dict, get_points_version_async
+)
+from .analysis.points_pagination import points_page_statement, encode_cursor
+from .analysis.popularity import record_ticker_view
 from .retrieve_public_stock_info.stock_profile import get_stock_profile
+from .retrieve_public_stock_info.profile_cache import get_profile_cache_stats, FIELD_TTLS
 from fastapi import Query
 
 router = APIRouter()
 
-@router.get("/retrieve-analysis")
-def fetch_analysis(ticker: str, only_database: bool = False, timezone: str = Query("UTC", description="Timezone (e.g. 'Europe/Berlin')")):
-    with session_scope() as session:
-        ticker_obj = session.query(Ticker).filter(func.lower(Ticker.symbol) == ticker.lower()).first()
-
-        if not ticker_obj:
-            return {"error": "Ticker not found"}
-        
-        company_data = {
-            "ticker": ticker_obj.symbol,
-            "title": ticker_obj.name,
-            "description": ticker_obj.description,
-            "sentimentScore": ticker_obj.overall_sentiment_score,
-        }
-
-        if not only_database:
-            fmp_profile = get_stock_profile(ticker, timezone)
-            company_data.update({
-                "logo": fmp_profile["logo"],
-                "website": fmp_profile["website"],
-                "price": fmp_profile["price"],
-                "exchangeShortName": fmp_profile["exchangeShortName"],
-                "mktCap": fmp_profile["mktCap"],
-                "industry": fmp_profile["industry"],
-                "earningsCallDate": fmp_profile["earningsCallDate"],
-                "analystRating": fmp_profile["analystRating"],
-                "forwardPE": fmp_profile["forwardPE"],
-                "dcf": fmp_profile["dcf"],
-                "beta": fmp_profile["beta"]
-            })
-
-        points_query = session.query(Point).filter(Point.ticker_id == ticker_obj.id).all()
-        points_list = []
-
-        for pt in points_query:
-            post_obj = session.get(Post, pt.post_id)
-            pt_data = {
-                "content": pt.text,
-                "sentimentScore": pt.sentiment_score,
-                "postUrl": post_obj.link if post_obj else None,
-                "postTitle": post_obj.title if post_obj else None,
-                "postAuthor": post_obj.author if post_obj else None,
-                "postSource": post_obj.source if post_obj else None,
-                "postDate": post_obj.date_of_post if post_obj else None,
-                "criticismExists": pt.criticism_exists,
-                "criticisms": []
-            }
-
-            for crit in pt.criticisms:
-                criticism_data = {
-                    "content": crit.text,
-                    "validityScore": crit.validity_score,
-                    "commentUrl": crit.comment.link if crit.comment else None
-                }
-                pt_data["criticisms"].append(criticism_data)
-            
-            points_list.append(pt_data)
-    
-    return {"company": company_data, "points": points_list}
+# Upper bound for a single batch request, the favorites page stays far below it
+MAX_BATCH_TICKERS = 100
+
+# Responses with live profile data keep the same ETag for as long as the cached price is fresh
+PROFILE_ETAG_WINDOW_SECONDS = FIELD_TTLS["price"][0]
+
+MAX_POINTS_PAGE_SIZE = 500
+# Rows fetched per round-trip from the server-side cursor when streaming
+POINTS_STREAM_BATCH_SIZE = 200
+
+async def load_analysis_snapshot(ticker: str, points_version):
+    # Serve the materialized snapshot if there is one, otherwise rebuild it from the database and store it.
+    # points_version has to be read before the rebuild, the snapshot is only stored if it is still current
+    snapshot = await get_analysis_snapshot_async(ticker)
+    if snapshot is None:
+        async with async_session_scope() as session:
+            stmt = select(Ticker).where(func.lower(Ticker.symbol) == ticker.lower())
+            ticker_obj = (await session.execute(stmt)).scalars().first()
+
+            if not ticker_obj:
+                return None
+
+            snapshot = await build_analysis_snapshot_async(session, ticker_obj)
+        if points_version is not None:
+            await store_analysis_snapshot_async(snapshot, points_version)
+
+    return snapshot
+
+async def get_ticker_version(ticker: str):
+    """Returns (id, last_analyzed) of the ticker with a single indexed lookup, or None if it doesn't exist."""
+    async with async_session_scope() as session:
+        stmt = select(Ticker.id, Ticker.last_analyzed).where(func.lower(Ticker.symbol) == ticker.lower())
+        return (await session.execute(stmt)).first()
+
+def compute_analysis_etag(ticker_id: int, last_analyzed, points_version: int, variant: str) -> str:
+    """
+    Strong ETag of an analysis response. The database part changes when an analysis finishes (last_analyzed)
+    and whenever a running analysis stores points (points_version), 'variant' separates responses that also
+    carry other data.
+    """
+    version = last_analyzed.isoformat() if last_analyzed else "never"
+    digest = hashlib.sha256(f"{ticker_id}:{version}:{points_version}:{variant}".encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    # If-None-Match uses the weak comparison, so a W/ prefix added by a proxy still matches
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+# The analysis payloads are large, so they are serialized with orjson and returned as responses directly,
+# which also skips FastAPI's jsonable_encoder pass over every point
+@router.get("/retrieve-analysis", response_class=ORJSONResponse)
+async def fetch_analysis(
+    ticker: str,
+    background_tasks: BackgroundTasks,
+    only_database: bool = False,
+    timezone: str = Query("UTC", description="Timezone (e.g. 'Europe/Berlin')"),
+    if_none_match: Optional[str] = Header(None)
+    ):
+    ticker_version, points_version = await asyncio.gather(get_ticker_version(ticker), get_points_version_async(ticker))
+    if ticker_version is None:
+        return {"error": "Ticker not found"}
+
+    ticker_id, last_analyzed = ticker_version
+    # Popular tickers are refreshed first by the refresh scheduler. Counted once the response is sent,
+    # so the view doesn't cost this request a Redis round-trip
+    background_tasks.add_task(record_ticker_view, ticker)
+    if only_database:
+        variant = "database"
+    else:
+        # Live profile data (price, earnings date in the user's timezone) is part of the response
+        variant = f"profile:{timezone}:{int(time.time() // PROFILE_ETAG_WINDOW_SECONDS)}"
+    # Without the points version the response can't be identified, so it goes out without an ETag
+    etag = compute_analysis_etag(ticker_id, last_analyzed, points_version, variant) if points_version is not None else None
+    headers = {"ETag": etag, "Cache-Control": "no-cache"} if etag else {"Cache-Control": "no-cache"}
+
+    # Conditional request for an unchanged analysis, answer without building the payload
+    if etag and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    snapshot = await load_analysis_snapshot(ticker, points_version)
+    if snapshot is None:
+        return {"error": "Ticker not found"}
+
+    company_data = dict(snapshot["company"])
+
+    if not only_database:
+        fmp_profile = await get_stock_profile(ticker, timezone)
+        company_data.update({
+            "logo": fmp_profile["logo"],
+            "website": fmp_profile["website"],
+            "price": fmp_profile["price"],
+            "exchangeShortName": fmp_profile["exchangeShortName"],
+            "mktCap": fmp_profile["mktCap"],
+            "industry": fmp_profile["industry"],
+            "earningsCallDate": fmp_profile["earningsCallDate"],
+            "analystRating": fmp_profile["analystRating"],
+            "forwardPE": fmp_profile["forwardPE"],
+            "dcf": fmp_profile["dcf"],
+            "beta": fmp_profile["beta"]
+        })
+
+    return ORJSONResponse(
+        {"company": company_data, "points": snapshot["points"]},
+        headers=headers
+    )
+
+
+async def load_analysis_batch(tickers: List[str], include_points: bool):
+    """
+    Loads the company data (and optionally the points) of many tickers with one query for the tickers
+    and, if requested, one set of queries for the points of all of them.
+    """
+    async with async_session_scope() as session:
+        stmt = select(Ticker).where(func.lower(Ticker.symbol).in_(tickers))
+        ticker_objs = (await session.execute(stmt)).scalars().all()
+        tickers_by_symbol = {ticker_obj.symbol.lower(): ticker_obj for ticker_obj in ticker_objs}
+
+        points_by_ticker = {}
+        if include_points and ticker_objs:
+            points_by_ticker = await build_points_by_ticker_async(session, [ticker_obj.id for ticker_obj in ticker_objs])
+
+        results = []
+        not_found = []
+        # Keep the order the tickers were requested in
+        for ticker in tickers:
+            ticker_obj = tickers_by_symbol.get(ticker)
+            if ticker_obj is None:
+                not_found.append(ticker)
+                continue
+
+            result = {"company": build_company_data(ticker_obj)}
+            if include_points:
+                result["points"] = points_by_ticker.get(ticker_obj.id, [])
+            results.append(result)
+
+    return {"results": results, "notFound": not_found}
+
+@router.get("/retrieve-analysis/batch", response_class=ORJSONResponse)
+async def fetch_analysis_batch(
+    tickers: List[str] = Query(..., description="Tickers to retrieve, as repeated parameters or comma separated"),
+    include_points: bool = Query(False, description="Include the full points of every ticker")
+    ):
+    # Accept both ?tickers=a&tickers=b and ?tickers=a,b and drop duplicates while keeping the order
+    requested_tickers = list(dict.fromkeys(
+        ticker.strip().lower() for value in tickers for ticker in value.split(",") if ticker.strip()
+    ))
+
+    if len(requested_tickers) > MAX_BATCH_TICKERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_TICKERS} tickers can be retrieved at once")
+
+    return ORJSONResponse(await load_analysis_batch(requested_tickers, include_points))
+
+
+async def get_ticker_id(ticker: str):
+    ticker_version = await get_ticker_version(ticker)
+    return ticker_version[0] if ticker_version else None
+
+@router.get("/retrieve-analysis/points", response_class=ORJSONResponse)
+async def fetch_analysis_points(
+    ticker: str,
+    order_by: Literal["sentiment", "date"] = Query("sentiment", description="Order points by sentiment score or post date"),
+    descending: bool = Query(True, description="Sort direction"),
+    cursor: Optional[str] = Query(None, description="nextCursor of the previous page"),
+    limit: int = Query(50, ge=1, le=MAX_POINTS_PAGE_SIZE, description="Page size (ignored when streaming)"),
+    stream: bool = Query(False, description="Stream all points after the cursor as NDJSON instead of returning one page")
+    ):
+    ticker_id = await get_ticker_id(ticker)
+    if ticker_id is None:
+        return {"error": "Ticker not found"}
+
+    # Validate the cursor up front, once streaming has started we can't send an error status anymore
+    try:
+        stmt = points_page_statement(ticker_id, order_by, descending, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not stream:
+        async with async_session_scope() as session:
+            # Fetch one extra row to know whether there is a next page
+            points = (await session.execute(stmt.limit(limit + 1))).scalars().all()
+
+            has_next_page = len(points) > limit
+            points = points[:limit]
+            next_cursor = encode_cursor(points[-1], order_by, descending) if has_next_page else None
+            points_list = [point_to_dict(pt) for pt in points]
+
+        return ORJSONResponse({"points": points_list, "nextCursor": next_cursor})
+
+    async def stream_points():
+        async with async_session_scope() as session:
+            # A streamed result uses a server-side cursor, so only one batch of points is held in memory at a time
+            result = await session.stream(stmt.execution_options(yield_per=POINTS_STREAM_BATCH_SIZE))
+            async for pt in result.scalars():
+                yield orjson.dumps(point_to_dict(pt)) + b"\n"
+
+    return StreamingResponse(stream_points(), media_type="application/x-ndjson")
+
+
+@router.get("/stock-profile/cache-stats")
+async def stock_profile_cache_stats():
+    """Hit, stale hit and miss counters of the shared stock profile cache, counted per field."""
+    return await get_profile_cache_stats()
@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Query
-from sqlalchemy import  select, func, case, text
+from sqlalchemy import select, func, case, union
 from dotenv import load_dotenv
 import os
 from database.models.stock_index import stocks_table
-from database.stocks_db import stockindex_session_scope
+from database.stocks_db import async_stockindex_session_scope
+from .stock_search.search_index import search_index_loader
+from .stock_search.query_cache import stock_query_cache, get_query_cache_stats
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ENV_PATH = os.getenv("ENV_PATH")
@@ -14,28 +16,96 @@ DB_PASSWORD = os.getenv("POSTGRESQL_PASSWORD")
 DB_HOST = os.getenv("POSTGRESQL_HOST")
 DB_NAME = os.getenv("POSTGRESQL_STOCKS_DBNAME")
 
+# "memory" answers from the in-process search index, "postgres" queries the stock index database on every request
+STOCK_SEARCH_BACKEND = os.getenv("STOCK_SEARCH_BACKEND", "memory")
+
 router = APIRouter()
 
 @router.get("/stock-query")
-def search_stock(q: str = Query(..., min_length=1)):
+async def search_stock(q: str = Query(..., min_length=1)):
     # Limit Number of results to keep it responsive
     limit = 10
-    with stockindex_session_scope() as session:
-        # use ILIKE with indexes
-        stmt = select(
-            stocks_table.c.ticker,
-            stocks_table.c.title,
-            # Calculate weighted relevance score
-            (
-                case((stocks_table.c.ticker.ilike(q), 1.0), else_=0.0) + # Exact ticker match
-                func.similarity(stocks_table.c.ticker, q) * 0.7 +        # Partial ticker match
-                func.similarity(stocks_table.c.title, q) * 0.3           # partial title match
-            ).label("relevance")
-        ).where(
-            stocks_table.c.ticker.ilike(f"%{q}%") | stocks_table.c.title.ilike(f"%{q}%")
-        ).order_by(text("relevance DESC"))\
+    use_index = STOCK_SEARCH_BACKEND == "memory"
+
+    cached_results = await stock_query_cache.get(STOCK_SEARCH_BACKEND, q, prefix_reuse=use_index)
+    if cached_results is not None:
+        return cached_results
+
+    index = await search_index_loader.get_index() if use_index else None
+    if index is not None:
+        results = index.search(q, limit)
+        # Fewer rows than the limit means every match is in there, which lets longer queries reuse it
+        complete = len(results) < limit
+        backend = "memory"
+    else:
+        # Fall back to the database while the index couldn't be built
+        results = await search_stock_in_database(q, limit)
+        complete = False
+        backend = "postgres"
+
+    # Fallback results aren't cached, lookups go to the configured backend and they shouldn't outlive an index outage
+    if backend == STOCK_SEARCH_BACKEND:
+        await stock_query_cache.store(backend, q, results, complete)
+    return results
+
+@router.get("/stock-query/cache-stats")
+async def stock_query_cache_stats():
+    """Hit and miss counters of the shared /stock-query cache."""
+    return await get_query_cache_stats()
+
+def knn_search_statement(q: str, limit: int):
+    """
+    Top matches for q, found with index-assisted lookups instead of ranking every ILIKE match:
+      - prefix ticker matches via the btree index on lower(ticker) (the fast path for short queries)
+      - the nearest tickers and titles by trigram distance (<->), filtered with %, via the GiST trigram indexes
+    Each branch returns at most 'limit' rows straight from its index, only those few candidates get ranked.
+    """
+    # Prefix match written as a byte-wise range, so the text_pattern_ops index is used even with a bound parameter
+    prefix_start = q.lower()
+    prefix_end = prefix_start[:-1] + chr(ord(prefix_start[-1]) + 1)
+    ticker_prefix = (
+        select(stocks_table.c.id)
+        .where(
+            func.lower(stocks_table.c.ticker).op("~>=~")(prefix_start),
+            func.lower(stocks_table.c.ticker).op("~<~")(prefix_end)
+        )
+        .order_by(func.length(stocks_table.c.ticker), stocks_table.c.ticker)
+        .limit(limit)
+        .subquery()
+    )
+    ticker_knn = (
+        select(stocks_table.c.id)
+        .where(stocks_table.c.ticker.op("%")(q))
+        .order_by(stocks_table.c.ticker.op("<->")(q))
+        .limit(limit)
+        .subquery()
+    )
+    title_knn = (
+        select(stocks_table.c.id)
+        .where(stocks_table.c.title.op("%")(q))
+        .order_by(stocks_table.c.title.op("<->")(q))
+        .limit(limit)
+        .subquery()
+    )
+    candidate_ids = union(
+        select(ticker_prefix.c.id), select(ticker_knn.c.id), select(title_knn.c.id)
+    ).subquery()
+
+    relevance = (
+        case((stocks_table.c.ticker.ilike(q), 1.0), else_=0.0) + # Exact ticker match
+        func.similarity(stocks_table.c.ticker, q) * 0.7 +        # Partial ticker match
+        func.similarity(stocks_table.c.title, q) * 0.3           # partial title match
+    ).label("relevance")
+
+    return (
+        select(stocks_table.c.ticker, stocks_table.c.title, relevance)
+        .where(stocks_table.c.id.in_(select(candidate_ids.c.id)))
+        .order_by(relevance.desc(), stocks_table.c.ticker)
         .limit(limit)
+    )
 
-        results = session.execute(stmt).all()
+async def search_stock_in_database(q: str, limit: int):
+    async with async_stockindex_session_scope() as session:
+        results = (await session.execute(knn_search_statement(q, limit))).all()
 
-    return [{"ticker":  r[0], "title": r[1]} for r in results]
\ No newline at end of file
+    return [{"ticker":  r[0], "title": r[1]} for r in results]
@@ -0,0 +1,200 @@
+import logging
+import time
+from collections import OrderedDict
+import orjson
+from redis.exceptions import RedisError
+from database.redis_db import redis_client, async_redis_client
+from .search_index import pg_trigrams, relevance
+
+"""
+Cache for /stock-query results, shared by all API workers through Redis.
+
+Every typed prefix is a request, and popular prefixes ("a", "ap", "ts") are requested by every user,
+so results are cached per lowercased query (the search is case-insensitive).
+
+  - Redis holds up to MAX_ENTRIES queries for ENTRY_TTL_SECONDS. A sorted set of the queries by last
+    access keeps it bounded: when it grows past MAX_ENTRIES the least recently used queries are evicted.
+  - Each worker keeps a small LRU of its own in front of Redis, so the hottest prefixes don't cost a
+    Redis round trip either. Its entries live for LOCAL_TTL_SECONDS.
+  - Prefix-extension reuse: with the memory backend a result set that has fewer than 'limit' rows is
+    complete (every stock containing the query is in it). Every stock containing "tsla" also contains
+    "tsl", so "tsla" can be answered by filtering and re-ranking a complete "tsl" result.
+    This doesn't hold for the postgres backend, whose trigram matching isn't monotone in the query.
+"""
+
+CACHE_KEY_PREFIX = "stock_query_cache:"
+LRU_KEY = "stock_query_cache:lru"
+STATS_KEY = "stock_query_cache:stats"
+
+MAX_ENTRIES = 20000
+# The stock list only changes on a redeploy, which clears the cache
+ENTRY_TTL_SECONDS = 60 * 60
+LOCAL_MAX_ENTRIES = 2048
+LOCAL_TTL_SECONDS = 30
+# Hits answered without Redis are counted locally and written out at most this often
+STATS_FLUSH_SECONDS = 10
+
+LOCAL_HIT = "local_hit"
+REDIS_HIT = "redis_hit"
+PREFIX_HIT = "prefix_hit"
+MISS = "miss"
+
+
+def cache_key(backend: str, query_lower: str) -> str:
+    return f"{CACHE_KEY_PREFIX}{backend}:{query_lower}"
+
+
+def results_from_parent(query_lower: str, parent_results: list) -> list:
+    """Answers a query from the complete result set of one of its prefixes, ranked like TickerSearchIndex.search."""
+    query_trigrams = pg_trigrams(query_lower)
+    matches = []
+    for result in parent_results:
+        ticker_lower, title = result["ticker"].lower(), result["title"] or ""
+        if query_lower not in ticker_lower and query_lower not in title.lower():
+            continue
+        score = relevance(query_lower, query_trigrams, ticker_lower, pg_trigrams(ticker_lower), pg_trigrams(title))
+        matches.append((-score, ticker_lower, result))
+
+    matches.sort(key=lambda match: match[:2])
+    return [result for _, _, result in matches]
+
+
+class StockQueryCache:
+    def __init__(self):
+        self.local_entries = OrderedDict()
+        self.pending_stats = {}
+        self.last_stats_flush = time.monotonic()
+
+    def get_local(self, key: str):
+        entry = self.local_entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.local_entries[key]
+            return None
+        self.local_entries.move_to_end(key)
+        return value
+
+    def store_local(self, key: str, value: dict):
+        self.local_entries[key] = (time.monotonic() + LOCAL_TTL_SECONDS, value)
+        self.local_entries.move_to_end(key)
+        while len(self.local_entries) > LOCAL_MAX_ENTRIES:
+            self.local_entries.popitem(last=False)
+
+    def count(self, outcome: str):
+        self.pending_stats[outcome] = self.pending_stats.get(outcome, 0) + 1
+
+    def queue_stats(self, pipe):
+        for outcome, count in self.pending_stats.items():
+            pipe.hincrby(STATS_KEY, outcome, count)
+        self.pending_stats = {}
+        self.last_stats_flush = time.monotonic()
+
+    async def flush_stats_if_due(self):
+        if not self.pending_stats or time.monotonic() - self.last_stats_flush < STATS_FLUSH_SECONDS:
+            return
+        try:
+            async with async_redis_client.pipeline(transaction=False) as pipe:
+                self.queue_stats(pipe)
+                await pipe.execute()
+        except RedisError as e:
+            logging.warning(f"Could not record stock query cache stats: {e}")
+
+    async def get(self, backend: str, query: str, prefix_reuse: bool):
+        """Returns the cached results for the query or None on a miss."""
+        query_lower = query.lower()
+        key = cache_key(backend, query_lower)
+
+        entry = self.get_local(key)
+        if entry is not None:
+            self.count(LOCAL_HIT)
+            await self.flush_stats_if_due()
+            return entry["results"]
+
+        # Longest prefixes first, the first complete one gives the smallest set to filter
+        parent_keys = [cache_key(backend, query_lower[:length]) for length in range(len(query_lower) - 1, 0, -1)] if prefix_reuse else []
+        parent_entry = next(
+            (entry for entry in map(self.get_local, parent_keys) if entry is not None and entry["complete"]), None
+        )
+        read_parents = parent_keys and parent_entry is None
+
+        try:
+            async with async_redis_client.pipeline(transaction=False) as pipe:
+                pipe.get(key)
+                pipe.zadd(LRU_KEY, {key: time.time()}, xx=True)
+                if read_parents:
+                    pipe.mget(parent_keys)
+                self.queue_stats(pipe)
+                replies = await pipe.execute()
+        except RedisError as e:
+            logging.warning(f"Could not read stock query cache: {e}")
+            return None
+
+        if replies[0]:
+            entry = orjson.loads(replies[0])
+            self.store_local(key, entry)
+            self.count(REDIS_HIT)
+            return entry["results"]
+
+        if read_parents:
+            parent_entries = (orjson.loads(value) for value in replies[2] if value)
+            parent_entry = next((entry for entry in parent_entries if entry["complete"]), None)
+        if parent_entry is not None:
+            results = results_from_parent(query_lower, parent_entry["results"])
+            await self.store(backend, query, results, complete=True)
+            self.count(PREFIX_HIT)
+            return results
+
+        self.count(MISS)
+        return None
+
+    async def store(self, backend: str, query: str, results: list, complete: bool):
+        key = cache_key(backend, query.lower())
+        entry = {"results": results, "complete": complete}
+        self.store_local(key, entry)
+
+        try:
+            async with async_redis_client.pipeline(transaction=False) as pipe:
+                pipe.set(key, orjson.dumps(entry), ex=ENTRY_TTL_SECONDS)
+                pipe.zadd(LRU_KEY, {key: time.time()})
+                pipe.zcard(LRU_KEY)
+                replies = await pipe.execute()
+
+            excess = replies[2] - MAX_ENTRIES
+            if excess > 0:
+                evicted = await async_redis_client.zpopmin(LRU_KEY, excess)
+                if evicted:
+                    await async_redis_client.delete(*(evicted_key for evicted_key, _ in evicted))
+        except RedisError as e:
+            logging.warning(f"Could not write stock query cache: {e}")
+
+
+stock_query_cache = StockQueryCache()
+
+
+async def get_query_cache_stats() -> dict:
+    try:
+        raw_stats = await async_redis_client.hgetall(STATS_KEY)
+        entries = await async_redis_client.zcard(LRU_KEY)
+    except RedisError as e:
+        logging.warning(f"Could not read stock query cache stats: {e}")
+        raw_stats, entries = {}, 0
+    stats = {outcome: int(raw_stats.get(outcome.encode(), 0)) for outcome in (LOCAL_HIT, REDIS_HIT, PREFIX_HIT, MISS)}
+    lookups = sum(stats.values())
+    stats["hit_rate"] = (lookups - stats[MISS]) / lookups if lookups else None
+    stats["entries"] = entries
+    return stats
+
+
+def clear_stock_query_cache():
+    """Drops all cached results, called after the stocks table was redeployed."""
+    try:
+        cached_keys = redis_client.zrange(LRU_KEY, 0, -1)
+        with redis_client.pipeline(transaction=False) as pipe:
+            if cached_keys:
+                pipe.delete(*cached_keys)
+            pipe.delete(LRU_KEY)
+            pipe.execute()
+    except RedisError as e:
+        print(f"Could not clear stock query cache, cached results expire within {ENTRY_TTL_SECONDS} seconds: {e}")
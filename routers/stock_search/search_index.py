@@ -0,0 +1,214 @@
+import asyncio
+import heapq
+import logging
+import re
+import time
+from array import array
+from collections import defaultdict
+from sqlalchemy import select
+from redis.exceptions import RedisError
+from database.models.stock_index import stocks_table
+from database.stocks_db import async_stockindex_session_scope
+from database.redis_db import redis_client, async_redis_client
+
+"""
+In-process search index over the stocks table (the contents of data/sec_tickers.json).
+
+It reproduces the relevance ranking of the SQL query in stock_query.py:
+    exact ticker match * 1.0 + similarity(ticker, q) * 0.7 + similarity(title, q) * 0.3
+over all rows whose ticker or title contains q (case-insensitive), where similarity() is pg_trgm's.
+
+Candidates are found through an inverted index of the 1-, 2- and 3-character substrings of every
+ticker and title, so a query only touches rows that can contain it instead of scanning the table.
+"""
+
+# Key bumped by deploy_stock_index_db.py whenever the stocks table is redeployed
+STOCK_INDEX_VERSION_KEY = "stock_index:version"
+# How often a worker checks whether the stocks table was redeployed
+RELOAD_CHECK_SECONDS = 30
+# After a failed build, requests are answered by the database for this long before the next attempt
+BUILD_RETRY_SECONDS = 60
+
+# pg_trgm treats everything that isn't alphanumeric as a word separator
+WORD_PATTERN = re.compile(r"[^\W_]+")
+MAX_NGRAM = 3
+# Results for one and two character queries scan a large part of the index, so they are kept
+SHORT_QUERY_LENGTH = 2
+
+
+def pg_trigrams(text: str) -> frozenset:
+    """Trigrams the way pg_trgm extracts them: lowercased words padded with two spaces in front and one at the end."""
+    trigrams = set()
+    for word in WORD_PATTERN.findall(text.lower()):
+        padded = f"  {word} "
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(trigrams)
+
+
+def trigram_similarity(trigrams_a: frozenset, trigrams_b: frozenset) -> float:
+    """pg_trgm's similarity(): shared trigrams divided by all distinct trigrams of both strings."""
+    shared = len(trigrams_a & trigrams_b)
+    total = len(trigrams_a) + len(trigrams_b) - shared
+    return shared / total if total else 0.0
+
+
+def relevance(query_lower: str, query_trigrams: frozenset, ticker_lower: str, ticker_trigrams: frozenset, title_trigrams: frozenset) -> float:
+    return (
+        (1.0 if ticker_lower == query_lower else 0.0) +           # Exact ticker match
+        trigram_similarity(ticker_trigrams, query_trigrams) * 0.7 +  # Partial ticker match
+        trigram_similarity(title_trigrams, query_trigrams) * 0.3     # partial title match
+    )
+
+
+def ngrams(text: str, n: int) -> set:
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class TickerSearchIndex:
+    def __init__(self, rows):
+        self.tickers = []
+        self.titles = []
+        self.tickers_lower = []
+        self.titles_lower = []
+        self.ticker_trigrams = []
+        self.title_trigrams = []
+
+        postings = defaultdict(set)
+        for row_id, (ticker, title) in enumerate(rows):
+            ticker = ticker or ""
+            title = title or ""
+            ticker_lower, title_lower = ticker.lower(), title.lower()
+
+            self.tickers.append(ticker)
+            self.titles.append(title)
+            self.tickers_lower.append(ticker_lower)
+            self.titles_lower.append(title_lower)
+            self.ticker_trigrams.append(pg_trigrams(ticker))
+            self.title_trigrams.append(pg_trigrams(title))
+
+            for n in range(1, MAX_NGRAM + 1):
+                for gram in ngrams(ticker_lower, n) | ngrams(title_lower, n):
+                    postings[gram].add(row_id)
+
+        # Compact posting lists, a set per gram would cost several times the memory
+        self.postings = {gram: array("I", sorted(row_ids)) for gram, row_ids in postings.items()}
+        self.short_query_results = {}
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def candidates(self, query_lower: str) -> list:
+        """Row ids whose ticker or title contains the query."""
+        n = min(len(query_lower), MAX_NGRAM)
+        grams = sorted(ngrams(query_lower, n), key=lambda gram: len(self.postings.get(gram, ())))
+        if not grams or grams[0] not in self.postings:
+            return []
+
+        # Intersect starting from the rarest gram, then verify since grams may come from different places
+        row_ids = set(self.postings[grams[0]])
+        for gram in grams[1:]:
+            row_ids.intersection_update(self.postings[gram])
+            if not row_ids:
+                return []
+
+        if n == len(query_lower):
+            return list(row_ids)
+        return [
+            row_id for row_id in row_ids
+            if query_lower in self.tickers_lower[row_id] or query_lower in self.titles_lower[row_id]
+        ]
+
+    def search(self, query: str, limit: int = 10) -> list:
+        query_lower = query.lower()
+        if len(query_lower) <= SHORT_QUERY_LENGTH and (query_lower, limit) in self.short_query_results:
+            return self.short_query_results[(query_lower, limit)]
+
+        query_trigrams = pg_trigrams(query)
+
+        def score(row_id):
+            return relevance(
+                query_lower, query_trigrams, self.tickers_lower[row_id],
+                self.ticker_trigrams[row_id], self.title_trigrams[row_id]
+            )
+
+        # Ties are broken by ticker so results are stable between calls
+        top_rows = heapq.nsmallest(
+            limit, self.candidates(query_lower),
+            key=lambda row_id: (-score(row_id), self.tickers_lower[row_id])
+        )
+        results = [{"ticker": self.tickers[row_id], "title": self.titles[row_id]} for row_id in top_rows]
+
+        if len(query_lower) <= SHORT_QUERY_LENGTH:
+            self.short_query_results[(query_lower, limit)] = results
+        return results
+
+
+async def load_stock_rows() -> list:
+    async with async_stockindex_session_scope() as session:
+        stmt = select(stocks_table.c.ticker, stocks_table.c.title).order_by(stocks_table.c.id)
+        return (await session.execute(stmt)).all()
+
+
+class SearchIndexLoader:
+    """
+    Holds the index of this worker and rebuilds it when the stocks table was redeployed.
+    Requests keep being answered from the old index while a new one is built. Without an index (the first
+    build failed) get_index returns None, so requests fall back to the database until the next attempt.
+    """
+
+    def __init__(self):
+        self.index = None
+        self.version = None
+        self.last_check = 0.0
+        self.failed_at = None
+        self.reload_lock = asyncio.Lock()
+
+    async def read_version(self):
+        try:
+            version = await async_redis_client.get(STOCK_INDEX_VERSION_KEY)
+        except RedisError as e:
+            logging.warning(f"Could not read stock index version: {e}")
+            return self.version
+        return version.decode() if version else None
+
+    def is_current(self) -> bool:
+        """Whether get_index can answer without checking for a new index (or retrying a failed build)."""
+        if self.index is None:
+            return self.failed_at is not None and time.monotonic() - self.failed_at < BUILD_RETRY_SECONDS
+        return time.monotonic() - self.last_check < RELOAD_CHECK_SECONDS
+
+    async def get_index(self):
+        if self.is_current():
+            return self.index
+
+        async with self.reload_lock:
+            # Another request may have reloaded while we were waiting for the lock
+            if self.is_current():
+                return self.index
+            self.last_check = time.monotonic()
+
+            version = await self.read_version()
+            if self.index is None or version != self.version:
+                try:
+                    rows = await load_stock_rows()
+                    # Building takes a moment, keep it off the event loop
+                    self.index = await asyncio.to_thread(TickerSearchIndex, rows)
+                    self.version = version
+                    self.failed_at = None
+                    logging.info(f"Loaded stock search index with {len(self.index)} stocks (version {version})")
+                except Exception as e:
+                    self.failed_at = time.monotonic()
+                    logging.warning(f"Could not build stock search index, retrying in {BUILD_RETRY_SECONDS}s: {e}")
+
+        return self.index
+
+
+search_index_loader = SearchIndexLoader()
+
+
+def bump_stock_index_version():
+    """Tells every API worker to rebuild its search index. Called after the stocks table was redeployed."""
+    try:
+        redis_client.set(STOCK_INDEX_VERSION_KEY, str(time.time()))
+    except RedisError as e:
+        print(f"Could not bump stock index version, API workers will keep their current index: {e}")
@@ -0,0 +1,51 @@
+import argparse
+import logging
+import os
+import signal
+import threading
+from dotenv import load_dotenv
+
+"""
+Queues refreshes of stale analyses in the background, see routers/analysis/refresh_scheduler.py.
+
+    python scheduler.py
+
+runs a scheduling round every SCHEDULER_INTERVAL_SECONDS, the queued analyses are run by worker.py.
+More than one scheduler can run (e.g. one per deployment), only one of them schedules per interval.
+"""
+
+ENV_PATH = os.getenv("ENV_PATH")
+load_dotenv(ENV_PATH)
+
+
+def run_scheduler(interval: int, once: bool):
+    from routers.analysis.refresh_scheduler import schedule_refreshes
+
+    stopping = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stopping.set())
+
+    print(f"Refresh scheduler running every {interval} seconds")
+    while not stopping.is_set():
+        try:
+            queued = schedule_refreshes(interval)
+            if queued:
+                logging.info(f"Queued {queued} analysis refreshes")
+        except Exception as e:
+            logging.warning(f"Scheduling round failed: {e}")
+        if once:
+            break
+        stopping.wait(interval)
+    print("Refresh scheduler stopped")
+
+
+if __name__ == "__main__":
+    from routers.analysis.refresh_scheduler import SCHEDULER_INTERVAL_SECONDS
+
+    parser = argparse.ArgumentParser(description="Queues refreshes of stale analyses")
+    parser.add_argument("--interval", type=int, default=SCHEDULER_INTERVAL_SECONDS, help="Seconds between scheduling rounds")
+    parser.add_argument("--once", action="store_true", help="Run a single scheduling round and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    run_scheduler(args.interval, args.once)
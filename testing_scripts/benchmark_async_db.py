@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Benchmark: sync vs async database reads for the analysis routes
+
+Simulates many concurrent readers loading the database part of /retrieve-analysis
+(ticker lookup + all points with posts and criticisms) for one ticker.
+
+  - sync:  the old path, blocking session_scope() calls on a thread pool capped at 40 threads
+           (the default capacity of Starlette's thread pool for sync handlers)
+  - async: the new path, async_session_scope() on the asyncpg engine, all readers on one event loop
+
+Reports requests per second and p50 / p95 latency for both.
+The database configured in the env file must contain an analyzed ticker.
+
+Usage:
+    python -m testing_scripts.benchmark_async_db --ticker spry --requests 2000 --concurrency 200
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import func, select
+from database.db import session_scope, async_session_scope, async_engine
+from database.models.thesisai import Ticker
+from routers.analysis.analysis_snapshot import build_analysis_snapshot, build_analysis_snapshot_async
+
+STARLETTE_THREADPOOL_SIZE = 40
+
+
+def load_sync(ticker: str):
+    with session_scope() as session:
+        ticker_obj = session.execute(select(Ticker).where(func.lower(Ticker.symbol) == ticker.lower())).scalars().first()
+        return build_analysis_snapshot(session, ticker_obj)
+
+
+async def load_async(ticker: str):
+    async with async_session_scope() as session:
+        ticker_obj = (await session.execute(select(Ticker).where(func.lower(Ticker.symbol) == ticker.lower()))).scalars().first()
+        return await build_analysis_snapshot_async(session, ticker_obj)
+
+
+def timed_sync(ticker: str):
+    start = time.perf_counter()
+    load_sync(ticker)
+    return time.perf_counter() - start
+
+
+async def timed_async(ticker: str, semaphore: asyncio.Semaphore):
+    async with semaphore:
+        start = time.perf_counter()
+        await load_async(ticker)
+        return time.perf_counter() - start
+
+
+async def run_sync(ticker: str, num_requests: int, concurrency: int):
+    # Requests are accepted by the event loop but each one waits for a free thread, like sync FastAPI handlers
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    with ThreadPoolExecutor(max_workers=STARLETTE_THREADPOOL_SIZE) as executor:
+        async def one_request():
+            async with semaphore:
+                return await loop.run_in_executor(executor, timed_sync, ticker)
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(one_request() for _ in range(num_requests)))
+        return time.perf_counter() - start, latencies
+
+
+async def run_async(ticker: str, num_requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(timed_async(ticker, semaphore) for _ in range(num_requests)))
+    return time.perf_counter() - start, latencies
+
+
+def report(name: str, elapsed: float, latencies: list):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:>6}: {len(latencies) / elapsed:8.1f} req/s | p50 {statistics.median(latencies) * 1000:7.1f} ms | p95 {p95 * 1000:7.1f} ms")
+
+
+async def main(ticker: str, num_requests: int, concurrency: int):
+    # Warm up both connection pools so pool creation isn't part of the measurement
+    load_sync(ticker)
+    await load_async(ticker)
+
+    report("sync", *await run_sync(ticker, num_requests, concurrency))
+    report("async", *await run_async(ticker, num_requests, concurrency))
+
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ticker", required=True)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.ticker, args.requests, args.concurrency))
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark: serialization and bytes-on-wire of a /retrieve-analysis payload
+
+Builds a synthetic payload for a well covered ticker (1,000 points with post data and criticisms,
+the same shape fetch_analysis returns) and compares:
+
+  - serialization time of FastAPI's default path (jsonable_encoder + json.dumps) vs orjson
+  - response size uncompressed, gzip (level 9, Starlette's default) and brotli (quality 4, as configured in main.py)
+  - compression time of gzip and brotli
+
+Usage:
+    python -m testing_scripts.benchmark_serialization --points 1000 --repeat 20
+"""
+
+import argparse
+import gzip
+import json
+import random
+import time
+from datetime import datetime, timedelta
+import brotli
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+WORDS = (
+    "revenue margin growth guidance shares buyback debt cash flow earnings quarter demand supply "
+    "pipeline approval launch competition valuation multiple insider dilution dividend segment"
+).split()
+
+
+def random_sentence(rng: random.Random, num_words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(num_words)).capitalize() + "."
+
+
+def build_payload(num_points: int, seed: int = 42) -> dict:
+    rng = random.Random(seed)
+    start_date = datetime(2024, 1, 1)
+
+    points = []
+    for i in range(num_points):
+        post_id = i // 5
+        points.append({
+            "content": random_sentence(rng, rng.randint(8, 20)),
+            "sentimentScore": rng.randint(1, 100),
+            "postUrl": f"https://www.reddit.com/r/stocks/comments/{post_id:06x}/some_long_post_title_slug/",
+            "postTitle": random_sentence(rng, rng.randint(5, 12)),
+            "postAuthor": f"user_{post_id}",
+            "postSource": rng.choice(["reddit", "seekingalpha"]),
+            "postDate": start_date + timedelta(days=post_id % 365),
+            "criticismExists": i % 3 == 0,
+            "criticisms": [
+                {
+                    "content": random_sentence(rng, rng.randint(6, 14)),
+                    "validityScore": rng.randint(1, 100),
+                    "commentUrl": f"https://www.reddit.com/r/stocks/comments/{post_id:06x}/slug/c{j}/",
+                }
+                for j in range(rng.randint(1, 3))
+            ] if i % 3 == 0 else [],
+        })
+
+    company = {
+        "ticker": "spry",
+        "title": "ARS Pharmaceuticals, Inc.",
+        "description": random_sentence(rng, 150),
+        "sentimentScore": 64,
+    }
+    return {"company": company, "points": points}
+
+
+def time_it(func, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main(num_points: int, repeat: int):
+    payload = build_payload(num_points)
+
+    default_time, default_body = time_it(
+        lambda: json.dumps(jsonable_encoder(payload), ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+        repeat
+    )
+    orjson_time, orjson_body = time_it(lambda: orjson.dumps(payload), repeat)
+
+    gzip_time, gzip_body = time_it(lambda: gzip.compress(orjson_body, compresslevel=9), repeat)
+    brotli_time, brotli_body = time_it(lambda: brotli.compress(orjson_body, quality=4, mode=brotli.MODE_TEXT), repeat)
+
+    print(f"Synthetic payload: {num_points} points, best of {repeat} runs\n")
+    print("Serialization")
+    print(f"  jsonable_encoder + json.dumps: {default_time * 1000:8.2f} ms")
+    print(f"  orjson.dumps:                  {orjson_time * 1000:8.2f} ms ({default_time / orjson_time:.1f}x faster)\n")
+    print("Bytes on wire")
+    print(f"  uncompressed: {len(default_body):>9,} B (json) / {len(orjson_body):>9,} B (orjson)")
+    print(f"  gzip 9:       {len(gzip_body):>9,} B ({len(gzip_body) / len(orjson_body):.1%}) in {gzip_time * 1000:.2f} ms")
+    print(f"  brotli 4:     {len(brotli_body):>9,} B ({len(brotli_body) / len(orjson_body):.1%}) in {brotli_time * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    main(args.points, args.repeat)
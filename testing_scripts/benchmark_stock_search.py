@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Benchmark: /stock-query latency of the old ILIKE query vs the KNN trigram query
+
+Samples queries the way users type them (prefixes of tickers and of title words, 1 to 5 characters)
+from data/sec_tickers.json and runs every query against the stock index database with:
+
+  - ilike:  the previous query, ILIKE '%q%' on ticker and title, similarity() on every match, then sort
+  - knn:    knn_search_statement, prefix btree lookup + % / <-> on the GiST trigram indexes
+  - memory: the in-process TickerSearchIndex (no database round trip), for reference
+
+Reports p50 / p95 latency per query length. The stock index database must have been deployed
+with deploy_stock_index_db.py (so the GiST and prefix indexes exist).
+
+Usage:
+    python -m testing_scripts.benchmark_stock_search --queries 500
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from collections import defaultdict
+from sqlalchemy import text
+from database.stocks_db import async_stockindex_session_scope, async_engine
+from routers.stock_query import knn_search_statement
+from routers.stock_search.search_index import TickerSearchIndex, load_stock_rows
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+JSON_DATA_PATH = os.path.join(BASE_DIR, "data", "sec_tickers.json")
+LIMIT = 10
+
+ILIKE_QUERY = text("""
+    SELECT ticker, title,
+        (CASE WHEN ticker ILIKE :q THEN 1.0 ELSE 0.0 END) +
+        similarity(ticker, :q) * 0.7 +
+        similarity(title, :q) * 0.3 AS relevance
+    FROM stocks
+    WHERE ticker ILIKE :pattern OR title ILIKE :pattern
+    ORDER BY relevance DESC
+    LIMIT :limit
+""")
+
+
+def sample_queries(num_queries: int, seed: int = 42) -> list:
+    with open(JSON_DATA_PATH, "r") as f:
+        records = list(json.load(f).values())
+
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(num_queries):
+        record = rng.choice(records)
+        if rng.random() < 0.5:
+            source = record["ticker"]
+        else:
+            source = rng.choice(record["title"].split() or [record["ticker"]])
+        queries.append(source[:rng.randint(1, 5)])
+    return queries
+
+
+async def time_ilike(session, q: str) -> float:
+    start = time.perf_counter()
+    (await session.execute(ILIKE_QUERY, {"q": q, "pattern": f"%{q}%", "limit": LIMIT})).all()
+    return time.perf_counter() - start
+
+
+async def time_knn(session, q: str) -> float:
+    start = time.perf_counter()
+    (await session.execute(knn_search_statement(q, LIMIT))).all()
+    return time.perf_counter() - start
+
+
+def report(name: str, latencies_by_length: dict):
+    print(name)
+    for length in sorted(latencies_by_length):
+        latencies = sorted(latencies_by_length[length])
+        p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)]
+        print(f"  {length} chars ({len(latencies):>4} queries): p50 {statistics.median(latencies) * 1000:7.2f} ms | p95 {p95 * 1000:7.2f} ms")
+
+
+async def main(num_queries: int):
+    queries = sample_queries(num_queries)
+    ilike_latencies, knn_latencies, memory_latencies = defaultdict(list), defaultdict(list), defaultdict(list)
+
+    async with async_stockindex_session_scope() as session:
+        # Warm up the connection and the buffer cache
+        for q in queries[:20]:
+            await time_ilike(session, q)
+            await time_knn(session, q)
+
+        for q in queries:
+            ilike_latencies[len(q)].append(await time_ilike(session, q))
+            knn_latencies[len(q)].append(await time_knn(session, q))
+
+    index = TickerSearchIndex(await load_stock_rows())
+    for q in queries:
+        start = time.perf_counter()
+        index.search(q, LIMIT)
+        memory_latencies[len(q)].append(time.perf_counter() - start)
+
+    report("ilike", ilike_latencies)
+    report("knn", knn_latencies)
+    report("memory", memory_latencies)
+
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.queries))
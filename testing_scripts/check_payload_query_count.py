@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Regression check: building the /retrieve-analysis payload must take the same number of queries
+no matter how many points a ticker has (no lazy loads per point, post, criticism or comment).
+
+Inserts a throwaway ticker with N points and one with 10N points (each point with criticisms
+linked to comments, spread over several posts), counts the statements sent while building the
+payload of each with a before_cursor_execute listener and asserts both counts are equal.
+Everything runs in one transaction that is rolled back, so the database is left as it was.
+
+Usage:
+    python -m testing_scripts.check_payload_query_count --points 20
+"""
+
+import argparse
+import uuid
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from database.db import engine
+from database.models.thesisai import Ticker, Post, Point, Criticism, Comment
+from routers.analysis.analysis_snapshot import build_analysis_snapshot
+
+POINTS_PER_POST = 5
+CRITICISMS_PER_POINT = 2
+
+
+def insert_ticker(session: Session, num_points: int) -> int:
+    ticker = Ticker(symbol=uuid.uuid4().hex[:10], name="Query count check")
+    session.add(ticker)
+    session.flush()
+
+    post = None
+    for index in range(num_points):
+        if index % POINTS_PER_POST == 0:
+            post = Post(ticker_id=ticker.id, source="reddit", title=f"Post {index}", link=f"https://example.com/{index}")
+            session.add(post)
+            session.flush()
+        point = Point(ticker_id=ticker.id, post_id=post.id, sentiment_score=50, text=f"Point {index}")
+        session.add(point)
+        session.flush()
+        for criticism_index in range(CRITICISMS_PER_POINT):
+            comment = Comment(post_id=post.id, content="Comment", link=f"https://example.com/{index}/{criticism_index}")
+            session.add(comment)
+            session.flush()
+            session.add(Criticism(point_id=point.id, comment_id=comment.id, text="Criticism", validity_score=50))
+    session.flush()
+    return ticker.id
+
+
+def count_payload_queries(connection, session: Session, ticker_id: int) -> int:
+    # Start from an empty identity map, otherwise objects left from inserting would hide lazy loads
+    session.expunge_all()
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(connection, "before_cursor_execute", count_statement)
+    try:
+        ticker_obj = session.get(Ticker, ticker_id)
+        build_analysis_snapshot(session, ticker_obj)
+    finally:
+        event.remove(connection, "before_cursor_execute", count_statement)
+    return len(statements)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=20, help="N, the smaller ticker's number of points")
+    args = parser.parse_args()
+
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        session = Session(bind=connection)
+        try:
+            small_ticker_id = insert_ticker(session, args.points)
+            large_ticker_id = insert_ticker(session, args.points * 10)
+
+            small_count = count_payload_queries(connection, session, small_ticker_id)
+            large_count = count_payload_queries(connection, session, large_ticker_id)
+        finally:
+            session.close()
+            transaction.rollback()
+
+    print(f"{args.points} points: {small_count} queries")
+    print(f"{args.points * 10} points: {large_count} queries")
+    assert small_count == large_count, "The number of queries grows with the number of points"
+    print("OK, the number of queries doesn't depend on the number of points")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from dotenv import load_dotenv
+
+"""
+Runs the analysis jobs queued by /generate-analysis.
+
+    python worker.py --processes 2 --concurrency 3
+
+starts 2 worker processes that each run up to 3 analyses at the same time. Workers can be started on
+any machine that reaches the Redis server and the database, so analysis throughput scales by adding
+processes or machines. SIGTERM / Ctrl+C lets running analyses finish before a worker exits.
+"""
+
+ENV_PATH = os.getenv("ENV_PATH")
+load_dotenv(ENV_PATH)
+
+DEFAULT_PROCESSES = int(os.getenv("ANALYSIS_WORKER_PROCESSES", 1))
+DEFAULT_CONCURRENCY = int(os.getenv("ANALYSIS_WORKER_CONCURRENCY", 2))
+DEFAULT_METRICS_PORT = int(os.getenv("ANALYSIS_WORKER_METRICS_PORT", 0))
+
+
+async def consume_jobs(worker_id: str, stopping: asyncio.Event):
+    from routers.analysis.job_queue import dequeue_job, acknowledge_job
+
+    while not stopping.is_set():
+        try:
+            dequeued = await dequeue_job(worker_id)
+        except Exception as e:
+            logging.warning(f"Worker {worker_id} could not read the job queue: {e}")
+            await asyncio.sleep(1)
+            continue
+        if dequeued is None:
+            continue
+
+        raw_job, job = dequeued
+        try:
+            await run_job(job)
+        except Exception as e:
+            # Keeps the consumer alive, e.g. if Redis failed while renewing or releasing the lease
+            logging.exception(f"Worker {worker_id} failed to run analysis {job['task_id']}: {e}")
+        try:
+            await acknowledge_job(worker_id, raw_job)
+        except Exception as e:
+            # The job stays in this worker's processing list, it only runs again if this worker crashes
+            logging.warning(f"Worker {worker_id} could not acknowledge analysis {job['task_id']}: {e}")
+
+
+async def keep_lock_alive(ticker: str, task_id: str):
+    from routers.analysis.analysis_lock import renew_analysis_lock, LOCK_RENEW_INTERVAL_SECONDS
+
+    while True:
+        await asyncio.sleep(LOCK_RENEW_INTERVAL_SECONDS)
+        if not await renew_analysis_lock(ticker, task_id):
+            logging.warning(f"Analysis {task_id} lost the lock on {ticker}")
+            return
+
+
+async def run_job(job: dict):
+    from routers.analysis.analysis_lock import renew_analysis_lock, release_analysis_lock
+    from routers.analysis.job_queue import mark_task_failed
+    from routers.analysis.run_analysis import start_analysis_process
+    from routers.analysis.ai.llm_limiter import set_llm_priority, INTERACTIVE
+
+    task_id, ticker = job["task_id"], job["params"]["ticker"]
+    # The lease may have expired while the job waited, e.g. if it was requeued, and been taken by a newer task since
+    if not await renew_analysis_lock(ticker, task_id):
+        logging.warning(f"Skipping analysis {task_id}, another analysis of {ticker} is running")
+        await mark_task_failed(task_id, "Another analysis of this ticker is already running. Please try again later.")
+        return
+
+    logging.info(f"Starting analysis {task_id} for {ticker}")
+    # Every consumer runs in its own context, so this only applies to this job's LLM requests
+    set_llm_priority(job.get("priority", INTERACTIVE))
+    renewal = asyncio.create_task(keep_lock_alive(ticker, task_id))
+    try:
+        # start_analysis_process reports its own failures on the task, so the job is done either way
+        await start_analysis_process(**job["params"], task_id=task_id)
+    finally:
+        renewal.cancel()
+        await release_analysis_lock(ticker, task_id)
+
+
+def send_heartbeats(worker_id: str, stopped: threading.Event):
+    """
+    Runs in a thread of its own, so analyses blocking the event loop for a while can't make the worker look
+    dead to the others (which would requeue its running jobs).
+    """
+    from routers.analysis.job_queue import send_heartbeat, HEARTBEAT_INTERVAL_SECONDS
+
+    while not stopped.wait(HEARTBEAT_INTERVAL_SECONDS):
+        try:
+            send_heartbeat(worker_id)
+        except Exception as e:
+            logging.warning(f"Worker {worker_id} could not send heartbeat: {e}")
+
+
+async def requeue_jobs_of_stopped_workers(worker_id: str, stopping: asyncio.Event):
+    from routers.analysis.job_queue import requeue_orphaned_jobs, HEARTBEAT_INTERVAL_SECONDS
+
+    while not stopping.is_set():
+        try:
+            # Workers look after each other, jobs of a crashed worker don't wait for a restart
+            requeued = await requeue_orphaned_jobs()
+            if requeued:
+                logging.warning(f"Requeued {requeued} analysis jobs of stopped workers")
+        except Exception as e:
+            logging.warning(f"Worker {worker_id} could not check for stopped workers: {e}")
+        try:
+            await asyncio.wait_for(stopping.wait(), timeout=HEARTBEAT_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_worker(concurrency: int):
+    # Imported here so the parent process doesn't load the analysis pipeline and its models
+    from routers.analysis.job_queue import new_worker_id, register_worker, unregister_worker
+
+    worker_id = new_worker_id()
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    await register_worker(worker_id)
+    heartbeats_stopped = threading.Event()
+    heartbeats = threading.Thread(target=send_heartbeats, args=(worker_id, heartbeats_stopped), daemon=True)
+    heartbeats.start()
+
+    print(f"Worker {worker_id} (pid {os.getpid()}) waiting for jobs, concurrency {concurrency}")
+    # Every consumer runs one analysis at a time, so the number of consumers is the concurrency
+    try:
+        await asyncio.gather(
+            requeue_jobs_of_stopped_workers(worker_id, stopping),
+            *(consume_jobs(worker_id, stopping) for _ in range(concurrency)),
+        )
+    finally:
+        heartbeats_stopped.set()
+
+    await unregister_worker(worker_id)
+    print(f"Worker {worker_id} stopped")
+
+
+def worker_process(concurrency: int, metrics_port: int = 0):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if metrics_port:
+        from prometheus_client import start_http_server
+        start_http_server(metrics_port)
+        print(f"Serving analysis metrics on port {metrics_port}")
+    asyncio.run(run_worker(concurrency))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs queued analysis jobs")
+    parser.add_argument("--processes", type=int, default=DEFAULT_PROCESSES, help="Number of worker processes")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Analyses run at the same time per process")
+    parser.add_argument(
+        "--metrics-port", type=int, default=DEFAULT_METRICS_PORT,
+        help="Serve Prometheus metrics from this port on, one port per process (0 disables it)"
+    )
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        worker_process(args.concurrency, args.metrics_port)
+    else:
+        processes = [
+            multiprocessing.Process(
+                target=worker_process,
+                args=(args.concurrency, args.metrics_port + index if args.metrics_port else 0),
+                daemon=False
+            )
+            for index in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+
+        # Ctrl+C reaches the children directly, on SIGTERM the parent passes it on. Either way it waits for them.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda *_: [process.terminate() for process in processes])
+        for process in processes:
+            process.join()